@@ -0,0 +1,206 @@
+"""Reports how the data layer of the app scales with the size of the data, on synthetic data at 1x, 10x
+and 100x today's size from benchmarks/synthetic_data.py.
+
+Each step runs in a fresh interpreter with the synthetic root as its working directory, so that the app's
+modules find the synthetic data at their usual ./data paths, and the peak memory reported is that of the
+step alone:
+
+    prep    data_prep.py builds the agent monthly counts, price sketches and analytics database
+    load    main.py loads the filter options, chart series, leaderboard and price sketches
+    filter  main.py filters and pages the transaction tables, the leaderboards and the percentiles
+    frame   the data chat reads the filtered frames and exports them for the worker pool
+
+Every run is appended to benchmarks/results/data_layer.jsonl with the commit it ran on, and compared with
+the latest result of another commit on the same machine. The synthetic data is kept in benchmarks/.data, so
+that every commit is measured on the same data. Run from the repository root:
+
+    python benchmarks/data_layer.py [scale ...]
+"""
+
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+results_path = f"{repository}/benchmarks/results/data_layer.jsonl"
+steps = ["prep", "load", "filter", "frame"]
+
+# repetitions of each filter query, whose median latency is reported
+repeats = 20
+
+
+def timed(timings, name, function, *args, repeat=1, **kwargs):
+    """This function runs the function, records its median duration in seconds and returns its result"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+    timings[name] = statistics.median(seconds)
+    return result
+
+
+def run_step(step):
+    """This function runs one step of the benchmark in the working directory, and returns the duration
+    of each of its operations"""
+    import data_prep
+    from helper_functions import analytics_db
+
+    timings = {}
+    if step == "prep":
+        # built from scratch, as after new data is ingested
+        for path in [data_prep.price_sketch_path, data_prep.analytics_db_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        timed(timings, "agent monthly counts", data_prep.CEAagentcounts)
+        timed(timings, "price sketches", data_prep.HDBresalesketches)
+        timed(timings, "analytics database", data_prep.analyticsdb)
+        return timings
+
+    options = {
+        field: tuple(analytics_db.distinct_values("resale_details", field))
+        for field in ["town", "month", "flat_type"]
+    }
+    towns = list(options["town"][:5])
+    all_filters = {field: list(values) for field, values in options.items()}
+    # five towns over the latest 12 months
+    filters = {**all_filters, "town": towns, "month": list(options["month"][-12:])}
+
+    if step == "load":
+        from helper_functions import chart_data
+        from helper_functions.leaderboard import LeaderboardIndex
+        from helper_functions.price_sketch import PriceSketchIndex, load_sketches
+
+        timed(
+            timings,
+            "filter options",
+            lambda: [analytics_db.distinct_values("resale_details", f) for f in options],
+        )
+        timed(
+            timings,
+            "chart series",
+            lambda: (
+                chart_data.downsample(analytics_db.select_rows("price_index"), "index", 600),
+                chart_data.median_price_series(analytics_db.select_rows("median_prices")),
+            ),
+        )
+        timed(timings, "leaderboard", lambda: LeaderboardIndex(analytics_db.select_rows("agent_counts")))
+        timed(timings, "price sketches", lambda: PriceSketchIndex(load_sketches(data_prep.price_sketch_path)))
+
+    elif step == "filter":
+        from helper_functions.leaderboard import LeaderboardIndex
+        from helper_functions.price_sketch import PriceSketchIndex, load_sketches
+
+        leaderboard = LeaderboardIndex(analytics_db.select_rows("agent_counts"))
+        sketches = PriceSketchIndex(load_sketches(data_prep.price_sketch_path))
+        def page(name, table, filters, **kwargs):
+            timed(timings, name, analytics_db.select_page, table, filters, page_size=25, repeat=repeats, **kwargs)
+
+        page("resale page, all filters", "resale_details", all_filters)
+        page("resale page, 5 towns", "resale_details", filters)
+        page("resale page, 5 towns by price", "resale_details", filters, sort_by="resale_price", ascending=False)
+        page("resale page, search", "resale_details", filters, search="AVE 3")
+        page("agent page, 5 towns", "agent_txn", {"town": towns})
+        timed(timings, "top agents, 5 towns", leaderboard.top_k, "agent", towns, repeat=repeats)
+        timed(timings, "price percentiles, 5 towns", sketches.quantiles, (0.25, 0.5, 0.75), towns=towns, repeat=repeats)
+
+    elif step == "frame":
+        from helper_functions import worker_pool
+
+        # frames in a fresh folder, so that the export is measured
+        worker_pool.shared_frame_directory = f"./data/shared_frames-{os.getpid()}"
+        resale_source = analytics_db.select_sql("resale_details", filters)
+        timed(timings, "resale frame, all filters", analytics_db.select_rows, "resale_details", all_filters)
+        timed(timings, "resale frame, 5 towns", analytics_db.read_sql, *resale_source)
+        timed(timings, "agent frame, 5 towns", analytics_db.select_rows, "agent_txn", {"town": towns})
+        timed(timings, "shared frame export", worker_pool.shared_frame, resale_source)
+        timed(timings, "shared frame rows, 5 towns", worker_pool.shared_frame, resale_source)
+    return timings
+
+
+def measure(scale, step):
+    """This function runs a step of the benchmark on the synthetic data at the scale in a fresh interpreter
+
+    Returns:
+        dict: duration of each operation of the step in seconds, and the peak memory of the step in MB
+    """
+    root = f"{repository}/benchmarks/.data/{scale}x"
+    if not os.path.exists(f"{root}/data"):
+        from synthetic_data import generate
+
+        print(f"Generating synthetic data at {scale}x")
+        generate(scale, root)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--step", step],
+        cwd=root,
+        env={**os.environ, "PYTHONPATH": repository},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def commit():
+    """This function returns the commit of the working tree, marked if it has changes"""
+    head = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=repository, capture_output=True, text=True
+    ).stdout.strip()
+    dirty = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=no"], cwd=repository, capture_output=True, text=True
+    ).stdout.strip()
+    return head + ("-dirty" if dirty else "")
+
+
+def previous_results(machine, current_commit):
+    """This function returns the latest result of each step of another commit on the same machine, with
+    the commit"""
+    previous = {}
+    if not os.path.exists(results_path):
+        return previous
+    with open(results_path) as file:
+        for line in file:
+            run = json.loads(line)
+            if run["machine"] == machine and run["commit"] != current_commit:
+                for key, result in run["results"].items():
+                    previous[key] = {**result, "commit": run["commit"]}
+    return previous
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--step"]:
+        timings = run_step(sys.argv[2])
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(json.dumps({"seconds": timings, "peak_mb": peak_mb}))
+        sys.exit()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    scales = [int(scale) for scale in sys.argv[1:]] or [1, 10, 100]
+    machine = f"{platform.node()} {platform.machine()} {os.cpu_count()} CPUs, Python {platform.python_version()}"
+    run = {"commit": commit(), "time": time.strftime("%Y-%m-%d %H:%M:%S"), "machine": machine, "results": {}}
+    previous = previous_results(machine, run["commit"])
+    print(f"commit {run['commit']} on {machine}")
+
+    for scale in scales:
+        for step in steps:
+            result = measure(scale, step)
+            run["results"][f"{scale}x {step}"] = result
+            before = previous.get(f"{scale}x {step}")
+            print(
+                f"\n{scale}x {step}, peak memory {result['peak_mb']:.0f} MB"
+                + (f", compared with commit {before['commit']}" if before is not None else "")
+            )
+            for name, seconds in result["seconds"].items():
+                line = f"  {name:<32}{seconds * 1000:>12.1f} ms"
+                if before is not None and name in before["seconds"]:
+                    line += f"{(seconds / before['seconds'][name] - 1) * 100:>+10.0f}%"
+                print(line)
+
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "a") as file:
+        file.write(json.dumps(run) + "\n")
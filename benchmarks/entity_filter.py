@@ -0,0 +1,68 @@
+"""Reports what the entity pre-filter does for a set of targeted data chat questions, with every town, month
+and flat type selected: the narrowing it applies, how long extraction takes, and the rows and load time of
+the frame handed to the data chat with and without it. Run from the repository root:
+
+    python benchmarks/entity_filter.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper_functions import analytics_db  # noqa: E402
+from logics import entity_filter  # noqa: E402
+
+questions = {
+    "resale_details": [
+        "What is the average price of 4 room flats in Bishan since March?",
+        "How many executive flats were sold in Tampines and Bedok in Q2 2024?",
+        "What is the median resale price of a Model A flat in Punggol over the past 6 months?",
+        "How many 3-room flats were sold in Kallang from Jan to Jun 2024?",
+        "How do prices in Bishan compare with other towns?",
+        "Which towns are cheaper than Bishan for 4 room flats?",
+        "What is the average price of each flat type in Bishan?",
+    ],
+    "agent_txn": [
+        "How many flats did agents of PropNex Realty sell in Sengkang since August?",
+        "How many transactions did ERA Realty Network close in Woodlands in the last 3 months?",
+        "Who are the top 3 agents in Tampines?",
+    ],
+}
+
+
+def load_seconds(table, filters, repeat=5):
+    """This function returns the median seconds to load the frame of the filtered rows, and its rows"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = analytics_db.select_rows(table, filters)
+        seconds.append(time.perf_counter() - start)
+    return sorted(seconds)[len(seconds) // 2], len(df)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    entity_filter.build_extractors()
+    print(f"extractors built in {(time.perf_counter() - start) * 1000:.0f} ms\n")
+
+    all_filters = {
+        "resale_details": {
+            field: analytics_db.distinct_values("resale_details", field) for field in ["town", "month", "flat_type"]
+        },
+        "agent_txn": {"town": analytics_db.distinct_values("agent_txn", "town")},
+    }
+    for table, table_questions in questions.items():
+        full_seconds, full_rows = load_seconds(table, all_filters[table])
+        for question in table_questions:
+            start = time.perf_counter()
+            filters, narrowing = entity_filter.narrow_filters(question, table, all_filters[table])
+            extraction = time.perf_counter() - start
+            seconds, rows = load_seconds(table, filters)
+            print(question)
+            print(f"  {narrowing}")
+            print(
+                f"  extraction {extraction * 1000:.1f} ms, frame {full_rows} -> {rows} rows, "
+                f"load {full_seconds * 1000:.0f} -> {seconds * 1000:.0f} ms\n"
+            )
@@ -0,0 +1,83 @@
+"""Reports the import cost of each app module and of the heavy dependencies that the app defers.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, so the reported time
+is its cold import cost, including everything it pulls in. Run from the repository root:
+
+    python benchmarks/import_time.py [module ...]
+"""
+
+import os
+import subprocess
+import sys
+
+# app modules, followed by the heavy dependencies they import on first use
+modules = [
+    "helper_functions.warmup",
+    "helper_functions.utility",
+    "helper_functions.llm",
+    "helper_functions.memory_store",
+    "helper_functions.analytics_db",
+    "helper_functions.chart_data",
+    "logics.renochat",
+    "logics.plan_executor",
+    "logics.agent",
+    "logics.rag_retrieval",
+    "logics.numpy_retriever",
+    "streamlit",
+    "pandas",
+    "openai",
+    "tiktoken",
+    "langchain_openai",
+    "langchain_experimental.agents.agent_toolkits",
+    "langchain_chroma",
+    "langchain_cohere",
+    "langchain.retrievers.document_compressors",
+]
+
+
+def import_time(module, top=5):
+    """This function imports the module in a fresh interpreter and parses the -X importtime report.
+
+    Args:
+        module (str): name of module
+        top (int, optional): number of heaviest packages to report. Defaults to 5.
+
+    Returns:
+        tuple: cumulative import time of the module in seconds (None if the import failed), and list of
+        (package, cumulative seconds) for the heaviest top-level packages it pulled in
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if result.returncode != 0:
+        return None, []
+    total = None
+    packages = {}
+    for line in result.stderr.splitlines():
+        # lines look like "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:") :].split("|")
+        name = package.strip()
+        seconds = int(cumulative) / 1e6
+        if name == module:
+            total = seconds
+        elif "." not in name and not name.startswith("_"):
+            packages[name] = max(packages.get(name, 0), seconds)
+    heaviest = sorted(packages.items(), key=lambda x: -x[1])
+    return total, heaviest[:top]
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or modules
+    print(f"{'module':<50}{'import (s)':>12}   heaviest imports")
+    for module in selected:
+        total, heaviest = import_time(module)
+        if total is None:
+            print(f"{module:<50}{'failed':>12}")
+            continue
+        top = ", ".join(f"{name} {seconds:.2f}" for name, seconds in heaviest)
+        print(f"{module:<50}{total:>12.3f}   {top}")
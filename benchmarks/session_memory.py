@@ -0,0 +1,103 @@
+"""Reports how the resident memory of the server process grows with the number of sessions.
+
+Each simulated session runs the data path of a rerun of main.py outside Streamlit: it gets the filter
+options, chart series, leaderboard and price sketches, loads a page of each transaction table, computes
+the leaderboards and percentiles, and keeps what a session keeps between reruns. In "shared" mode the
+datasets are shared by all sessions, as with st.cache_resource. In "copied" mode every session gets its
+own deserialised copy of the full datasets, as st.cache_data gave each session before, for comparison.
+Run from the repository root:
+
+    python benchmarks/session_memory.py [shared|copied] [max sessions]
+"""
+
+import gc
+import os
+import pickle
+import sys
+
+import pandas as pd
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_prep  # noqa: E402
+from helper_functions import analytics_db, chart_data  # noqa: E402
+from helper_functions.leaderboard import LeaderboardIndex  # noqa: E402
+from helper_functions.price_sketch import PriceSketchIndex, load_sketches  # noqa: E402
+
+pd.set_option("mode.copy_on_write", True)
+
+checkpoints = [1, 10, 25, 50, 100, 200]
+
+
+def rss_mb():
+    """This function returns the resident memory of this process in MB"""
+    gc.collect()
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def load_shared():
+    """This function loads the datasets that main.py loads once per process"""
+    if not os.path.exists(data_prep.price_sketch_path):
+        data_prep.HDBresalesketches()
+    return {
+        "filter_options": {
+            field: tuple(analytics_db.distinct_values("resale_details", field))
+            for field in ["town", "month", "flat_type"]
+        },
+        "median_series": chart_data.median_price_series(analytics_db.select_rows("median_prices")),
+        "leaderboard": LeaderboardIndex(analytics_db.select_rows("agent_counts")),
+        "price_sketches": PriceSketchIndex(load_sketches(data_prep.price_sketch_path)),
+    }
+
+
+def load_full_frames():
+    """This function loads the full transaction tables, as load_data returned them before"""
+    return {
+        "df3": analytics_db.select_rows("resale_details"),
+        "df4": analytics_db.select_rows("agent_txn"),
+    }
+
+
+def session_rerun(datasets):
+    """This function runs the data path of one rerun of main.py and returns what the session keeps"""
+    options = datasets["filter_options"]
+    towns = list(options["town"][:5])
+    filters = {"town": towns, "month": list(options["month"]), "flat_type": list(options["flat_type"])}
+    page3, _ = analytics_db.select_page("resale_details", filters, page_size=25)
+    page4, _ = analytics_db.select_page("agent_txn", {"town": towns}, page_size=25)
+    leaderboard = datasets["leaderboard"]
+    return {
+        "df3_filters": filters,
+        "page3": page3,
+        "page4": page4,
+        "median_prices": datasets["median_series"]["Location"][towns[0]],
+        "top_agents": leaderboard.top_k("agent", towns),
+        "top_agencies": leaderboard.top_k("agency", towns),
+        "percentiles": datasets["price_sketches"].quantiles((0.25, 0.5, 0.75), towns=towns),
+    }
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "shared"
+    max_sessions = int(sys.argv[2]) if len(sys.argv) > 2 else checkpoints[-1]
+    shared = load_shared()
+    if mode == "copied":
+        shared.update(load_full_frames())
+        serialised = pickle.dumps(shared)
+    # warm up the database connection and imports before the baseline
+    session_rerun(shared)
+    baseline = rss_mb()
+    print(f"mode: {mode}, baseline RSS {baseline:.1f} MB")
+    print(f"{'sessions':>10}{'RSS (MB)':>12}{'growth (MB)':>14}{'per session (KB)':>18}")
+
+    sessions = []
+    for n in range(1, max_sessions + 1):
+        datasets = pickle.loads(serialised) if mode == "copied" else shared
+        state = session_rerun(datasets)
+        if mode == "copied":
+            state["datasets"] = datasets
+        sessions.append(state)
+        if n in checkpoints or n == max_sessions:
+            growth = rss_mb() - baseline
+            print(f"{n:>10}{baseline + growth:>12.1f}{growth:>14.1f}{growth * 1024 / n:>18.1f}")
@@ -0,0 +1,97 @@
+"""Generates synthetic HDB resale and CEA agent transaction data at a multiple of today's size.
+
+The synthetic datasets are the engineered csv files that data_prep.py builds, written to the data folder
+of a separate root, so that the app's data layer can be run on them unchanged from that root. Rows are
+drawn with replacement from the real engineered rows, so that the mix of towns, flat types, flat models,
+floor areas, agents and agencies, and how they go together, is that of the real data. The real 12 months
+are widened to a longer history, up to 30 years, with resale prices adjusted by the HDB resale price index
+of each quarter and a small random variation. The price index and median prices are copied unchanged.
+The data depends only on the scale and the seed. Run from the repository root:
+
+    python benchmarks/synthetic_data.py [scale] [root]
+"""
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# engineered csv files in data folder
+price_index_file = "1_HDBResalePriceIndex2009_2024.csv"
+median_prices_file = "2_HDBMedianResalePrices2020_2024.csv"
+resale_details_file = "3_HDBResalePricesDetailsOct23_Oct24.csv"
+agent_txn_file = "4_CEAAgentTransactionsSep23-Sep24.csv"
+
+# longest history generated, in months
+max_months = 360
+
+
+def history(last_month, scale):
+    """This function returns the months of the synthetic history, oldest first, ending in the last real
+    month. The history is scale times the real 12 months, up to max_months."""
+    end = pd.Period(last_month, freq="M")
+    n_months = min(12 * scale, max_months)
+    return [str(end - i) for i in range(n_months - 1, -1, -1)]
+
+
+def price_factors(months, price_index):
+    """This function returns, for each month, the resale price index of its quarter relative to the
+    latest quarter, using the earliest quarter for months before the index starts"""
+    index = price_index.set_index("quarter")["index"]
+    quarters = [f"{month[:4]}-Q{(int(month[5:]) - 1) // 3 + 1}" for month in months]
+    values = index.reindex(quarters).bfill().ffill()
+    return dict(zip(months, values.to_numpy() / index.iloc[-1]))
+
+
+def generate(scale, root, seed=0, source=f"{repository}/data"):
+    """This function writes synthetic engineered csv files at scale times the size of the real ones to
+    the data folder of root, a month at a time.
+
+    Args:
+        scale (int): multiple of the real number of rows
+        root (str): folder to write the data folder in
+        seed (int, optional): seed of the random draws. Defaults to 0.
+        source (str, optional): folder with the real engineered csv files. Defaults to the repository's data folder.
+    """
+    rng = np.random.default_rng(seed)
+    directory = f"{root}/data"
+    os.makedirs(directory, exist_ok=True)
+    for file in [price_index_file, median_prices_file]:
+        shutil.copyfile(f"{source}/{file}", f"{directory}/{file}")
+
+    # Step 1: HDB resale details
+    resale = pd.read_csv(f"{source}/{resale_details_file}", dtype={"block": str})
+    months = history(resale["month"].max(), scale)
+    factors = price_factors(months, pd.read_csv(f"{source}/{price_index_file}"))
+    rows_per_month = len(resale) * scale // len(months)
+    with open(f"{directory}/{resale_details_file}.tmp", "w") as sink:
+        for n, month in enumerate(months):
+            df = resale.iloc[rng.integers(0, len(resale), rows_per_month)].copy()
+            df["month"] = month
+            variation = rng.lognormal(0, 0.03, rows_per_month)
+            df["resale_price"] = (df["resale_price"] * factors[month] * variation).round(-3)
+            # a flat cannot be sold before its lease commenced
+            df["lease_commence_date"] = np.minimum(df["lease_commence_date"], int(month[:4]))
+            df.to_csv(sink, header=n == 0, index=False)
+    os.replace(f"{directory}/{resale_details_file}.tmp", f"{directory}/{resale_details_file}")
+
+    # Step 2: CEA agent transactions
+    agent_txn = pd.read_csv(f"{source}/{agent_txn_file}")
+    rows_per_month = len(agent_txn) * scale // len(months)
+    with open(f"{directory}/{agent_txn_file}.tmp", "w") as sink:
+        for n, month in enumerate(months):
+            df = agent_txn.iloc[rng.integers(0, len(agent_txn), rows_per_month)].copy()
+            df["resale_transaction_date"] = f"{month}-01"
+            df.to_csv(sink, header=n == 0, index=False)
+    os.replace(f"{directory}/{agent_txn_file}.tmp", f"{directory}/{agent_txn_file}")
+
+
+if __name__ == "__main__":
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    root = sys.argv[2] if len(sys.argv) > 2 else f"{repository}/benchmarks/.data/{scale}x"
+    generate(scale, root)
+    print(f"Synthetic data at {scale}x written to {root}/data")
@@ -0,0 +1,93 @@
+"""Reports the memory, scan time and recall@k of each first-pass configuration of the NumPy vector store.
+
+Exact float32 search is the reference. For every configuration, recall@k is the share of the exact top k
+chunks that the store returns after its quantized first pass and exact rescoring of the shortlist of
+rescore_k chunks. The exported chunk vectors in data/rag_vectors are scaled up to the requested number
+of chunks by mixing pairs of them with noise of the same spread per dimension, and the queries are made
+the same way, so that the corpus keeps the structure of real embeddings. Run from the repository root:
+
+    python benchmarks/vector_recall.py [chunks] [queries]
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logics.numpy_retriever import NumpyVectorStore, vector_directory  # noqa: E402
+
+# (precision, dimensions) of the first pass
+configurations = [
+    ("float32", None),
+    ("float16", None),
+    ("int8", None),
+    ("float32", 512),
+    ("int8", 512),
+    ("int8", 256),
+]
+ks = [4, 20]
+rescore_ks = [100, 1000]
+
+
+def synthetic_vectors(base, n, rng):
+    """This function returns n unit-length vectors, each a random mix of two base vectors plus noise"""
+    pairs = rng.integers(0, len(base), size=(n, 2))
+    weights = rng.uniform(0, 1, size=(n, 1)).astype(np.float32)
+    vectors = weights * base[pairs[:, 0]] + (1 - weights) * base[pairs[:, 1]]
+    vectors += rng.normal(0, 0.3 * base.std(axis=0), size=vectors.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(scores, k):
+    """This function returns the positions of the k highest scores in each row, as sets"""
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+if __name__ == "__main__":
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = np.random.default_rng(0)
+    base = np.load(f"{vector_directory}/vectors.npy")
+
+    with tempfile.TemporaryDirectory() as directory:
+        np.save(f"{directory}/vectors.npy", synthetic_vectors(base, n_chunks, rng))
+        with open(f"{directory}/chunks.json", "w") as file:
+            file.write("[]")
+        queries = synthetic_vectors(base, n_queries, rng)
+        exact = NumpyVectorStore(directory).scores(queries)
+        reference = {k: top_k(exact, k) for k in ks}
+
+        print(f"{n_chunks} chunks of {base.shape[1]} dimensions, {n_queries} queries")
+        header = f"{'first pass':>16}{'rescore_k':>11}{'memory (MB)':>13}{'ms/query':>10}{'ms/batch of 8':>15}"
+        print(header + "".join(f"{f'recall@{k}':>11}" for k in ks))
+        for (precision, dimensions), rescore_k in itertools.product(configurations, rescore_ks):
+            if precision == "float32" and dimensions is None and rescore_k != rescore_ks[0]:
+                continue
+            store = NumpyVectorStore(directory, precision, dimensions, rescore_k)
+            index = store.vectors if store.index is None else store.index
+            memory = index.nbytes / 2**20
+
+            start = time.perf_counter()
+            for query in queries[:20]:
+                store.scores([query])
+            single = (time.perf_counter() - start) / 20 * 1000
+            start = time.perf_counter()
+            for i in range(0, 80, 8):
+                store.scores(queries[i : i + 8])
+            batch = (time.perf_counter() - start) / 10 * 1000
+
+            scores = np.concatenate([store.scores([query]) for query in queries])
+            recalls = [
+                np.mean([len(a & b) / k for a, b in zip(top_k(scores, k), reference[k])]) for k in ks
+            ]
+            name = f"{precision}/{dimensions or base.shape[1]}"
+            print(
+                f"{name:>16}{rescore_k:>11}{memory:>13.1f}{single:>10.1f}{batch:>15.1f}"
+                + "".join(f"{recall:>11.3f}" for recall in recalls)
+            )
@@ -0,0 +1,251 @@
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pandas as pd
+
+import data_prep
+
+# datastore API of data.gov.sg. Set the environment variable DATASTORE_URL to ingest from another
+# server, e.g. the local stand-in in datastore_standin.py
+datastore_url = os.environ.get("DATASTORE_URL", "https://data.gov.sg/api/action/datastore_search")
+
+# values that read_csv takes as missing by default
+missing_values = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null", None,
+]
+
+# records ingested into each engineered csv file so far, so that a rerun fetches only new records
+checkpoint_path = "./data/ingest_checkpoint.json"
+
+# resource of the CEA Agent Info, which is fetched in full on every run since its records are updated in place
+agent_info_resource = ("d_07c63be0f37e6e59c07a4ddc2fd87fcb", "./raw_data/CEASalespersonInformation.csv")
+
+# resource of each dataset, and the engineered csv file in data folder that its records are streamed into
+datasets = {
+    "price_index": ("d_14f63e595975691e7c24a27ae4c07c79", "1_HDBResalePriceIndex2009_2024.csv"),
+    "median_prices": ("d_b51323a474ba789fb4cc3db58a3116d4", "2_HDBMedianResalePrices2020_2024.csv"),
+    "resale_details": ("d_8b84c4ee58e3cfc0ece0d773c8ca6abc", "3_HDBResalePricesDetailsOct23_Oct24.csv"),
+    "agent_txn": ("d_ee7e46d3c57f7865790704632b0aef71", "4_CEAAgentTransactionsSep23-Sep24.csv"),
+}
+
+
+def fetch_page(client, resource_id, offset, limit, retries=5):
+    """This function fetches one page of records of a resource from the datastore API, retrying with
+    exponential backoff when the API is rate limited, unavailable or unreachable.
+
+    Args:
+        client (httpx.Client): HTTP client
+        resource_id (str): resource to fetch
+        offset (int): position of the first record of the page
+        limit (int): number of records in the page
+        retries (int, optional): number of retries. Defaults to 5.
+
+    Returns:
+        dict: result of the request, with the records, their fields and the total number of records
+    """
+    params = {"resource_id": resource_id, "offset": offset, "limit": limit}
+    for attempt in range(retries + 1):
+        try:
+            response = client.get(datastore_url, params=params)
+            if response.status_code not in (429, 500, 502, 503, 504):
+                response.raise_for_status()
+                return response.json()["result"]
+            # the API says when to retry a rate limited request
+            delay = float(response.headers.get("Retry-After", 2**attempt))
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            delay = 2**attempt
+        if attempt == retries:
+            response.raise_for_status()
+        time.sleep(delay)
+
+
+def stream_pages(client, resource_id, offset=0, page_size=1000, concurrency=4):
+    """This function fetches the records of a resource from the offset onwards, a page at a time. Up to
+    concurrency pages are fetched at once, and the pages are returned in order as they become available,
+    so that no more than concurrency pages are held in memory.
+
+    Args:
+        client (httpx.Client): HTTP client
+        resource_id (str): resource to fetch
+        offset (int, optional): position of the first record to fetch. Defaults to 0.
+        page_size (int, optional): number of records in each page. Defaults to 1000.
+        concurrency (int, optional): number of pages fetched at once. Defaults to 4.
+
+    Yields:
+        tuple: position of the first record of the page, and the result of its request
+    """
+    first = fetch_page(client, resource_id, offset, page_size)
+    yield offset, first
+    offsets = iter(range(offset + page_size, first["total"], page_size))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = collections.deque()
+        for page_offset in offsets:
+            pending.append(
+                (page_offset, executor.submit(fetch_page, client, resource_id, page_offset, page_size))
+            )
+            if len(pending) == concurrency:
+                break
+        while len(pending) > 0:
+            page_offset, future = pending.popleft()
+            page = future.result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(
+                    (next_offset, executor.submit(fetch_page, client, resource_id, next_offset, page_size))
+                )
+            yield page_offset, page
+
+
+def records_frame(page):
+    """This function returns the records of a page as a DataFrame, with the fields in the order the API
+    gives them. The API gives every value as text, so the values that read_csv takes as missing are
+    made missing and the fields holding only numbers are made numeric, for the same types and missing
+    values as when the csv file of the resource is read in."""
+    columns = [field["id"] for field in page["fields"] if field["id"] != "_id"]
+    df = pd.DataFrame.from_records(page["records"], columns=columns)
+    for column in columns:
+        values = df[column].where(~df[column].isin(missing_values))
+        try:
+            df[column] = pd.to_numeric(values)
+        except (ValueError, TypeError):
+            df[column] = values
+    return df
+
+
+def _load_checkpoint(path):
+    """This function returns the stored checkpoint, or an empty one if there is none"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _save_checkpoint(checkpoint, path):
+    """This function stores the checkpoint, replacing the previous one only once written"""
+    with open(path + ".tmp", "w") as file:
+        json.dump(checkpoint, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def ingest(client, name, prepare, page_size=1000, concurrency=4, path=checkpoint_path):
+    """This function streams the records of a dataset that are not in its engineered csv file yet from the
+    datastore API, engineers them a page at a time and appends them to the file. The number of records
+    ingested and the size of the file are checkpointed after every page, so that an interrupted run
+    resumes where it stopped, dropping any partly written page, and a rerun fetches only new records. The
+    file is rebuilt from the first record if it has no checkpoint or the resource has fewer records than
+    were ingested.
+
+    Args:
+        client (httpx.Client): HTTP client
+        name (str): name of the dataset in datasets
+        prepare (function): function that engineers a DataFrame of records
+        page_size (int, optional): number of records in each page. Defaults to 1000.
+        concurrency (int, optional): number of pages fetched at once. Defaults to 4.
+        path (str, optional): location of the checkpoint. Defaults to "./data/ingest_checkpoint.json".
+
+    Returns:
+        tuple: number of records appended to the file, and the months they fall in, for updating the
+        datasets derived from it
+    """
+    resource_id, file = datasets[name]
+    filepath = f"{data_prep.directory}/{file}"
+    checkpoint = _load_checkpoint(path)
+    state = checkpoint.get(name)
+    if (
+        state is None
+        or state["resource_id"] != resource_id
+        or not os.path.exists(filepath)
+        # the resource was republished with fewer records, so every record is ingested again
+        or fetch_page(client, resource_id, 0, 1)["total"] < state["offset"]
+    ):
+        state = {"resource_id": resource_id, "offset": 0, "size": 0}
+    # only what the derived datasets need is kept of each page, rather than the records themselves
+    rows, months = 0, set()
+    with open(filepath, "a+") as sink:
+        # a page written after the last checkpoint is dropped, and fetched again
+        sink.truncate(state["size"])
+        sink.seek(state["size"])
+        for page_offset, page in stream_pages(
+            client, resource_id, state["offset"], page_size, concurrency
+        ):
+            df = prepare(records_frame(page))
+            df.to_csv(sink, header=sink.tell() == 0, index=False)
+            sink.flush()
+            os.fsync(sink.fileno())
+            rows += len(df)
+            if "month" in df.columns:
+                months.update(df["month"].unique())
+            state = {
+                "resource_id": resource_id,
+                "offset": page_offset + len(page["records"]),
+                "size": sink.tell(),
+            }
+            checkpoint[name] = state
+            _save_checkpoint(checkpoint, path)
+            print(f"{name}: {state['offset']}/{page['total']} records")
+    return rows, sorted(months)
+
+
+def refresh_agent_info(client, page_size=1000, concurrency=4):
+    """This function fetches every record of the CEA Agent Info from the datastore API and streams them into
+    the raw csv file, replacing the previous one once complete.
+
+    Args:
+        client (httpx.Client): HTTP client
+        page_size (int, optional): number of records in each page. Defaults to 1000.
+        concurrency (int, optional): number of pages fetched at once. Defaults to 4.
+    """
+    resource_id, filepath = agent_info_resource
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath + ".tmp", "w") as sink:
+        for page_offset, page in stream_pages(client, resource_id, 0, page_size, concurrency):
+            records_frame(page).to_csv(sink, header=page_offset == 0, index=False)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def ingest_all(names=tuple(datasets), page_size=1000, concurrency=4):
+    """This function ingests the new records of every dataset from the datastore API, then updates the
+    datasets derived from them: the agent monthly counts, the price sketches of the months that received
+    records, and the analytics database.
+
+    Args:
+        names (tuple, optional): names of the datasets to ingest. Defaults to every dataset.
+        page_size (int, optional): number of records in each page. Defaults to 1000.
+        concurrency (int, optional): number of pages fetched at once. Defaults to 4.
+    """
+    preparers = {
+        "price_index": data_prep.prepare_resale_index,
+        "median_prices": data_prep.prepare_resale_median,
+        "resale_details": data_prep.prepare_resale_details,
+    }
+    # the API key raises the rate limit, and is optional
+    headers = {"x-api-key": os.environ["DATA_GOV_SG_API_KEY"]} if "DATA_GOV_SG_API_KEY" in os.environ else {}
+    with httpx.Client(headers=headers, timeout=60) as client:
+        if "agent_txn" in names:
+            refresh_agent_info(client, page_size, concurrency)
+            agentinfo = pd.read_csv(agent_info_resource[1])
+            preparers["agent_txn"] = lambda df: data_prep.prepare_agent_txn(df, agentinfo)
+        appended = {
+            name: ingest(client, name, preparers[name], page_size, concurrency) for name in names
+        }
+
+    if "agent_txn" in appended and appended["agent_txn"][0] > 0:
+        data_prep.CEAagentcounts()
+    if "resale_details" in appended and appended["resale_details"][0] > 0:
+        data_prep.HDBresalesketches(months=appended["resale_details"][1])
+    if any(rows > 0 for rows, _ in appended.values()):
+        data_prep.analyticsdb()
+
+
+if __name__ == "__main__":
+    # Run from the repository root, optionally naming the datasets to ingest:
+    # python data_ingest.py [price_index median_prices resale_details agent_txn]
+    ingest_all(tuple(sys.argv[1:]) or tuple(datasets))
@@ -1,8 +1,28 @@
 import os
+import sqlite3
 import pandas as pd
 
 directory = "./data"
 
+# quantile sketches of resale prices by town, flat type and month, built from the engineered resale details
+price_sketch_path = "./data/resale_price_sketches.json"
+
+# embedded analytics database built from the engineered csv files, with the indexes to create on each table
+analytics_db_path = "./data/resale_analytics.sqlite3"
+analytics_tables = {
+    "price_index": ("1_HDBResalePriceIndex2009_2024.csv", ["quarter"]),
+    "median_prices": ("2_HDBMedianResalePrices2020_2024.csv", ["quarter", "town"]),
+    "resale_details": (
+        "3_HDBResalePricesDetailsOct23_Oct24.csv",
+        ["month", "town", "flat_type", "town, month, flat_type"],
+    ),
+    "agent_txn": (
+        "4_CEAAgentTransactionsSep23-Sep24.csv",
+        ["resale_transaction_date", "town", "sales_agent_reg_num"],
+    ),
+    "agent_counts": ("5_CEAAgentMonthlyCountsSep23-Sep24.csv", ["town, month"]),
+}
+
 
 def HDBresaleindex(filepath="./raw_data/HDBResalePriceIndex1Q2009100Quarterly.csv"):
     """This function reads in the raw HDB resale price index csv file downloaded from
@@ -14,11 +34,22 @@ def HDBresaleindex(filepath="./raw_data/HDBResalePriceIndex1Q2009100Quarterly.cs
         Defaults to "./raw_data/HDBResalePriceIndex1Q2009100Quarterly.csv".
     """
     df = pd.read_csv(filepath)
+    prepare_resale_index(df).to_csv("./data/1_HDBResalePriceIndex2009_2024.csv", index=False)
+
+
+def prepare_resale_index(df):
+    """This function makes the adjustments to raw HDB resale price index records, e.g. a full csv file
+    or a page of records streamed from the datastore API, and returns the engineered records.
+
+    Args:
+        df (pd.DataFrame): raw records
+
+    Returns:
+        pd.DataFrame: engineered records
+    """
     # subsets to data starting from 2004-Q1, to provide data points for the past 20 years
     df_new = df[df["quarter"] > "2004"].reset_index()
-    df_new[["quarter", "index"]].to_csv(
-        "./data/1_HDBResalePriceIndex2009_2024.csv", index=False
-    )
+    return df_new[["quarter", "index"]]
 
 
 def HDBresalemedian(
@@ -32,13 +63,24 @@ def HDBresalemedian(
         filepath (str, optional): _description_. Defaults to "./raw_data/MedianResalePricesforRegisteredApplicationsbyTownandFlatType.csv".
     """
     df = pd.read_csv(filepath)
+    prepare_resale_median(df).to_csv("./data/2_HDBMedianResalePrices2020_2024.csv", index=False)
+
+
+def prepare_resale_median(df):
+    """This function makes the adjustments to raw HDB median resale price records, e.g. a full csv file
+    or a page of records streamed from the datastore API, and returns the engineered records.
+
+    Args:
+        df (pd.DataFrame): raw records
+
+    Returns:
+        pd.DataFrame: engineered records
+    """
     # subsets to data starting from 2020-Q1, to provide data points for the past 5 years
     df_new = df[df["quarter"] > "2020"].reset_index()
     # replaces 'na' and '-' values in the price field with None
     df_new["price"] = df_new["price"].replace({"na": None, "-": None})
-    df_new[["quarter", "town", "flat_type", "price"]].to_csv(
-        "./data/2_HDBMedianResalePrices2020_2024.csv", index=False
-    )
+    return df_new[["quarter", "town", "flat_type", "price"]]
 
 
 def HDBresaledetails(
@@ -52,10 +94,27 @@ def HDBresaledetails(
         filepath (str, optional): _description_. Defaults to "./raw_data/ResaleflatpricesbasedonregistrationdatefromJan2017onwards.csv".
     """
     df = pd.read_csv(filepath)
+    prepare_resale_details(df).to_csv("./data/3_HDBResalePricesDetailsOct23_Oct24.csv", index=False)
+    # Rebuild the price sketches of every month, since stored months may have received more records
+    if os.path.exists(price_sketch_path):
+        os.remove(price_sketch_path)
+    HDBresalesketches()
+
+
+def prepare_resale_details(df):
+    """This function makes the adjustments to raw HDB resale price details records, e.g. a full csv file
+    or a page of records streamed from the datastore API, and returns the engineered records.
+
+    Args:
+        df (pd.DataFrame): raw records
+
+    Returns:
+        pd.DataFrame: engineered records
+    """
     # subsets to data starting from Oct 2023 to provide data points for the past 12 months
     # Also removes redundant field - remaining_lease
     df_new = df[df["month"] > "2023-09"].drop("remaining_lease", axis=1).reset_index()
-    df_new[
+    return df_new[
         [
             "month",
             "town",
@@ -68,7 +127,43 @@ def HDBresaledetails(
             "storey_range",
             "lease_commence_date",
         ]
-    ].to_csv("./data/3_HDBResalePricesDetailsOct23_Oct24.csv", index=False)
+    ]
+
+
+def HDBresalesketches(
+    filepath="./data/3_HDBResalePricesDetailsOct23_Oct24.csv",
+    sketchpath=price_sketch_path,
+    k=200,
+    months=(),
+):
+    """This function reads in the engineered HDB resale price details, builds a mergeable quantile sketch
+    of the resale prices for every town, flat type and month, and stores the sketches as JSON in data folder.
+    If sketches have been stored before, only months that are not in them yet are added, so that new
+    months of data can be added incrementally. Months that were stored before but have since received more
+    records can be given to have them rebuilt.
+
+    Args:
+        filepath (str, optional): location where engineered file is stored.
+        Defaults to "./data/3_HDBResalePricesDetailsOct23_Oct24.csv".
+        sketchpath (str, optional): location to store the sketches. Defaults to "./data/resale_price_sketches.json".
+        k (int, optional): accuracy parameter of the sketches. Defaults to 200.
+        months (iterable, optional): stored months to rebuild. Defaults to ().
+    """
+    from helper_functions.price_sketch import KLLSketch, load_sketches, save_sketches
+
+    sketches = load_sketches(sketchpath) if os.path.exists(sketchpath) else {}
+    months = set(months)
+    sketches = {key: sketch for key, sketch in sketches.items() if key[2] not in months}
+    stored_months = {month for (_, _, month) in sketches}
+    df = pd.read_csv(filepath, usecols=["month", "town", "flat_type", "resale_price"])
+    df_new = df[~df["month"].isin(stored_months)]
+    for (town, flat_type, month), rows in df_new.groupby(["town", "flat_type", "month"]):
+        sketch = KLLSketch(k=k)
+        sketch.update(rows["resale_price"].to_numpy())
+        sketches[(town, flat_type, month)] = sketch
+    # written to a temporary file first, so that a failed run does not leave partial sketches behind
+    save_sketches(sketches, sketchpath + ".tmp")
+    os.replace(sketchpath + ".tmp", sketchpath)
 
 
 def CEAagenttxn(
@@ -87,6 +182,25 @@ def CEAagenttxn(
     """
     agentinfo = pd.read_csv(filepath[0])
     CEAtxn = pd.read_csv(filepath[1])
+    prepare_agent_txn(CEAtxn, agentinfo).to_csv(
+        "./data/4_CEAAgentTransactionsSep23-Sep24.csv", index=False
+    )
+    # Count the transactions of each agent by town and month, for the agent and agency leaderboards
+    CEAagentcounts()
+
+
+def prepare_agent_txn(CEAtxn, agentinfo):
+    """This function makes the adjustments to raw CEA Agent Transaction records, e.g. a full csv file
+    or a page of records streamed from the datastore API, combines them with the CEA Agent Info and
+    returns the engineered records.
+
+    Args:
+        CEAtxn (pd.DataFrame): raw CEA Agent Transaction records
+        agentinfo (pd.DataFrame): raw CEA Agent Info
+
+    Returns:
+        pd.DataFrame: engineered records
+    """
     # converts transaction_date field to datetime format for ease of subsetting
     CEAtxn["transaction_date"] = pd.to_datetime(
         CEAtxn["transaction_date"], format="%b-%Y"
@@ -118,7 +232,72 @@ def CEAagenttxn(
         "town",
         "real_estate_company_name",
     ]
-    df_new.to_csv("./data/4_CEAAgentTransactionsSep23-Sep24.csv", index=False)
+    return df_new
+
+
+def CEAagentcounts(filepath="./data/4_CEAAgentTransactionsSep23-Sep24.csv"):
+    """This function reads in the engineered CEA Agent Transaction details, counts the transactions of each
+    sales agent by town and month, and stores the counts as csv in data folder. The counts are the partial
+    counts that the agent and agency leaderboards merge over any set of towns and range of months.
+
+    Args:
+        filepath (str, optional): location where engineered file is stored.
+        Defaults to "./data/4_CEAAgentTransactionsSep23-Sep24.csv".
+    """
+    df = pd.read_csv(filepath)
+    df["month"] = df["resale_transaction_date"].str[:7]
+    df_new = (
+        df.groupby(
+            [
+                "town",
+                "month",
+                "sales_agent_reg_num",
+                "sales_agent_name",
+                "real_estate_company_name",
+            ],
+            dropna=False,
+        )
+        .size()
+        .reset_index(name="transactions")
+    )
+    # sorted by town and month, so that the counts for a town over a range of months are contiguous
+    df_new.sort_values(["town", "month", "sales_agent_reg_num"]).to_csv(
+        "./data/5_CEAAgentMonthlyCountsSep23-Sep24.csv", index=False
+    )
+
+
+def analyticsdb(db_path=analytics_db_path, chunksize=50000):
+    """This function loads the engineered csv files in data folder into an embedded SQLite database,
+    and indexes the fields used for filtering and aggregation (month, town, flat_type and agent
+    registration number), so that the app can query the data without holding full copies in memory.
+    The csv files are streamed in chunks, and the database is built in a temporary file that replaces
+    the existing one only once complete.
+
+    Args:
+        db_path (str, optional): location of the database. Defaults to "./data/resale_analytics.sqlite3".
+        chunksize (int, optional): number of csv rows loaded at a time. Defaults to 50000.
+    """
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        for table, (file, indexes) in analytics_tables.items():
+            # lease commencement year is shown as text in the app
+            for chunk in pd.read_csv(
+                f"{directory}/" + file,
+                chunksize=chunksize,
+                dtype={"lease_commence_date": str, "block": str},
+            ):
+                chunk.to_sql(table, conn, if_exists="append", index=False)
+            for fields in indexes:
+                name = f"idx_{table}_" + "_".join(f.strip() for f in fields.split(","))
+                conn.execute(f"CREATE INDEX {name} ON {table} ({fields})")
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
 
 
 if __name__ == "__main__":
@@ -128,5 +307,11 @@ if __name__ == "__main__":
         HDBresalemedian()
     if "3_HDBResalePricesDetailsOct23_Oct24.csv" not in os.listdir(directory):
         HDBresaledetails()
+    if "resale_price_sketches.json" not in os.listdir(directory):
+        HDBresalesketches()
     if "4_CEAAgentTransactionsSep23-Sep24.csv" not in os.listdir(directory):
         CEAagenttxn()
+    if "5_CEAAgentMonthlyCountsSep23-Sep24.csv" not in os.listdir(directory):
+        CEAagentcounts()
+    if "resale_analytics.sqlite3" not in os.listdir(directory):
+        analyticsdb()
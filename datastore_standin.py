@@ -0,0 +1,129 @@
+"""Local stand-in for the data.gov.sg datastore API, for testing data_ingest.py without the network.
+
+It serves recorded records of each resource, read from the raw csv file that data_prep.py builds from,
+a page at a time as datastore_search does, with every value as text and an _id per record. It can serve
+only the first records of each resource, to test that a rerun ingests only the records added since, and
+can fail some requests with 429 Too Many Requests, to test retries. Run from the repository root, then
+point data_ingest.py at it:
+
+    python datastore_standin.py [port] [records served] [failure rate]
+    DATASTORE_URL=http://localhost:8765/api/action/datastore_search python data_ingest.py price_index
+"""
+
+import json
+import os
+import random
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import data_ingest
+
+# recorded records of each resource
+recordings = {
+    data_ingest.agent_info_resource[0]: data_ingest.agent_info_resource[1],
+    data_ingest.datasets["price_index"][0]: "./raw_data/HDBResalePriceIndex1Q2009100Quarterly.csv",
+    data_ingest.datasets["median_prices"][0]: "./raw_data/MedianResalePricesforRegisteredApplicationsbyTownandFlatType.csv",
+    data_ingest.datasets["resale_details"][0]: "./raw_data/ResaleflatpricesbasedonregistrationdatefromJan2017onwards.csv",
+    data_ingest.datasets["agent_txn"][0]: "./raw_data/CEASalespersonsPropertyTransactionRecordsresidential.csv",
+}
+
+
+def load_recording(filepath, max_records=None):
+    """This function reads the recorded records of a resource as text, and the fields with their types
+
+    Args:
+        filepath (str): location of the recorded records
+        max_records (int, optional): number of records to serve. Defaults to None, for all.
+
+    Returns:
+        tuple: list of records, and list of fields
+    """
+    df = pd.read_csv(filepath, dtype=str, keep_default_na=False, nrows=max_records)
+    fields = [{"type": "int4", "id": "_id"}]
+    for column in df.columns:
+        numeric = pd.to_numeric(df[column], errors="coerce").notna().all()
+        fields.append({"type": "numeric" if numeric else "text", "id": column})
+    df.insert(0, "_id", range(1, len(df) + 1))
+    return df.to_dict("records"), fields
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler that serves pages of the recorded records"""
+
+    # resource id -> (records, fields), loaded on first request
+    loaded = {}
+    max_records = None
+    failure_rate = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        resource_id = params.get("resource_id")
+        if url.path != "/api/action/datastore_search" or resource_id not in recordings:
+            return self._reply(404, {"success": False, "error": {"message": "Not found"}})
+        if not os.path.exists(recordings[resource_id]):
+            return self._reply(404, {"success": False, "error": {"message": "No recording"}})
+        if random.random() < self.failure_rate:
+            return self._reply(429, {"success": False, "error": {"message": "Too many requests"}}, {"Retry-After": "0.1"})
+        if resource_id not in self.loaded:
+            self.loaded[resource_id] = load_recording(recordings[resource_id], self.max_records)
+        records, fields = self.loaded[resource_id]
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 100))
+        result = {
+            "resource_id": resource_id,
+            "fields": fields,
+            "records": records[offset : offset + limit],
+            "offset": offset,
+            "limit": limit,
+            "total": len(records),
+        }
+        self._reply(200, {"success": True, "result": result})
+
+    def _reply(self, status, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=8765, max_records=None, failure_rate=0.0):
+    """This function returns a stand-in server, to run with serve_forever, e.g. in a background thread.
+
+    Args:
+        port (int, optional): port to listen on, or 0 for any free port. Defaults to 8765.
+        max_records (int, optional): number of records served of each resource. Defaults to None, for all.
+        failure_rate (float, optional): share of requests that fail with 429. Defaults to 0.0.
+
+    Returns:
+        ThreadingHTTPServer: server, with its URL in server.url
+    """
+    handler = type(
+        "Handler",
+        (StandInHandler,),
+        {"loaded": {}, "max_records": max_records, "failure_rate": failure_rate},
+    )
+    server = ThreadingHTTPServer(("localhost", port), handler)
+    server.url = f"http://localhost:{server.server_address[1]}/api/action/datastore_search"
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    max_records = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    server = make_server(port, max_records, failure_rate)
+    print(f"Serving recorded records at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
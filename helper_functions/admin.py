@@ -0,0 +1,85 @@
+import collections
+import datetime
+
+import streamlit as st
+
+from helper_functions import profiling
+from helper_functions.single_flight import flight_stats
+from helper_functions.warmup import warmup_timings
+
+
+def admin_page():
+    """This function displays the hidden admin page, with the per-rerun profiles, flamegraph capture,
+    request coalescing statistics and warm-up timings. It is opened by adding ?admin=1 to the app URL
+    after logging in, and entering the admin password, which is set by the environment variable
+    ADMIN_PASSWORD or the admin_password secret. Without an admin password it is turned off.
+    """
+    st.markdown("### Admin")
+
+    # Step 1: Profiling controls, which apply to every session of this process
+    profiling.enabled = st.toggle(
+        "Profile every rerun", value=profiling.enabled, key="admin_profiling"
+    )
+    if st.button("Capture a flamegraph of the next rerun", key="admin_capture"):
+        profiling.enabled = True
+        profiling.capture_next = True
+        st.info("The next rerun of the app, by any session, will be sampled.")
+
+    # Step 2: Timings of each section, over the buffered reruns
+    st.markdown("#### Sections")
+    st.dataframe(profiling.section_summary(), hide_index=True, key="admin_sections")
+
+    st.markdown("#### Recent reruns")
+    records = list(profiling.reruns)[::-1]
+    st.dataframe(
+        [
+            {
+                "started": datetime.datetime.fromtimestamp(record["started"]).strftime("%H:%M:%S"),
+                "name": record["name"],
+                "session_id": record["session_id"],
+                "seconds": record["seconds"],
+                "slowest section": max(record["sections"], key=lambda x: x[1])[0]
+                if record["sections"]
+                else None,
+            }
+            for record in records
+        ],
+        hide_index=True,
+        key="admin_reruns",
+    )
+
+    # Step 3: Captured flamegraphs, as folded stacks for flamegraph tools such as speedscope or flamegraph.pl
+    st.markdown("#### Flamegraphs")
+    for i, record in enumerate(r for r in records if r["folded_stacks"]):
+        started = datetime.datetime.fromtimestamp(record["started"]).strftime("%Y%m%d-%H%M%S")
+        st.write(f"*{record['name']} at {started}, {record['seconds']:.2f}s*")
+        # samples in which each function was running, rather than waiting on a function it called
+        self_samples = collections.Counter()
+        for line in record["folded_stacks"].splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self_samples[stack.rsplit(";", 1)[-1]] += int(count)
+        st.dataframe(
+            [{"function": f, "samples": n} for f, n in self_samples.most_common(15)],
+            hide_index=True,
+            key=f"admin_flamegraph_{i}",
+        )
+        st.download_button(
+            "Download folded stacks",
+            record["folded_stacks"],
+            file_name=f"rerun-{started}.folded",
+            key=f"admin_download_{i}",
+        )
+
+    # Step 4: Request coalescing and warm-up
+    st.markdown("#### Request coalescing")
+    st.dataframe(
+        [{"function": name, **stats} for name, stats in flight_stats().items()],
+        hide_index=True,
+        key="admin_coalescing",
+    )
+    st.markdown("#### Warm-up")
+    st.dataframe(
+        [{"step": name, "seconds": seconds} for name, seconds in warmup_timings.items()],
+        hide_index=True,
+        key="admin_warmup",
+    )
@@ -0,0 +1,230 @@
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import httpx
+
+# tool -> (requests per second, burst) that the tool's model calls are admitted at. Calls from threads
+# that are not running a tool, e.g. RenoChat summaries, share the "background" budget.
+tool_budgets = {
+    "resalestats": (2.0, 4),
+    "resalesearch": (2.0, 4),
+    "renochat": (2.0, 4),
+    "replay": (8.0, 16),
+    "background": (1.0, 2),
+}
+
+# lower is admitted first. Guard calls are short, and every tool call waits on one, so they go first.
+priorities = {"guard": 0, "generation": 1}
+
+# tool, session and priority of the model calls made in the current context
+_context = contextvars.ContextVar("admission_context", default={})
+
+
+@contextlib.contextmanager
+def admission_context(**values):
+    """This function sets the tool, session_id, priority or on_wait callback of the model calls made
+    within the context. on_wait(position, eta) is called while a call waits to be admitted, in the
+    thread that set it.
+    """
+    values = {**_context.get(), **values}
+    if "on_wait" in values:
+        values["thread"] = threading.get_ident()
+    token = _context.set(values)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class TokenBucket:
+    """Token bucket that refills at rate tokens per second, up to burst tokens"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        """This function adds the tokens accrued since the last refill"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """This function takes a token if one is available, returning whether it did"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """This function returns the seconds until a token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Waiter:
+    """A model call waiting to be admitted"""
+
+    def __init__(self, tool, session_id, priority, seq):
+        self.tool = tool
+        self.session_id = session_id
+        self.priority = priority
+        self.seq = seq
+
+
+class AdmissionScheduler:
+    """Admission control for model calls shared by all sessions. Each tool has a token bucket budget.
+    Calls waiting for the same tool are admitted by priority, then round robin across sessions, so that
+    a session sending many calls does not hold up the others, then in order of arrival.
+
+    Args:
+        budgets (dict): tool -> (requests per second, burst)
+        max_sessions (int, optional): number of (tool, session) admission times kept for round robin.
+        Defaults to 4096.
+    """
+
+    def __init__(self, budgets, max_sessions=4096):
+        self._budgets = budgets
+        self._buckets = {}
+        self._waiters = {}
+        # (tool, session_id) -> when the session last had a call admitted, counted in admissions, least
+        # recently admitted first. Dropping the least recently admitted session leaves the order unchanged,
+        # since a session that was never admitted goes first as well.
+        self._last_served = OrderedDict()
+        self._max_sessions = max_sessions
+        self._seq = itertools.count()
+        self._admissions = itertools.count()
+        self._cond = threading.Condition()
+
+    def _bucket(self, tool):
+        """This function returns the token bucket of the tool, creating it on first use"""
+        if tool not in self._buckets:
+            self._buckets[tool] = TokenBucket(*self._budgets.get(tool, self._budgets["background"]))
+        return self._buckets[tool]
+
+    def _queue(self, tool):
+        """This function returns the calls waiting for the tool, in the order they will be admitted"""
+        return sorted(
+            self._waiters.get(tool, []),
+            key=lambda w: (w.priority, self._last_served.get((tool, w.session_id), -1), w.seq),
+        )
+
+    def _eta(self, tool, position):
+        """This function estimates the seconds until the call at the queue position is admitted"""
+        bucket = self._bucket(tool)
+        return bucket.wait_time() + position / bucket.rate
+
+    def acquire(self, tool, session_id, priority="generation", on_wait=None):
+        """This function blocks until a model call of the tool is admitted.
+
+        Args:
+            tool (str): tool making the call
+            session_id (str): session making the call
+            priority (str, optional): "guard" or "generation". Defaults to "generation".
+            on_wait (callable, optional): called with the queue position and estimated wait in seconds while waiting. Defaults to None.
+        """
+        with self._cond:
+            waiter = _Waiter(tool, session_id, priorities[priority], next(self._seq))
+            self._waiters.setdefault(tool, []).append(waiter)
+        try:
+            while True:
+                with self._cond:
+                    queue = self._queue(tool)
+                    position = queue.index(waiter)
+                    if position == 0 and self._bucket(tool).take():
+                        self._last_served[(tool, session_id)] = next(self._admissions)
+                        self._last_served.move_to_end((tool, session_id))
+                        if len(self._last_served) > self._max_sessions:
+                            self._last_served.popitem(last=False)
+                        return
+                    eta = self._eta(tool, position)
+                if on_wait is not None:
+                    on_wait(position, eta)
+                with self._cond:
+                    self._cond.wait(timeout=min(max(self._bucket(tool).wait_time(), 0.01), 0.5))
+        finally:
+            with self._cond:
+                self._waiters[tool].remove(waiter)
+                self._cond.notify_all()
+
+    def status(self, session_id):
+        """This function returns the queue position and estimated wait of each waiting call of the session.
+
+        Args:
+            session_id (str): session
+
+        Returns:
+            list: list of dictionaries with the tool, queue position and estimated wait in seconds
+        """
+        with self._cond:
+            return [
+                {"tool": tool, "position": position, "eta": self._eta(tool, position)}
+                for tool in self._waiters
+                for position, waiter in enumerate(self._queue(tool))
+                if waiter.session_id == session_id
+            ]
+
+
+scheduler = AdmissionScheduler(tool_budgets)
+
+
+def admit():
+    """This function blocks until a model call in the current context is admitted"""
+    context = _context.get()
+    on_wait = context.get("on_wait")
+    if context.get("thread") != threading.get_ident():
+        # the callback may update the page, which only the thread running the page can do
+        on_wait = None
+    scheduler.acquire(
+        context.get("tool", "background"),
+        context.get("session_id", "background"),
+        context.get("priority", "generation"),
+        on_wait,
+    )
+
+
+class AdmissionTransport(httpx.BaseTransport):
+    """HTTP transport that admits every request through the scheduler before sending it, so that calls
+    made by any client library using it share the budgets. The seconds the request waited to be admitted
+    are stored in its extensions as admission_seconds."""
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        admit()
+        request.extensions["admission_seconds"] = time.perf_counter() - start
+        return self._transport.handle_request(request)
+
+    def close(self):
+        self._transport.close()
+
+
+@lru_cache(maxsize=None)
+def http_client(provider="openai"):
+    """This function returns the HTTP client for model calls to the provider, shared by all clients.
+
+    Args:
+        provider (str, optional): "openai" or "cohere". Defaults to "openai".
+
+    Returns:
+        httpx.Client: HTTP client
+    """
+    from helper_functions.cassette import wrap_transport
+
+    # requests are replayed if a cassette is turned on, without waiting to be admitted, else admitted and sent
+    transport = wrap_transport(AdmissionTransport(httpx.HTTPTransport()))
+    if provider == "openai":
+        from openai import DefaultHttpxClient
+
+        return DefaultHttpxClient(transport=transport)
+    return httpx.Client(transport=transport, timeout=300)
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+import data_prep
+
+# fields of each table that can be selected and filtered on
+table_columns = {
+    "price_index": ["quarter", "index"],
+    "median_prices": ["quarter", "town", "flat_type", "price"],
+    "resale_details": [
+        "month",
+        "town",
+        "flat_type",
+        "flat_model",
+        "floor_area_sqm",
+        "resale_price",
+        "street_name",
+        "block",
+        "storey_range",
+        "lease_commence_date",
+    ],
+    "agent_txn": [
+        "sales_agent_name",
+        "resale_transaction_date",
+        "sales_agent_reg_num",
+        "town",
+        "real_estate_company_name",
+    ],
+    "agent_counts": [
+        "town",
+        "month",
+        "sales_agent_reg_num",
+        "sales_agent_name",
+        "real_estate_company_name",
+        "transactions",
+    ],
+}
+
+_local = threading.local()
+_build_lock = threading.Lock()
+
+
+def _ensure_db(db_path):
+    """This function builds the analytics database from the engineered csv files if it does not exist yet"""
+    with _build_lock:
+        if not os.path.exists(db_path):
+            data_prep.analyticsdb(db_path)
+
+
+def data_version(db_path=data_prep.analytics_db_path):
+    """This function returns a version string for the analytics database, which changes
+    whenever the database is rebuilt. Useful as a cache key for data derived from it.
+
+    Args:
+        db_path (str, optional): location of the database. Defaults to data_prep.analytics_db_path.
+
+    Returns:
+        str: data version
+    """
+    _ensure_db(db_path)
+    stat = os.stat(db_path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def open_connection(db_path=data_prep.analytics_db_path):
+    """This function opens a new read-only connection to the analytics database, building the
+    database from the engineered csv files first if it does not exist yet.
+
+    Args:
+        db_path (str, optional): location of the database. Defaults to data_prep.analytics_db_path.
+
+    Returns:
+        sqlite3.Connection: read-only database connection
+    """
+    _ensure_db(db_path)
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def get_connection():
+    """This function returns the read-only connection to the analytics database kept for the calling thread.
+    The connection is reopened when the database has been rebuilt, since a connection opened before keeps
+    reading the replaced file."""
+    version = data_version()
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.version != version:
+        if conn is not None:
+            conn.close()
+        conn = open_connection()
+        _local.conn, _local.version = conn, version
+    return conn
+
+
+def _check_fields(table, fields):
+    """This function ensures that only known tables and fields make it into SQL statements"""
+    if table not in table_columns:
+        raise ValueError(f"Unknown table: {table}")
+    for field in fields:
+        if field not in table_columns[table]:
+            raise ValueError(f"Unknown field for {table}: {field}")
+
+
+def filter_clause(table, filters):
+    """This function builds the WHERE clause for a set of filters on a table.
+
+    Args:
+        table (str): name of table
+        filters (dict): field -> list of accepted values, or a single accepted value
+
+    Returns:
+        tuple: WHERE clause (empty if there are no filters) and its parameters
+    """
+    _check_fields(table, filters)
+    conditions = []
+    params = []
+    for field, values in filters.items():
+        if isinstance(values, (list, tuple, set)):
+            values = list(values)
+            conditions.append(f'"{field}" IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+        else:
+            conditions.append(f'"{field}" = ?')
+            params.append(values)
+    if len(conditions) == 0:
+        return "", params
+    return " WHERE " + " AND ".join(conditions), params
+
+
+def select_sql(table, filters=None, columns=None):
+    """This function builds the SELECT statement for the filtered rows of a table.
+
+    Args:
+        table (str): name of table
+        filters (dict, optional): field -> list of accepted values, or a single accepted value. Defaults to None.
+        columns (list, optional): fields to select. Defaults to None (all fields).
+
+    Returns:
+        tuple: SQL statement and its parameters
+    """
+    columns = columns or table_columns[table]
+    _check_fields(table, columns)
+    where, params = filter_clause(table, filters or {})
+    fields = ", ".join(f'"{col}"' for col in columns)
+    return f"SELECT {fields} FROM {table}{where}", params
+
+
+def read_sql(sql, params=None):
+    """This function runs a SELECT statement on the analytics database.
+
+    Args:
+        sql (str): SQL statement
+        params (list, optional): parameters of the SQL statement. Defaults to None.
+
+    Returns:
+        pd.DataFrame: selected rows
+    """
+    return pd.read_sql_query(sql, get_connection(), params=params)
+
+
+def select_rows(table, filters=None, columns=None):
+    """This function returns the rows of a table that pass the filters.
+
+    Args:
+        table (str): name of table
+        filters (dict, optional): field -> list of accepted values, or a single accepted value. Defaults to None.
+        columns (list, optional): fields to select. Defaults to None (all fields).
+
+    Returns:
+        pd.DataFrame: filtered rows
+    """
+    return read_sql(*select_sql(table, filters, columns))
+
+
+def select_page(
+    table,
+    filters=None,
+    columns=None,
+    sort_by=None,
+    ascending=True,
+    search="",
+    page=1,
+    page_size=50,
+):
+    """This function returns one page of the rows of a table that pass the filters, with sorting
+    and searching done by the database so that only the rows on the page are loaded.
+
+    Args:
+        table (str): name of table
+        filters (dict, optional): field -> list of accepted values, or a single accepted value. Defaults to None.
+        columns (list, optional): fields to select and search in. Defaults to None (all fields).
+        sort_by (str, optional): field to sort by. Defaults to None (order of the table).
+        ascending (bool, optional): whether to sort in ascending order. Defaults to True.
+        search (str, optional): text that at least one of the selected fields must contain. Defaults to "".
+        page (int, optional): page number, starting from 1. Defaults to 1.
+        page_size (int, optional): number of rows on each page. Defaults to 50.
+
+    Returns:
+        tuple: rows on the page in pandas dataframe, and total number of rows that pass the filters and search
+    """
+    columns = columns or table_columns[table]
+    _check_fields(table, columns + ([sort_by] if sort_by else []))
+    where, params = filter_clause(table, filters or {})
+    if search:
+        matches = " OR ".join(f'"{col}" LIKE ?' for col in columns)
+        where = (where + " AND " if where else " WHERE ") + f"({matches})"
+        params = params + [f"%{search}%"] * len(columns)
+    total = get_connection().execute(
+        f"SELECT COUNT(*) FROM {table}{where}", params
+    ).fetchone()[0]
+    order = f' ORDER BY "{sort_by}" {"ASC" if ascending else "DESC"}' if sort_by else ""
+    fields = ", ".join(f'"{col}"' for col in columns)
+    rows = read_sql(
+        f"SELECT {fields} FROM {table}{where}{order} LIMIT ? OFFSET ?",
+        params + [page_size, (max(page, 1) - 1) * page_size],
+    )
+    return rows, total
+
+
+def distinct_values(table, field):
+    """This function returns the distinct values of a field, in order of first appearance.
+
+    Args:
+        table (str): name of table
+        field (str): name of field
+
+    Returns:
+        list: distinct values
+    """
+    _check_fields(table, [field])
+    rows = get_connection().execute(
+        f'SELECT "{field}" FROM {table} GROUP BY "{field}" ORDER BY MIN(rowid)'
+    ).fetchall()
+    return [row[0] for row in rows]
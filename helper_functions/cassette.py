@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import httpx
+
+# default location of the on-disk store of recorded model calls
+cassette_path = "./data/model_cassette.sqlite3"
+
+# request body fields that do not change the response, and are left out of the request key
+_volatile_fields = {"user", "stream_options"}
+
+# response headers that no longer apply once the body is stored decoded
+_dropped_headers = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CassetteMiss(RuntimeError):
+    """Raised in strict replay when a request was not recorded"""
+
+
+def request_key(request):
+    """This function returns the key of a request, a hash of its method, URL and body. JSON bodies are
+    normalised, so that key order and volatile fields do not matter. Headers, which carry API keys,
+    retry counts and client versions, are left out.
+
+    Args:
+        request (httpx.Request): request
+
+    Returns:
+        str: key of the request
+    """
+    body = request.content
+    try:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            payload = {k: v for k, v in payload.items() if k not in _volatile_fields}
+        body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url}\n".encode() + body)
+    return digest.hexdigest()
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """HTTP transport that records requests and their responses to a compact on-disk store, or replays
+    the recorded responses without touching the network.
+
+    In record mode, every request is sent and its response stored, with how long it took, less any time
+    it waited in an admission transport. In replay mode, a recorded response is served after its recorded
+    latency times latency_scale, e.g. 0 for no delay. Identical requests recorded more than once are
+    replayed in the order they were recorded. A request that was not recorded is sent and recorded, or in
+    strict mode raises CassetteMiss.
+
+    Args:
+        transport (httpx.BaseTransport): transport that sends requests
+        mode (str): "record" or "replay"
+        db_path (str, optional): location of the store. Defaults to cassette_path.
+        latency_scale (float, optional): multiplier of the recorded latency on replay. Defaults to 1.0.
+        strict (bool, optional): whether a replayed request that was not recorded fails. Defaults to False.
+    """
+
+    def __init__(self, transport, mode, db_path=cassette_path, latency_scale=1.0, strict=False):
+        self._transport = transport
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        # key -> number of times the request has been replayed by this process
+        self._replayed = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS model_calls (
+                request_key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                seconds REAL NOT NULL,
+                PRIMARY KEY (request_key, seq)
+            )"""
+        )
+        self._conn.commit()
+
+    def _replay(self, key):
+        """This function returns the next recorded response to the request, or None if there is none"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, headers, body, seconds FROM model_calls WHERE request_key = ? ORDER BY seq",
+                (key,),
+            ).fetchall()
+            if len(rows) == 0:
+                return None
+            n = self._replayed.get(key, 0)
+            self._replayed[key] = n + 1
+        status, headers, body, seconds = rows[n % len(rows)]
+        return status, json.loads(headers), zlib.decompress(body), seconds
+
+    def _record(self, key, request, response, seconds):
+        """This function stores the response to the request"""
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _dropped_headers]
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO model_calls VALUES (
+                    ?, (SELECT COUNT(*) FROM model_calls WHERE request_key = ?), ?, ?, ?, ?, ?
+                )""",
+                (
+                    key,
+                    key,
+                    str(request.url),
+                    response.status_code,
+                    json.dumps(headers),
+                    zlib.compress(response.content),
+                    seconds,
+                ),
+            )
+            self._conn.commit()
+
+    def handle_request(self, request):
+        request.read()
+        key = request_key(request)
+        if self.mode == "replay":
+            recorded = self._replay(key)
+            if recorded is not None:
+                status, headers, body, seconds = recorded
+                time.sleep(seconds * self.latency_scale)
+                return httpx.Response(status, headers=headers, content=body, request=request)
+            if self.strict:
+                raise CassetteMiss(f"No recorded response to {request.method} {request.url}")
+        start = time.perf_counter()
+        response = self._transport.handle_request(request)
+        response.read()
+        # the wait for admission is left out, so that replay is not throttled twice
+        seconds = time.perf_counter() - start - request.extensions.get("admission_seconds", 0.0)
+        self._record(key, request, response, seconds)
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _dropped_headers]
+        return httpx.Response(
+            response.status_code, headers=headers, content=response.content, request=request
+        )
+
+    def close(self):
+        self._transport.close()
+        self._conn.close()
+
+
+def wrap_transport(transport):
+    """This function wraps the transport for model calls in a cassette, if one is turned on with the
+    environment variable MODEL_CASSETTE, set to record or replay. MODEL_CASSETTE_PATH sets the location of
+    the store, MODEL_CASSETTE_LATENCY the multiplier of the recorded latency on replay (default 1, 0 for no
+    delay), and MODEL_CASSETTE_STRICT=1 makes requests that were not recorded fail on replay.
+
+    Args:
+        transport (httpx.BaseTransport): transport that sends requests
+
+    Returns:
+        httpx.BaseTransport: cassette transport, or the transport itself if no cassette is turned on
+    """
+    mode = os.environ.get("MODEL_CASSETTE", "off")
+    if mode not in ("record", "replay"):
+        return transport
+    return CassetteTransport(
+        transport,
+        mode,
+        db_path=os.environ.get("MODEL_CASSETTE_PATH", cassette_path),
+        latency_scale=float(os.environ.get("MODEL_CASSETTE_LATENCY", "1")),
+        strict=os.environ.get("MODEL_CASSETTE_STRICT", "0") == "1",
+    )
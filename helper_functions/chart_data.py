@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def median_price_series(df):
+    """This function precomputes the series for the HDB median resale prices bar chart, pivoted
+    by flat type, for every town and for every quarter, so that switching the selected location or
+    period is a dictionary lookup.
+
+    Args:
+        df (pd.DataFrame): median resale prices, with fields quarter, town, flat_type and price
+
+    Returns:
+        dict: {"Location": {town: prices by quarter}, "Period": {quarter: prices by town}}, with
+        one column of prices per flat type
+    """
+    series = {"Location": {}, "Period": {}}
+    for town, rows in df.groupby("town", sort=False):
+        series["Location"][town] = rows.pivot(
+            index="quarter", columns="flat_type", values="price"
+        )
+    for quarter, rows in df.groupby("quarter", sort=False):
+        series["Period"][quarter] = rows.pivot(
+            index="town", columns="flat_type", values="price"
+        )
+    return series
+
+
+def downsample(df, y, max_points):
+    """This function downsamples a long series for a line chart with the Largest-Triangle-Three-Buckets
+    algorithm, which keeps the points that matter to the shape of the line. The first and last points
+    are always kept.
+
+    Args:
+        df (pd.DataFrame): series to be plotted, in plotting order
+        y (str): field plotted on the y axis
+        max_points (int): maximum number of points, typically the width of the chart in pixels
+
+    Returns:
+        pd.DataFrame: downsampled series
+    """
+    num_points = len(df)
+    if num_points <= max_points or max_points < 3:
+        return df
+    values = df[y].to_numpy(dtype=float)
+    buckets = np.array_split(np.arange(1, num_points - 1), max_points - 2)
+    selected = [0]
+    for i, bucket in enumerate(buckets):
+        # average of the next bucket, or the last point, is the third vertex of the triangle
+        following = buckets[i + 1] if i + 1 < len(buckets) else np.array([num_points - 1])
+        avg_x, avg_y = following.mean(), values[following].mean()
+        prev = selected[-1]
+        areas = np.abs(
+            (prev - avg_x) * (values[bucket] - values[prev])
+            - (prev - bucket) * (avg_y - values[prev])
+        )
+        selected.append(int(bucket[np.argmax(areas)]))
+    selected.append(num_points - 1)
+    return df.iloc[selected]
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+class LeaderboardIndex:
+    """Index of the transaction counts of CEA sales agents, partitioned by town and month, for
+    answering top-k agent and agency queries over any set of towns and range of months.
+
+    The partial counts are held in flat arrays sorted by town and month, so the counts for one town
+    over a range of months form a single contiguous slice. A query merges at most one slice per
+    selected town with a vectorised bincount, and selects the top k without sorting every entity.
+
+    Args:
+        df (pd.DataFrame): transaction counts, with fields town, month, sales_agent_reg_num,
+        sales_agent_name, real_estate_company_name and transactions
+    """
+
+    def __init__(self, df):
+        df = df.sort_values(["town", "month"], kind="stable")
+        self.towns = sorted(df["town"].unique().tolist())
+        self.months = sorted(df["month"].unique().tolist())
+        town_idx = np.searchsorted(self.towns, df["town"].to_numpy())
+        month_idx = np.searchsorted(self.months, df["month"].to_numpy())
+        # offsets[t, m] is where the counts for town t and month m start in the flat arrays
+        cell = town_idx * len(self.months) + month_idx
+        self._offsets = np.searchsorted(
+            cell, np.arange(len(self.towns) * len(self.months) + 1)
+        )
+        self._counts = df["transactions"].to_numpy(dtype=np.int64)
+
+        agent_codes, agents = df["sales_agent_reg_num"].factorize()
+        self._agent_idx = agent_codes
+        # name and agency of each agent, as at the latest month
+        latest = df.assign(code=agent_codes).sort_values("month").drop_duplicates("code", keep="last")
+        latest = latest.set_index("code").reindex(range(len(agents)))
+        self._agents = np.array(agents, dtype=object)
+        self._agent_names = latest["sales_agent_name"].to_numpy(dtype=object)
+        self._agent_agencies = latest["real_estate_company_name"].to_numpy(dtype=object)
+
+        # transactions of agents without an agency are left out of the agency leaderboard
+        agency_codes, agencies = df["real_estate_company_name"].factorize()
+        self._agency_idx = agency_codes
+        self._agencies = np.array(agencies, dtype=object)
+
+        # the index is shared by all sessions, so its arrays are made read-only
+        for array in vars(self).values():
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+
+    def _rows(self, towns, start_month, end_month):
+        """This function returns the positions of the counts for the towns and range of months"""
+        m0 = np.searchsorted(self.months, start_month or self.months[0], side="left")
+        m1 = np.searchsorted(self.months, end_month or self.months[-1], side="right")
+        num_months = len(self.months)
+        slices = []
+        for town in towns:
+            t = np.searchsorted(self.towns, town)
+            if t == len(self.towns) or self.towns[t] != town or m0 >= m1:
+                continue
+            start = self._offsets[t * num_months + m0]
+            end = self._offsets[t * num_months + m1]
+            slices.append(np.arange(start, end))
+        if len(slices) == 0:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(slices)
+
+    def top_k(self, kind, towns=None, start_month=None, end_month=None, k=5):
+        """This function returns the top k agents or agencies by number of transactions.
+
+        Args:
+            kind (str): "agent" or "agency"
+            towns (list, optional): towns to count transactions in. Defaults to None (all towns).
+            start_month (str, optional): first month to count, as YYYY-MM. Defaults to None (earliest month).
+            end_month (str, optional): last month to count, as YYYY-MM. Defaults to None (latest month).
+            k (int, optional): number of agents or agencies to return. Defaults to 5.
+
+        Returns:
+            list: list of dictionaries, in descending number of transactions
+        """
+        rows = self._rows(towns if towns is not None else self.towns, start_month, end_month)
+        if kind == "agent":
+            codes, labels = self._agent_idx[rows], self._agents
+        elif kind == "agency":
+            codes, labels = self._agency_idx[rows], self._agencies
+            keep = codes >= 0
+            codes, rows = codes[keep], rows[keep]
+        else:
+            raise ValueError(f"Unknown leaderboard kind: {kind}")
+        totals = np.bincount(codes, weights=self._counts[rows], minlength=len(labels))
+        k = min(k, int(np.count_nonzero(totals)))
+        if k == 0:
+            return []
+        # every entry tied with the k-th is a candidate, so that the ties are broken the same way each time
+        kth = np.partition(-totals, k - 1)[k - 1]
+        candidates = np.flatnonzero(-totals <= kth)
+        # order the candidates by transactions, then by registration number or agency name, and keep k
+        top = candidates[np.lexsort((labels[candidates], -totals[candidates]))[:k]]
+        if kind == "agent":
+            return [
+                {
+                    "sales_agent_name": self._agent_names[i],
+                    "sales_agent_reg_num": labels[i],
+                    "real_estate_company_name": self._agent_agencies[i],
+                    "transactions": int(totals[i]),
+                }
+                for i in top
+            ]
+        return [
+            {"real_estate_company_name": labels[i], "transactions": int(totals[i])}
+            for i in top
+        ]
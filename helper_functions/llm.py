@@ -1,9 +1,9 @@
 import os
+import threading
 import streamlit as st
-import tiktoken
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from functools import lru_cache
 
 if load_dotenv(".env"):
     # for local environment
@@ -12,21 +12,54 @@ else:
     # for streamlit community cloud environment
     OPENAI_KEY = st.secrets["OPENAI_API_KEY"]
 
-# Pass the API Key to the OpenAI Client
-client = OpenAI(api_key=OPENAI_KEY)
+# The OpenAI Client is constructed on first use, to keep app startup fast
+_client = None
+_client_lock = threading.Lock()
 
 
-def get_embedding(input, model="text-embedding-3-small"):
+def get_client():
+    """This function returns the OpenAI Client, constructing it with the API Key on first use
+
+    Returns:
+        OpenAI: OpenAI Client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+
+            from helper_functions.admission import http_client
+
+            # requests are admitted through the shared scheduler, see helper_functions.admission
+            _client = OpenAI(api_key=OPENAI_KEY, http_client=http_client("openai"))
+    return _client
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model="gpt-4o-mini"):
+    """This function returns the tiktoken encoding for the model, loading it on first use"""
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
+
+def get_embedding(input, model="text-embedding-3-small", dimensions=None):
     """This is the function for generating embedding for input string
 
     Args:
         input (str): input text string or list of input text string
         model (str, optional): embedding model. Defaults to 'text-embedding-3-small'.
+        dimensions (int, optional): number of dimensions of the shortened embedding. Defaults to None (full length).
 
     Returns:
         list: list of list of vector values
     """
-    response = client.embeddings.create(input=input, model=model)
+    if dimensions is None:
+        response = get_client().embeddings.create(input=input, model=model)
+    else:
+        response = get_client().embeddings.create(
+            input=input, model=model, dimensions=dimensions
+        )
     return [x.embedding for x in response.data]
 
 
@@ -59,7 +92,7 @@ def get_completion(
         output_json_structure = None
 
     messages = [{"role": "user", "content": prompt}]
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
@@ -88,7 +121,7 @@ def get_completion_by_messages(
     Returns:
         str: LLM's textual response
     """
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
@@ -110,7 +143,7 @@ def count_tokens(text):
     Returns:
         int: number of tokens
     """
-    encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+    encoding = _get_encoding("gpt-4o-mini")
     return len(encoding.encode(text))
 
 
@@ -125,7 +158,7 @@ def count_tokens_from_message(messages):
     Returns:
         int: number of tokens
     """
-    encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+    encoding = _get_encoding("gpt-4o-mini")
     # Extract the contents from each message and concatenate them
     value = " ".join([x.get("content") for x in messages])
     return len(encoding.encode(value))
@@ -172,6 +205,9 @@ def check_for_malicious_intent(user_message):
         },
     ]
 
-    # getting response from LLM, capping the number of output token at 1.
-    response = get_completion_by_messages(messages, max_tokens=1)
+    # getting response from LLM, capping the number of output token at 1. Guard calls are admitted ahead of other calls.
+    from helper_functions.admission import admission_context
+
+    with admission_context(priority="guard"):
+        response = get_completion_by_messages(messages, max_tokens=1)
     return response
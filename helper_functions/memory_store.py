@@ -0,0 +1,196 @@
+import atexit
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# default location of the on-disk store for RenoChat session memory
+memory_db_path = "./data/renochat_memory.sqlite3"
+
+
+class InProcessMemoryStore:
+    """Keeps every session's chatbot memory in RAM for the lifetime of the process.
+    Suitable for local development with a handful of sessions."""
+
+    def __init__(self):
+        self._memories = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id, default=None):
+        """Returns the chatbot memory of the session, or default if there is none"""
+        with self._lock:
+            return self._memories.get(session_id, default)
+
+    def put(self, session_id, memory):
+        """Stores the chatbot memory of the session"""
+        with self._lock:
+            self._memories[session_id] = memory
+
+
+class SQLiteMemoryStore:
+    """Keeps the chatbot memory of recently active sessions in an in-process LRU and spills
+    the rest to a local SQLite database. Sessions that are idle, or pushed out of the LRU by
+    newer sessions, are written to disk and reloaded lazily when the user returns. Stored
+    transcripts are compressed, and sessions not seen for a while are periodically removed.
+
+    Args:
+        db_path (str, optional): location of the SQLite database. Defaults to memory_db_path.
+        max_active (int, optional): maximum number of sessions held in RAM. Defaults to 256.
+        idle_seconds (int, optional): seconds of inactivity before a session is evicted to disk. Defaults to 900.
+        retention_days (int, optional): days of inactivity before a stored session is removed. Defaults to 7.
+        compact_every (int, optional): number of writes to disk between compactions. Defaults to 500.
+    """
+
+    def __init__(
+        self,
+        db_path=memory_db_path,
+        max_active=256,
+        idle_seconds=900,
+        retention_days=7,
+        compact_every=500,
+    ):
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        self.retention_days = retention_days
+        self.compact_every = compact_every
+        # session id -> [memory, last access time, whether memory has changed since last written]
+        self._active = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_compaction = 0
+        # whether a compaction is running, so that evictions meanwhile do not start another
+        self._compacting = False
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chatbot_memory (
+                session_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL,
+                transcript BLOB NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, session_id, default=None):
+        """Returns a copy of the chatbot memory of the session, reloading it from disk if it has been
+        evicted, or default if the session has no stored memory. The copy can be changed freely while
+        the stored memory is being written to disk by another thread, and is stored back with put."""
+        with self._lock:
+            entry = self._active.get(session_id)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT transcript FROM chatbot_memory WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                if row is None:
+                    return default
+                entry = [json.loads(zlib.decompress(row[0])), time.time(), False]
+                self._active[session_id] = entry
+            else:
+                entry[1] = time.time()
+            self._active.move_to_end(session_id)
+            memory = copy.deepcopy(entry[0])
+            self._evict(time.time())
+        return memory
+
+    def put(self, session_id, memory):
+        """Stores the chatbot memory of the session in RAM, to be written to disk on eviction. The
+        memory must not be changed after it is stored."""
+        with self._lock:
+            self._active[session_id] = [memory, time.time(), True]
+            self._active.move_to_end(session_id)
+            self._evict(time.time())
+
+    def flush(self):
+        """Writes the memory of all active sessions that has changed to disk, and the last access time of
+        the others"""
+        with self._lock:
+            for session_id, entry in self._active.items():
+                if entry[2]:
+                    self._write(session_id, entry)
+                else:
+                    self._touch(session_id, entry)
+            self._conn.commit()
+
+    def compact(self):
+        """Removes stored sessions that have not been used within the retention period and
+        reclaims the space they took up in the database file"""
+        with self._lock:
+            try:
+                cutoff = time.time() - self.retention_days * 86400
+                self._conn.execute(
+                    "DELETE FROM chatbot_memory WHERE last_access < ?", (cutoff,)
+                )
+                self._conn.commit()
+                self._conn.execute("VACUUM")
+                self._writes_since_compaction = 0
+            finally:
+                self._compacting = False
+
+    def _evict(self, now):
+        """Writes sessions beyond the LRU capacity, as well as idle sessions, to disk and
+        drops them from RAM. A session that was only read has its last access time updated, so
+        that it is not removed by compaction while it is still in use. Must be called with the lock held."""
+        evicted = False
+        while self._active:
+            session_id, entry = next(iter(self._active.items()))
+            if len(self._active) <= self.max_active and now - entry[1] < self.idle_seconds:
+                break
+            del self._active[session_id]
+            if entry[2]:
+                self._write(session_id, entry)
+            else:
+                self._touch(session_id, entry)
+            evicted = True
+        if evicted:
+            self._conn.commit()
+            if self._writes_since_compaction >= self.compact_every and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, daemon=True).start()
+
+    def _write(self, session_id, entry):
+        """Writes the compressed transcript of a session to disk. Must be called with the lock held."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO chatbot_memory (session_id, last_access, transcript) VALUES (?, ?, ?)",
+            (session_id, entry[1], zlib.compress(json.dumps(entry[0]).encode("utf-8"))),
+        )
+        entry[2] = False
+        self._writes_since_compaction += 1
+
+    def _touch(self, session_id, entry):
+        """Updates the last access time of a stored session that has not changed. Must be called with the lock held."""
+        self._conn.execute(
+            "UPDATE chatbot_memory SET last_access = ? WHERE session_id = ?", (entry[1], session_id)
+        )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store(backend=None):
+    """This function returns the process-wide store for RenoChat session memory, creating it
+    on first use.
+
+    Args:
+        backend (str, optional): "sqlite" for the LRU over SQLite or "memory" to keep all sessions
+        in RAM. Defaults to the RENOCHAT_MEMORY_BACKEND environment variable, or "sqlite" if not set.
+
+    Returns:
+        store with get(session_id, default) and put(session_id, memory) methods
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = backend or os.environ.get("RENOCHAT_MEMORY_BACKEND", "sqlite")
+            if backend == "memory":
+                _store = InProcessMemoryStore()
+            elif backend == "sqlite":
+                _store = SQLiteMemoryStore()
+                # write the sessions still held in RAM to disk on shutdown
+                atexit.register(_store.flush)
+            else:
+                raise ValueError(f"Unknown RenoChat memory backend: {backend}")
+    return _store
@@ -0,0 +1,206 @@
+import json
+import math
+
+import numpy as np
+
+
+class KLLSketch:
+    """Mergeable quantile sketch (KLL) over a stream of values.
+
+    Values are kept in levels of compactors, where a value at level h stands for 2**h values of the
+    stream. When a level outgrows its capacity, its values are sorted and every other one is promoted
+    to the level above. Memory stays bounded by about 3k values however many values are added, and
+    quantiles have a rank error of about 1.65% at the default k of 200. Sketches built over different
+    values can be merged, and the merged sketch has the same error bound.
+
+    Args:
+        k (int, optional): capacity of the top level, which sets the accuracy. Defaults to 200.
+        levels (list, optional): values held at each level, for restoring a stored sketch. Defaults to None.
+    """
+
+    def __init__(self, k=200, levels=None):
+        self.k = k
+        self.levels = [np.asarray(level, dtype=np.float64) for level in (levels or [[]])]
+        # compaction keeps the odd or even positions at random, which keeps the estimates unbiased
+        self._rng = np.random.default_rng(0)
+
+    def _capacity(self, h):
+        """This function returns the capacity of level h, which shrinks geometrically below the top level"""
+        depth = len(self.levels) - h - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        """This function compacts every level that has outgrown its capacity, from the bottom up"""
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(self.levels[h])
+                # an odd value out stays at this level
+                keep = values[len(values) - len(values) % 2 :]
+                values = values[: len(values) - len(values) % 2]
+                promoted = values[self._rng.integers(2) :: 2]
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.levels[h] = keep
+            h += 1
+
+    def update(self, values):
+        """This function adds values to the sketch.
+
+        Args:
+            values (array-like): values to add
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.levels[0] = np.concatenate([self.levels[0], values[~np.isnan(values)]])
+        self._compress()
+
+    def merge(self, *others):
+        """This function merges other sketches into this one.
+
+        Args:
+            others (KLLSketch): sketches to merge
+        """
+        num_levels = max([len(self.levels)] + [len(other.levels) for other in others])
+        combined = [[self.levels[h]] if h < len(self.levels) else [] for h in range(num_levels)]
+        for other in others:
+            for h, level in enumerate(other.levels):
+                combined[h].append(level)
+        self.levels = [
+            np.concatenate(parts) if len(parts) > 0 else np.empty(0) for parts in combined
+        ]
+        # compacting once after all levels are combined is much cheaper than once per sketch
+        self._compress()
+        return self
+
+    def count(self):
+        """This function returns the number of values added to the sketch"""
+        return int(sum(len(level) * 2**h for h, level in enumerate(self.levels)))
+
+    def quantiles(self, qs):
+        """This function estimates the quantiles of the values added to the sketch.
+
+        Args:
+            qs (list): quantiles between 0 and 1, e.g. 0.5 for the median
+
+        Returns:
+            list: estimated quantiles, or None for each if the sketch is empty
+        """
+        values = np.concatenate(self.levels)
+        if len(values) == 0:
+            return [None for _ in qs]
+        weights = np.concatenate(
+            [np.full(len(level), 2**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(values, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(
+            cumulative, np.asarray(qs, dtype=np.float64) * cumulative[-1], side="left"
+        )
+        return values[order][np.minimum(positions, len(values) - 1)].tolist()
+
+    def to_dict(self):
+        """This function returns the sketch in a form that can be stored as JSON"""
+        return {"k": self.k, "levels": [level.tolist() for level in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """This function restores a sketch stored with to_dict"""
+        return cls(k=data["k"], levels=data["levels"])
+
+
+class PriceSketchIndex:
+    """Quantile sketches of HDB resale prices for every town, flat type and month, which can be
+    merged over any selection of towns, flat types and range of months.
+
+    Args:
+        sketches (dict): (town, flat_type, month) -> KLLSketch of resale prices
+    """
+
+    def __init__(self, sketches):
+        self.sketches = sketches
+
+    def sketch(
+        self, towns=None, flat_types=None, start_month=None, end_month=None, months=None
+    ):
+        """This function merges the sketches for the selection into one sketch.
+
+        Args:
+            towns (list, optional): towns to include. Defaults to None (all towns).
+            flat_types (list, optional): flat types to include. Defaults to None (all flat types).
+            start_month (str, optional): first month to include, as YYYY-MM. Defaults to None (earliest month).
+            end_month (str, optional): last month to include, as YYYY-MM. Defaults to None (latest month).
+            months (list, optional): months to include, as YYYY-MM. Defaults to None (all months in the range).
+
+        Returns:
+            KLLSketch: merged sketch of the resale prices in the selection
+        """
+        towns = None if towns is None else set(towns)
+        flat_types = None if flat_types is None else set(flat_types)
+        months = None if months is None else set(months)
+        selected = [
+            sketch
+            for (town, flat_type, month), sketch in self.sketches.items()
+            if (towns is None or town in towns)
+            and (flat_types is None or flat_type in flat_types)
+            and (start_month is None or month >= start_month)
+            and (end_month is None or month <= end_month)
+            and (months is None or month in months)
+        ]
+        return KLLSketch().merge(*selected)
+
+    def quantiles(
+        self,
+        qs=(0.5,),
+        towns=None,
+        flat_types=None,
+        start_month=None,
+        end_month=None,
+        months=None,
+    ):
+        """This function estimates quantiles of the resale prices in the selection, e.g. the median.
+
+        Args:
+            qs (tuple, optional): quantiles between 0 and 1. Defaults to (0.5,).
+            towns (list, optional): towns to include. Defaults to None (all towns).
+            flat_types (list, optional): flat types to include. Defaults to None (all flat types).
+            start_month (str, optional): first month to include, as YYYY-MM. Defaults to None (earliest month).
+            end_month (str, optional): last month to include, as YYYY-MM. Defaults to None (latest month).
+            months (list, optional): months to include, as YYYY-MM. Defaults to None (all months in the range).
+
+        Returns:
+            list: estimated quantiles, or None for each if the selection has no transactions
+        """
+        return self.sketch(towns, flat_types, start_month, end_month, months).quantiles(qs)
+
+
+def load_sketches(filepath):
+    """This function loads the stored price sketches.
+
+    Args:
+        filepath (str): location of the stored sketches
+
+    Returns:
+        dict: (town, flat_type, month) -> KLLSketch
+    """
+    with open(filepath) as file:
+        stored = json.load(file)
+    return {
+        (entry["town"], entry["flat_type"], entry["month"]): KLLSketch.from_dict(entry)
+        for entry in stored
+    }
+
+
+def save_sketches(sketches, filepath):
+    """This function stores the price sketches as JSON.
+
+    Args:
+        sketches (dict): (town, flat_type, month) -> KLLSketch
+        filepath (str): location to store the sketches
+    """
+    stored = [
+        dict(town=town, flat_type=flat_type, month=month, **sketch.to_dict())
+        for (town, flat_type, month), sketch in sorted(sketches.items())
+    ]
+    with open(filepath, "w") as file:
+        json.dump(stored, file)
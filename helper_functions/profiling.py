@@ -0,0 +1,163 @@
+import collections
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+
+# Profiling is off unless the environment variable APP_PROFILING is 1, or it is turned on from the admin page
+enabled = os.environ.get("APP_PROFILING", "0") == "1"
+
+# most recent profiled reruns, newest last
+reruns = collections.deque(maxlen=200)
+
+# the next rerun started is sampled for a flamegraph
+capture_next = False
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class _Sampler(threading.Thread):
+    """Sampling profiler of one thread. Every interval, the thread's call stack is recorded, and the
+    samples are kept as folded stacks, the input format of flamegraph tools.
+
+    Args:
+        thread_id (int): identifier of the thread to sample
+        interval (float, optional): seconds between samples. Defaults to 0.005.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """This function stops sampling and returns the samples as folded stacks, one "stack count" per line"""
+        self._stop_event.set()
+        self.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.most_common())
+
+
+def start_rerun(name, session_id=None):
+    """This function starts the profile of a rerun of the script in the current thread, ending any
+    profile the thread left open, e.g. when the previous rerun was stopped early.
+
+    Args:
+        name (str): name of the script
+        session_id (str, optional): session rerunning the script. Defaults to None.
+    """
+    global capture_next
+    end_rerun()
+    if not enabled:
+        return
+    record = {
+        "started": time.time(),
+        "name": name,
+        "session_id": session_id,
+        "sections": [],
+        "seconds": None,
+        "folded_stacks": None,
+    }
+    record["_start"] = time.perf_counter()
+    with _lock:
+        if capture_next:
+            capture_next = False
+            record["_sampler"] = _Sampler(threading.get_ident())
+            record["_sampler"].start()
+    _local.record = record
+    _local.path = []
+
+
+def end_rerun():
+    """This function ends the profile of the rerun in the current thread and adds it to the buffer"""
+    record = getattr(_local, "record", None)
+    if record is None:
+        return
+    _local.record = None
+    record["seconds"] = time.perf_counter() - record.pop("_start")
+    sampler = record.pop("_sampler", None)
+    if sampler is not None:
+        record["folded_stacks"] = sampler.stop()
+    with _lock:
+        reruns.append(record)
+
+
+@contextlib.contextmanager
+def section(name):
+    """This function times the code within the context as a named section of the current rerun.
+    Outside a rerun, e.g. when a fragment reruns on its own, the section is profiled as a rerun itself.
+
+    Args:
+        name (str): name of section
+    """
+    if not enabled:
+        yield
+        return
+    standalone = getattr(_local, "record", None) is None
+    if standalone:
+        start_rerun(name)
+    _local.path.append(name)
+    path = "/".join(_local.path)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = getattr(_local, "record", None)
+        if record is not None:
+            record["sections"].append((path, time.perf_counter() - start))
+            _local.path.pop()
+            if standalone:
+                end_rerun()
+
+
+def profiled(name):
+    """This function returns a decorator that times every call of the function as a named section
+
+    Args:
+        name (str): name of section
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def section_summary():
+    """This function returns the number of calls and the mean and maximum seconds of each section over
+    the buffered reruns
+
+    Returns:
+        list: list of dictionaries, slowest mean first
+    """
+    with _lock:
+        records = list(reruns)
+    timings = collections.defaultdict(list)
+    for record in records:
+        for path, seconds in record["sections"]:
+            timings[path].append(seconds)
+    summary = [
+        {"section": path, "calls": len(s), "mean (s)": sum(s) / len(s), "max (s)": max(s)}
+        for path, s in timings.items()
+    ]
+    return sorted(summary, key=lambda row: -row["mean (s)"])
@@ -0,0 +1,133 @@
+import functools
+import re
+import threading
+
+# name -> SingleFlight, for every function wrapped with single_flight
+flights = {}
+
+
+def normalise_text(text):
+    """This function normalises text for matching identical requests, ignoring case, surrounding
+    whitespace and punctuation, and runs of whitespace.
+
+    Args:
+        text (str): text to normalise
+
+    Returns:
+        str: normalised text
+    """
+    return re.sub(r"\s+", " ", text.lower()).strip(" ?.!")
+
+
+class _Call:
+    """An execution in flight, which every identical request waits on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Process-wide coalescing of identical requests. While a request is executing, identical requests
+    from other sessions wait for it and share its result, or its exception, instead of executing again.
+    Nothing is kept once the request completes, so later requests execute afresh. A request that has
+    waited longer than the timeout stops waiting and executes itself, so that a hung request does not
+    hold up every identical request behind it.
+
+    Args:
+        name (str): name of the function, for reporting
+        timeout (float, optional): seconds to wait for an identical request. Defaults to 120.
+    """
+
+    def __init__(self, name, timeout=120):
+        self.name = name
+        self.timeout = timeout
+        self.requests = 0
+        self.coalesced = 0
+        self.timed_out = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """This function executes the function, unless an identical request is already executing, in
+        which case it waits for that request and returns its result. If that request does not complete
+        within the timeout, the function is executed for this request instead.
+
+        Args:
+            key (hashable): key identifying identical requests
+            function (callable): function to execute
+            args, kwargs: arguments of the function
+
+        Returns:
+            result of the function
+        """
+        with self._lock:
+            self.requests += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = function(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+        elif not call.done.wait(self.timeout):
+            with self._lock:
+                # the request executes after all, so it no longer counts as coalesced
+                self.coalesced -= 1
+                self.timed_out += 1
+            return function(*args, **kwargs)
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """This function returns the number of requests, how many were coalesced, and the coalescing rate"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "coalesced": self.coalesced,
+                "executions": self.requests - self.coalesced,
+                "timed_out": self.timed_out,
+                "coalescing_rate": self.coalesced / self.requests if self.requests else 0.0,
+            }
+
+
+def single_flight(key, timeout=120):
+    """This function returns a decorator that coalesces identical concurrent calls of the function.
+
+    Args:
+        key (callable): takes the arguments of the function and returns a hashable key, equal for
+        calls that must return the same result
+        timeout (float, optional): seconds a call waits for an identical call before executing
+        itself. Defaults to 120.
+
+    Returns:
+        callable: decorator
+    """
+
+    def decorator(function):
+        flight = flights.setdefault(function.__qualname__, SingleFlight(function.__qualname__, timeout))
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return flight.do(key(*args, **kwargs), function, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flight_stats():
+    """This function returns the coalescing statistics of every function wrapped with single_flight"""
+    return {name: flight.stats() for name, flight in flights.items()}
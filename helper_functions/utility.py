@@ -1,3 +1,6 @@
+import contextlib
+import math
+import os
 import streamlit as st
 import hmac
 
@@ -28,3 +31,136 @@ def check_password():
     if "password_correct" in st.session_state:
         st.error("😕 Password incorrect")
     return False
+
+
+def admin_password():
+    """This function returns the password of the admin page, set by the environment variable
+    ADMIN_PASSWORD or the admin_password secret, or None if neither is set, in which case the
+    admin page is turned off. It is separate from the password of the app, which all users share."""
+    password = os.environ.get("ADMIN_PASSWORD")
+    if password is None:
+        try:
+            password = st.secrets.get("admin_password")
+        except FileNotFoundError:
+            password = None
+    return password or None
+
+
+def check_admin_password():
+    """This functions provides password protection for the admin page, on top of the app password.
+    Returns `True` if the user entered the admin password in this session"""
+    password = admin_password()
+    if password is None:
+        return False
+
+    def admin_password_entered():
+        """Checks whether the admin password entered by the user is correct."""
+        st.session_state["admin_password_correct"] = hmac.compare_digest(
+            st.session_state["admin_password"], password
+        )
+        # DO NOT store the password.
+        del st.session_state["admin_password"]
+
+    # Return True if the admin password is validated.
+    if st.session_state.get("admin_password_correct", False):
+        return True
+    # Show input for admin password.
+    st.text_input(
+        "Please enter admin password to proceed",
+        type="password",
+        on_change=admin_password_entered,
+        key="admin_password",
+    )
+    if "admin_password_correct" in st.session_state:
+        st.error("😕 Password incorrect")
+    return False
+
+
+def paginated_table(table, filters, columns, key, page_size_options=(25, 50, 100)):
+    """This function displays the rows of a table that pass the filters one page at a time.
+    Sorting, searching and paging are done by the analytics database, so only the rows on the
+    current page are loaded and sent to the browser, however many rows pass the filters.
+
+    Args:
+        table (str): name of table in the analytics database
+        filters (dict): field -> list of accepted values
+        columns (list): fields to be displayed
+        key (str): prefix for the keys of the table widgets
+        page_size_options (tuple, optional): choices for the number of rows on each page. Defaults to (25, 50, 100).
+    """
+    # imported here so that the login screen does not wait for pandas to load
+    from helper_functions import analytics_db
+
+    col_search, col_sort, col_order = st.columns([2, 2, 1])
+    search = col_search.text_input("Search", key=f"{key}_search")
+    sort_by = col_sort.selectbox(
+        "Sort by", [None] + list(columns), key=f"{key}_sort", format_func=lambda x: x or "-"
+    )
+    ascending = col_order.radio(
+        "Order", ["Asc", "Desc"], key=f"{key}_order", horizontal=True
+    ) == "Asc"
+
+    # the number of rows on each page and the current page are chosen below the table, so
+    # they are read from the previous rerun of the widgets
+    page_size = st.session_state.get(f"{key}_page_size", page_size_options[0])
+    page = st.session_state.get(f"{key}_page", 1)
+    rows, total = analytics_db.select_page(
+        table,
+        filters,
+        columns=list(columns),
+        sort_by=sort_by,
+        ascending=ascending,
+        search=search,
+        page=page,
+        page_size=page_size,
+    )
+    num_pages = max(math.ceil(total / page_size), 1)
+    if page > num_pages:
+        # the filters have narrowed the rows down, go back to the first page
+        st.session_state[f"{key}_page"] = page = 1
+        rows, total = analytics_db.select_page(
+            table,
+            filters,
+            columns=list(columns),
+            sort_by=sort_by,
+            ascending=ascending,
+            search=search,
+            page=page,
+            page_size=page_size,
+        )
+    st.dataframe(rows, hide_index=True, use_container_width=True, key=f"{key}_df")
+
+    col_page, col_size, col_caption = st.columns([1, 1, 2])
+    col_page.number_input(
+        "Page", min_value=1, max_value=num_pages, step=1, key=f"{key}_page"
+    )
+    col_size.selectbox("Rows per page", page_size_options, key=f"{key}_page_size")
+    first_row = (page - 1) * page_size + 1 if total > 0 else 0
+    col_caption.caption(
+        f"Showing rows {first_row}-{min(page * page_size, total)} of {total}"
+    )
+
+
+@contextlib.contextmanager
+def model_call_queue(tool, session_id):
+    """This function runs the model calls made within the context under the tool's budget in the
+    shared scheduler, showing the queue position and estimated wait while a call waits to be admitted.
+
+    Args:
+        tool (str): tool making the model calls
+        session_id (str): session making the model calls
+    """
+    from helper_functions.admission import admission_context
+
+    placeholder = st.empty()
+
+    def on_wait(position, eta):
+        placeholder.caption(
+            f"Busy right now: {position} request(s) ahead of yours, about {math.ceil(eta)}s to go"
+        )
+
+    try:
+        with admission_context(tool=tool, session_id=session_id, on_wait=on_wait):
+            yield
+    finally:
+        placeholder.empty()
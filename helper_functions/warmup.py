@@ -0,0 +1,90 @@
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# step name -> seconds taken by the background warm-up
+warmup_timings = {}
+
+_started = False
+_sqlite_swapped = False
+_lock = threading.Lock()
+
+
+def use_pysqlite3():
+    """This function swaps the sqlite3 module for pysqlite3, since Chroma needs a newer SQLite than some
+    hosts provide. It runs once per process, and only on the Chroma path: at startup when RAG searches the
+    chromadb, before the warm-up thread starts and before any module using sqlite3 is imported, so that
+    every module sees the same sqlite3, or else when the chromadb is first opened, e.g. to export its
+    vectors."""
+    global _sqlite_swapped
+    with _lock:
+        if _sqlite_swapped:
+            return
+        __import__("pysqlite3")
+        sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+        _sqlite_swapped = True
+
+
+def _import(module):
+    """This function returns a warm-up step that imports the module"""
+    return lambda: importlib.import_module(module)
+
+
+def _construct(module, function):
+    """This function returns a warm-up step that calls a client constructor of the module"""
+    return lambda: getattr(importlib.import_module(module), function)()
+
+
+# heavy dependencies and model clients, in the order the tools are likely to need them
+warmup_steps = [
+    ("pandas", _import("pandas")),
+    ("logics.agent", _import("logics.agent")),
+    ("entity extractors", _construct("logics.entity_filter", "build_extractors")),
+    ("logics.rag_retrieval", _import("logics.rag_retrieval")),
+    ("openai client", _construct("helper_functions.llm", "get_client")),
+    ("tiktoken encoding", _construct("helper_functions.llm", "_get_encoding")),
+    ("langchain_openai", _import("langchain_openai")),
+    ("langchain pandas agent", _import("langchain_experimental.agents.agent_toolkits")),
+    ("langchain_cohere", _import("langchain_cohere")),
+    ("langchain retrievers", _import("langchain.retrievers.document_compressors")),
+    ("rag embeddings model", _construct("logics.rag_retrieval", "get_embeddings_model")),
+    ("rag language model", _construct("logics.rag_retrieval", "get_llm")),
+    ("rag vector store", _construct("logics.rag_retrieval", "get_numpy_store")),
+    ("data chat workers", _construct("helper_functions.worker_pool", "get_worker_pool")),
+]
+if os.environ.get("RAG_VECTOR_BACKEND", "numpy") == "chroma":
+    # Chroma, and the pysqlite3 it needs, are only imported when RAG searches the chromadb
+    warmup_steps.insert(8, ("chroma", _construct("logics.rag_retrieval", "_import_chroma")))
+
+
+def _warm():
+    """This function runs the warm-up steps one after another, recording the time each takes.
+    A failing step is skipped, and is retried when the tool that needs it is first used."""
+    for name, step in warmup_steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step '%s' failed: %s", name, e)
+            continue
+        warmup_timings[name] = time.perf_counter() - start
+
+
+def start_warmup():
+    """This function starts importing heavy dependencies and constructing model clients in a
+    background thread, once per process, so that they are ready by the time a tool is used.
+    Set the environment variable APP_WARMUP to 0 to turn this off.
+    """
+    global _started
+    if os.environ.get("APP_WARMUP", "1") == "0":
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_warm, name="app-warmup", daemon=True).start()
@@ -0,0 +1,288 @@
+import ast
+import contextlib
+import io
+import multiprocessing
+import os
+import queue
+import re
+import threading
+
+# location of the base datasets, stored as Arrow files that the workers memory-map
+shared_frame_directory = "./data/shared_frames"
+
+# output of a code run that is sent back, in characters
+max_output = 4000
+
+_pool = None
+_pool_lock = threading.Lock()
+_export_lock = threading.Lock()
+
+
+def _dataset_name(path):
+    """This function returns the name of the table that an Arrow file of shared_frame is a version of"""
+    return os.path.basename(path).rsplit("-", 2)[0]
+
+
+def _run_code(code, namespace):
+    """This function runs Python code the way the pandas agent's REPL tool does: every statement is
+    executed, and the value of a final expression is returned together with anything printed"""
+    code = re.sub(r"^(\s|`)*(?i:python)?\s*", "", code)
+    code = re.sub(r"(\s|`)*$", "", code)
+    tree = ast.parse(code)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if len(tree.body) > 0 and isinstance(tree.body[-1], ast.Expr):
+            exec(compile(ast.Module(tree.body[:-1], type_ignores=[]), "<agent>", "exec"), namespace)
+            result = eval(compile(ast.Expression(tree.body[-1].value), "<agent>", "eval"), namespace)
+        else:
+            exec(compile(tree, "<agent>", "exec"), namespace)
+            result = None
+    printed = output.getvalue()
+    return printed + ("" if result is None else str(result))
+
+
+def _worker_main(conn, memory_limit_mb):
+    """This function is the loop of a worker process. The worker attaches to the base datasets by
+    memory-mapping their Arrow files, so the datasets are shared with the other workers through the
+    page cache, and runs code on the rows it is given until it is told to release them."""
+    import resource
+
+    if memory_limit_mb:
+        # file-backed mappings, i.e. the shared datasets, do not count towards this limit
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    # imported before the first task, so that the worker is warm
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+
+    tables = {}
+    namespace = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        try:
+            if message[0] == "attach":
+                _, path, positions = message
+                if path not in tables:
+                    # older versions of the dataset are unmapped, so that the space of their deleted files is freed
+                    for old in [old for old in tables if _dataset_name(old) == _dataset_name(path)]:
+                        del tables[old]
+                    tables[path] = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+                # only the selected rows are copied out of the shared dataset
+                df = tables[path].take(positions).to_pandas()
+                namespace = {"df": df, "pd": pd, "np": np}
+                conn.send((True, len(df)))
+            elif message[0] == "run":
+                conn.send((True, _run_code(message[1], namespace)[:max_output]))
+            elif message[0] == "release":
+                namespace = None
+                conn.send((True, None))
+        except MemoryError:
+            conn.send((False, "MemoryError: the computation exceeded the worker's memory limit"))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class WorkerUnavailable(ValueError):
+    """Raised when no worker can be leased, because every worker is busy or attaching failed, with a
+    message for the user"""
+
+
+class _Worker:
+    """A worker process and the pipe to it"""
+
+    def __init__(self, ctx, memory_limit_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.healthy = True
+
+    def call(self, message, timeout):
+        """This function sends a message to the worker and returns its reply. The worker is terminated
+        if it does not reply within the timeout.
+
+        Raises:
+            ValueError: if the worker fails the task, times out or dies
+        """
+        if not self.healthy:
+            raise ValueError("Computation terminated unexpectedly")
+        try:
+            self.conn.send(message)
+            if not self.conn.poll(timeout):
+                self.stop()
+                raise ValueError(f"Computation timed out after {timeout}s")
+            ok, output = self.conn.recv()
+        except (EOFError, OSError):
+            self.stop()
+            raise ValueError("Computation terminated unexpectedly")
+        if not ok:
+            raise ValueError(output)
+        return output
+
+    def run(self, code, timeout=10):
+        """This function runs agent code on the attached rows, returning its output, or the error as
+        text so that the agent can correct its code"""
+        try:
+            return self.call(("run", code), timeout)
+        except ValueError as e:
+            return str(e)
+
+    def stop(self):
+        """This function terminates the worker"""
+        self.healthy = False
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """Pool of long-lived worker processes that run data chat code on the base datasets, so that heavy
+    or runaway computations do not hold up the Streamlit server. Each worker is leased to one request at
+    a time and attached to the rows the request selected; a worker that times out or dies is replaced.
+
+    Args:
+        size (int): number of workers
+        memory_limit_mb (int): memory limit of each worker in MB, or 0 for no limit
+    """
+
+    def __init__(self, size, memory_limit_mb):
+        # workers are spawned rather than forked, since the server process runs many threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._memory_limit_mb = memory_limit_mb
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(_Worker(self._ctx, memory_limit_mb))
+
+    @contextlib.contextmanager
+    def lease(self, path, positions, timeout=10):
+        """This function leases an idle worker, attached to the selected rows of a base dataset, for the
+        duration of the context. Variables defined by code run on the worker persist until it is released.
+
+        Args:
+            path (str): location of the Arrow file of the base dataset
+            positions (np.ndarray): positions of the selected rows
+            timeout (int, optional): seconds allowed for waiting for an idle worker, and for attaching. Defaults to 10.
+
+        Raises:
+            WorkerUnavailable: if no worker becomes idle within the timeout, or attaching fails
+
+        Returns:
+            _Worker: worker to run code on
+        """
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerUnavailable(
+                "Busy right now: every data chat worker is in use. Please try again in a moment."
+            ) from None
+        try:
+            try:
+                worker.call(("attach", path, positions), timeout)
+            except ValueError as e:
+                raise WorkerUnavailable("The data chat could not load the selected rows. Please try again.") from e
+            yield worker
+            if worker.healthy:
+                try:
+                    worker.call(("release",), timeout)
+                except ValueError:
+                    # the answer is not lost for a worker that failed to release its rows, which is replaced
+                    worker.stop()
+        finally:
+            # a worker that timed out or died was terminated, and is replaced
+            if not worker.healthy:
+                worker = _Worker(self._ctx, self._memory_limit_mb)
+            self._idle.put(worker)
+
+
+def get_worker_pool():
+    """This function returns the data chat worker pool, starting it on first use. The number of workers
+    and their memory limit in MB are set by the environment variables DATA_CHAT_WORKERS (default 2, 0 to
+    run the data chat in the server process) and DATA_CHAT_WORKER_MEMORY_MB (default 1024).
+
+    Returns:
+        WorkerPool: worker pool, or None if it is turned off
+    """
+    global _pool
+    size = int(os.environ.get("DATA_CHAT_WORKERS", "2"))
+    if size == 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(size, int(os.environ.get("DATA_CHAT_WORKER_MEMORY_MB", "1024")))
+    return _pool
+
+
+def shared_frame(source):
+    """This function returns the Arrow file of the base dataset that a data chat frame was selected from,
+    exporting it from the analytics database if this version has not been exported yet, and the
+    positions of the selected rows in it. Older versions of the dataset are deleted once a new one is
+    exported. A worker that still has an older version memory-mapped keeps reading it until it is next
+    attached, when it unmaps it and the space of the deleted file is freed.
+
+    Args:
+        source (tuple): SELECT statement for the frame rows and its parameters, from analytics_db.select_sql
+
+    Returns:
+        tuple: location of the Arrow file, and positions of the selected rows
+    """
+    import pyarrow as pa
+
+    from helper_functions import analytics_db
+
+    sql, params = source
+    table = re.match(r"SELECT .+? FROM (\w+)", sql).group(1)
+    path = f"{shared_frame_directory}/{table}-{analytics_db.data_version()}.arrow"
+    with _export_lock:
+        if not os.path.exists(path):
+            os.makedirs(shared_frame_directory, exist_ok=True)
+            # rows in table order, so that a row's position is its rowid less one
+            df = analytics_db.read_sql(analytics_db.select_sql(table)[0] + " ORDER BY rowid")
+            with pa.OSFile(path + ".tmp", "wb") as sink:
+                arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+                with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                    writer.write_table(arrow_table)
+            os.replace(path + ".tmp", path)
+            for name in os.listdir(shared_frame_directory):
+                old = f"{shared_frame_directory}/{name}"
+                if name.endswith(".arrow") and old != path and _dataset_name(old) == table:
+                    try:
+                        os.remove(old)
+                    except OSError:
+                        # e.g. a file that is still mapped cannot be deleted on Windows, and is deleted on
+                        # the next export instead
+                        pass
+    positions = analytics_db.read_sql(
+        re.sub(r"^SELECT .+? FROM (\w+)", r"SELECT rowid - 1 AS position FROM \1", sql)
+        + " ORDER BY rowid",
+        params,
+    )["position"].to_numpy()
+    return path, positions
+
+
+def pool_tool(tool, worker, timeout=10):
+    """This function returns a copy of the pandas agent's REPL tool that runs the agent's code on a
+    leased worker instead of in the server process.
+
+    Args:
+        tool (BaseTool): REPL tool of the pandas agent
+        worker (_Worker): leased worker
+        timeout (int, optional): seconds allowed for each code run. Defaults to 10.
+
+    Returns:
+        BaseTool: tool with the same name, description and arguments
+    """
+    from langchain_core.tools import StructuredTool
+
+    return StructuredTool.from_function(
+        func=lambda query: worker.run(query, timeout),
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+    )
@@ -1,8 +1,6 @@
-from langchain.agents.agent_types import AgentType
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-
-from helper_functions import llm
+from helper_functions import llm, profiling
+from helper_functions.single_flight import normalise_text, single_flight
+from logics import plan_executor
 
 system_msg_HDB = """<the_only_instruction>
     You are given a dataset on the details of HDB resale flat transactions across various locations in Singapore\
@@ -42,25 +40,86 @@ system_msg_CEA = """<the_only_instruction>
     """
 
 
-def LLM_query_df(query, df, sys_msg, flag=True, model="gpt-4o-mini", temperature=0):
+def _query_df_key(
+    query,
+    df,
+    sys_msg,
+    flag=True,
+    model="gpt-4o-mini",
+    temperature=0,
+    mode="agent",
+    source=None,
+    narrowing=None,
+):
+    """This function returns the key identifying identical LLM_query_df requests, which are coalesced"""
+    import pandas as pd
+
+    # the rows queried are identified by the statement that selected them, or else by their contents
+    rows = repr(source) if source is not None else int(pd.util.hash_pandas_object(df).sum())
+    return (normalise_text(query), sys_msg, flag, model, temperature, mode, rows, narrowing)
+
+
+@profiling.profiled("LLM_query_df")
+@single_flight(_query_df_key)
+def LLM_query_df(
+    query,
+    df,
+    sys_msg,
+    flag=True,
+    model="gpt-4o-mini",
+    temperature=0,
+    mode="agent",
+    source=None,
+    narrowing=None,
+):
     """This function takes in user query and the dataframe on which
     the query is to be applied on. It also takes in the relevant LLM system message as well as a flag
     to determine if the LLM is to be used on HDB or CEA data. It then passes the query through
     malicious activity and content relevant checks, before sending
     the query and dataframe to the pandas agent and LLM to provide a response.
+    In "oneshot" mode, the pandas agent is replaced by a single validated pandas expression
+    run in a sandbox, and queries with a cached plan skip the LLM entirely. If the SQL statement that
+    selected the dataframe rows is given, the plan is a SQL statement run on the analytics database instead.
+    If the rows were narrowed to the entities named in the query, the narrowing is stated to the agent.
 
     Args:
         query (str): input user query
-        df (pd.DataFrame): pandas dataframe to query from
+        df (pd.DataFrame): pandas dataframe to query from, or None to load the rows selected by source only
+        where they are needed
         sys_msg (str) : system message to be passed to LLM
         flag (boolean) : True - HDB, False - CEA. Defaults to True
         model (str, optional): _description_. Defaults to "gpt-4o-mini".
         temperature (int, optional): _description_. Defaults to 0.
+        mode (str, optional): "agent" for the pandas agent or "oneshot" for the plan executor. Defaults to "agent".
+        source (tuple, optional): SELECT statement for the dataframe rows and its parameters. Defaults to None.
+        narrowing (str, optional): how the rows were narrowed to the entities in the query, from
+        entity_filter.narrow_filters. Defaults to None.
 
     Returns:
         str: response from LLM or templated response
     """
 
+    # the agent is told how the rows were narrowed, so that it knows which rows the dataframe holds
+    agent_query = query if narrowing is None else f"{query}\n\n{narrowing}"
+
+    # Without the dataframe, the rows selected by source are only loaded here if the agent runs its code
+    # in this process. The worker pool and SQL plans read them from the analytics database themselves,
+    # so only the first rows are loaded, for the schema and sample shown to the LLM. The worker pool is
+    # only started for the agent, since plans do not use it.
+    from helper_functions import analytics_db, worker_pool
+
+    pool = worker_pool.get_worker_pool() if source is not None and mode == "agent" else None
+    if df is None:
+        if mode == "agent" and pool is None:
+            df = analytics_db.read_sql(*source)
+        else:
+            df = analytics_db.read_sql(f"{source[0]} LIMIT 5", source[1])
+
+    # Plans are only cached for queries that passed the checks below, so a cached plan can be run directly
+    language = "pandas" if source is None else "sql"
+    if mode == "oneshot" and plan_executor.cached_plan(agent_query, df, language) is not None:
+        return plan_executor.answer_query(agent_query, df, source=source)
+
     # Step 0: Safeguard the agent from malicious prompt
     # if query is deemed to be malicious, exit function with message
     if llm.check_for_malicious_intent(query) == "Y":
@@ -95,10 +154,23 @@ def LLM_query_df(query, df, sys_msg, flag=True, model="gpt-4o-mini", temperature
     if response == "N":
         return "Sorry, query potentially unrelated to dataset. Please consider rephrasing your query."
 
-    # Step 2 : initialise the LLM
-    llm_ = ChatOpenAI(model=model, temperature=temperature)
+    # Step 2 : In oneshot mode, answer with a single sandboxed pandas expression instead of the agent
+    if mode == "oneshot":
+        return plan_executor.answer_query(
+            agent_query, df, model=model, temperature=temperature, source=source
+        )
 
-    # Step 3: initialise the agent
+    # LangChain is imported on first use of the agent, to keep app startup fast
+    from langchain.agents.agent_types import AgentType
+    from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+    from langchain_openai import ChatOpenAI
+
+    from helper_functions.admission import http_client
+
+    # Step 2a : initialise the LLM
+    llm_ = ChatOpenAI(model=model, temperature=temperature, http_client=http_client("openai"))
+
+    # Step 2b: initialise the agent
     agent = create_pandas_dataframe_agent(
         llm_,
         df,
@@ -107,8 +179,21 @@ def LLM_query_df(query, df, sys_msg, flag=True, model="gpt-4o-mini", temperature
         allow_dangerous_code=True,
     )
 
+    # Step 3 : Run the agent's code on a worker process attached to the selected rows, if the worker pool is on
+    if pool is None:
+        response = agent.invoke(agent_query)
+    else:
+        try:
+            with pool.lease(*worker_pool.shared_frame(source)) as worker:
+                agent.tools = [
+                    worker_pool.pool_tool(tool, worker) if tool.name == "python_repl_ast" else tool
+                    for tool in agent.tools
+                ]
+                response = agent.invoke(agent_query)
+        except worker_pool.WorkerUnavailable as e:
+            return str(e)
+
     # Step 4 : Extract the response from LLM
-    response = agent.invoke(query)
     # If there is no output in the returned response, inform the user accordingly
     if response.get("output", "") == "":
         return "The LLM is unable to provide an answer to your query. Please consider refining your query."
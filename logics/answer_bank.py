@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+
+from helper_functions.single_flight import normalise_text
+
+# location of the precomputed answers
+answer_bank_path = "./data/rag_answer_bank.json"
+
+# curated questions, listed as sample queries on the ResaleSearch form
+sample_queries = [
+    "What are the details regarding the option fee and option period when purchasing a resale HDB flat?",
+    "What are the terms and conditions for obtaining a housing loan from HDB for a resale flat?",
+    "Can I cancel my HDB resale application?",
+    "How is property tax calculated?",
+    "What is the buyer stamp duty for purchasing an HDB resale flat?",
+    "What is the maximum household income to qualify for CPF housing grants?",
+]
+
+# words that do not change the question asked, e.g. "Can we cancel our HDB resale application" asks the same
+# as "Can I cancel my HDB resale application". Negations are not among them.
+_stop_words = {
+    "a", "an", "the", "i", "me", "my", "we", "us", "our", "please", "kindly", "pls", "hi", "hello",
+    "thanks", "thank", "you",
+}
+
+
+def corpus_version(chunks):
+    """This function returns a version of the indexed corpus, which changes whenever a chunk is added,
+    removed or changed.
+
+    Args:
+        chunks (list): chunks of the vector store, with their ids and contents
+
+    Returns:
+        str: version of the corpus
+    """
+    contents = json.dumps([(chunk["id"], chunk["page_content"]) for chunk in chunks])
+    return hashlib.sha1(contents.encode()).hexdigest()
+
+
+def settings_key(sys_msg, diversity, similarity_threshold):
+    """This function returns a key for the settings an answer was generated with, since an answer is
+    only served to queries asked with the same settings"""
+    return hashlib.sha1(json.dumps([sys_msg, diversity, similarity_threshold]).encode()).hexdigest()
+
+
+@lru_cache(maxsize=4)
+def _load(path, mtime, version):
+    """This function loads the answer bank, keeping only the answers generated from this version of
+    the corpus. The modification time is part of the cache key, so that a rebuilt bank is reloaded."""
+    with open(path) as file:
+        bank = json.load(file)
+    if bank.get("corpus_version") != version:
+        return []
+    return bank["entries"]
+
+
+def content_words(text):
+    """This function returns the words of a question that change what it asks, in order, leaving out case,
+    punctuation and stop words. Two questions with the same content words ask the same question, while a
+    word inserted, removed or changed, e.g. "not" in "can I not cancel" or "seller" for "buyer", does not.
+
+    Args:
+        text (str): question
+
+    Returns:
+        list: content words
+    """
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in _stop_words]
+
+
+def lookup(
+    query,
+    sys_msg,
+    diversity,
+    similarity_threshold,
+    version,
+    path=answer_bank_path,
+):
+    """This function returns the precomputed answer to a curated question, if the query is the same
+    question, differing at most in case, punctuation or stop words, and the corpus has not changed since
+    the answer was generated.
+
+    Args:
+        query (str): user query input
+        sys_msg (str): system message to be passed to the LLM
+        diversity (float): the lambda multipler input (0-1) to maximal marginal relevance
+        similarity_threshold (float): document similarity threshold (0-1)
+        version (str): version of the indexed corpus, from corpus_version
+        path (str, optional): location of the precomputed answers. Defaults to "./data/rag_answer_bank.json".
+
+    Returns:
+        tuple: the answer and the corresponding sources, or None if there is no match
+    """
+    if not os.path.exists(path):
+        return None
+    entries = _load(path, os.path.getmtime(path), version)
+    key = settings_key(sys_msg, diversity, similarity_threshold)
+    words = content_words(query)
+    for entry in entries:
+        if entry["settings"] != key:
+            continue
+        if content_words(entry["key"]) == words:
+            from langchain_core.documents import Document
+
+            sources = [Document(**source) for source in entry["sources"]]
+            return entry["answer"], sources
+    return None
+
+
+def build_answer_bank(
+    queries=sample_queries, diversity=0.7, similarity_threshold=0.5, path=answer_bank_path
+):
+    """This function answers the curated questions with the full RAG pipeline and stores each answer
+    with its sources and the version of the corpus it was generated from.
+
+    Args:
+        queries (list, optional): curated questions. Defaults to the ResaleSearch sample queries.
+        diversity (float): the lambda multipler input (0-1) to maximal marginal relevance. Default to 0.7
+        similarity_threshold (float): document similarity threshold (0-1). Default to 0.5.
+        path (str, optional): location to store the answers. Defaults to "./data/rag_answer_bank.json".
+    """
+    from logics import rag_retrieval
+
+    key = settings_key(rag_retrieval.system_msg_search, diversity, similarity_threshold)
+    entries = []
+    for i, (answer, sources) in rag_retrieval.retrievalQA_batch(
+        queries,
+        rag_retrieval.get_embeddings_model(),
+        rag_retrieval.system_msg_search,
+        rag_retrieval.get_llm(),
+        diversity=diversity,
+        similarity_threshold=similarity_threshold,
+    ):
+        # answers that were refused are not worth serving
+        if sources is None or "I am sorry but I don't know" in answer:
+            print(f"No answer stored for: {queries[i]}")
+            continue
+        entries.append(
+            {
+                "query": queries[i],
+                "key": normalise_text(queries[i]),
+                "settings": key,
+                "answer": answer,
+                "sources": [
+                    {"page_content": doc.page_content, "metadata": doc.metadata} for doc in sources
+                ],
+            }
+        )
+    bank = {
+        "corpus_version": rag_retrieval.get_corpus_version(),
+        "entries": sorted(entries, key=lambda entry: entry["query"]),
+    }
+    with open(path, "w") as file:
+        json.dump(bank, file, indent=1)
+    print(f"Stored {len(entries)} of {len(queries)} answers in {path}")
+
+
+if __name__ == "__main__":
+    # Run from the repository root after rag_preretrieval has rebuilt the vector store:
+    # python -m logics.answer_bank
+    build_answer_bank()
@@ -0,0 +1,88 @@
+import re
+
+from langchain_core.documents import Document
+
+from helper_functions import llm
+
+
+def _merge_spans(documents):
+    """This function merges documents from the same source whose text overlaps or is adjacent,
+    using their start_index metadata. Each merged span keeps the rank of its most relevant document.
+
+    Args:
+        documents (list): documents in relevance order
+
+    Returns:
+        list: list of (rank, source, start, text), one for each merged span
+    """
+    spans = []
+    by_source = {}
+    for rank, doc in enumerate(documents):
+        start = doc.metadata.get("start_index")
+        if start is None:
+            # documents without a position cannot be merged
+            spans.append((rank, None, None, doc.page_content))
+            continue
+        by_source.setdefault(doc.metadata.get("source"), []).append((start, rank, doc.page_content))
+
+    for source, chunks in by_source.items():
+        chunks.sort()
+        start, rank, text = chunks[0]
+        for next_start, next_rank, next_text in chunks[1:]:
+            end = start + len(text)
+            # chunks are stripped of whitespace when split, so a gap of a few characters is still adjacent
+            if next_start <= end + 2:
+                overlap = max(0, end - next_start)
+                if next_start + len(next_text) > end:
+                    separator = "" if overlap > 0 else "\n"
+                    text = text + separator + next_text[overlap:]
+                rank = min(rank, next_rank)
+            else:
+                spans.append((rank, source, start, text))
+                start, rank, text = next_start, next_rank, next_text
+        spans.append((rank, source, start, text))
+    return sorted(spans, key=lambda span: span[0])
+
+
+def _shingles(text, n=5):
+    """This function returns the set of n-word shingles of the text, for detecting near-duplicates"""
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i : i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def pack_context(documents, max_tokens=1200, duplicate_threshold=0.8):
+    """This function packs the retrieved documents into the context passed to the LLM. Overlapping or
+    adjacent chunks of the same page are merged so that their shared text is sent once, near-duplicate
+    passages are dropped, and the remaining passages are added in relevance order until the token
+    budget is used up.
+
+    Args:
+        documents (list): documents in relevance order, e.g. from the reranker
+        max_tokens (int, optional): token budget of the context. Defaults to 1200.
+        duplicate_threshold (float, optional): share of shingles in common (0-1) above which a passage
+        is a near-duplicate of a more relevant one. Defaults to 0.8.
+
+    Returns:
+        list: packed documents, in relevance order
+    """
+    packed = []
+    kept_shingles = []
+    tokens = 0
+    for rank, source, start, text in _merge_spans(documents):
+        shingles = _shingles(text)
+        if any(
+            len(shingles & kept) / min(len(shingles), len(kept)) >= duplicate_threshold
+            for kept in kept_shingles
+        ):
+            continue
+        num_tokens = llm.count_tokens(text)
+        if len(packed) > 0 and tokens + num_tokens > max_tokens:
+            # a shorter, less relevant passage may still fit. The most relevant passage is always kept.
+            continue
+        metadata = dict(documents[rank].metadata)
+        if start is not None:
+            metadata["start_index"] = start
+        packed.append(Document(page_content=text, metadata=metadata))
+        kept_shingles.append(shingles)
+        tokens += num_tokens
+    return packed
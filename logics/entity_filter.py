@@ -0,0 +1,464 @@
+import re
+from collections import deque
+from functools import lru_cache
+
+from helper_functions import analytics_db, profiling
+
+# field of each table holding the period of a transaction, whose values start with the year and month
+date_fields = {"resale_details": "month", "agent_txn": "resale_transaction_date"}
+
+# fields of each table whose values are recognised in questions
+entity_fields = {
+    "resale_details": ["town", "flat_type", "flat_model"],
+    "agent_txn": ["town", "sales_agent_name", "sales_agent_reg_num", "real_estate_company_name"],
+}
+
+# words that widen a question beyond the entities it names, e.g. "other towns", "excluding Bishan" or
+# "compared with the whole of Singapore", since the answer needs rows of other entities too, in which
+# case the rows are not narrowed
+_widening_words = {
+    "other", "others", "rest", "except", "excluding", "exclude", "without", "not", "besides", "apart",
+    "outside", "overall", "national", "nationwide", "islandwide", "singapore", "whole",
+}
+
+# words that compare a period with another, e.g. "compared to last year", in which case the period
+# is not narrowed
+_comparing_words = {"compare", "compared", "comparing", "comparison", "than", "vs", "versus"}
+
+# words that rank or compare the entities of a field, e.g. "how does Bishan rank", "cheaper than Bishan"
+# or "which town has the most sales", and words that take a share of a field, e.g. "what share of sales
+# were in Sengkang", whose answer needs the rows of the field's other values
+_ranking_words = _comparing_words | {
+    "rank", "ranks", "ranked", "ranking", "among", "amongst", "all", "every", "each", "most", "least",
+    "highest", "lowest", "top", "bottom",
+}
+_share_words = {"fraction", "share", "percentage", "percent", "proportion", "ratio"}
+
+# words naming each entity field, e.g. "towns" in "which towns are cheaper than Bishan", or "agents" in
+# "top 3 agents in Tampines", which ranks agents, not towns
+_field_words = {
+    "town": {"town", "towns", "area", "areas"},
+    "flat_type": {"type", "types"},
+    "flat_model": {"model", "models"},
+    "sales_agent_name": {"agent", "agents", "salesperson", "salespersons", "salespeople"},
+    "sales_agent_reg_num": {"agent", "agents", "salesperson", "salespersons", "salespeople"},
+    "real_estate_company_name": {"agency", "agencies", "company", "companies", "firm", "firms"},
+}
+
+# number of words between a comparing word or "rank" and a named entity that it compares or ranks, e.g.
+# "cheaper than Bishan", "Bishan vs Tampines" or "how does Bishan rank"
+_ranking_reach = 2
+
+# words of other fields with dates, e.g. "lease commencing in 2024" or "built before 1990", after which a
+# date is not the period of the transactions
+_other_date_words = {
+    "lease", "leases", "commence", "commences", "commenced", "commencing", "commencement", "built",
+    "build", "completed", "completion", "constructed", "construction",
+}
+
+# legal suffixes of agency names, which users tend to leave out
+_legal_suffixes = [["pte", "ltd"], ["private", "limited"], ["limited"], ["ltd"], ["llp"]]
+
+_number_words = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+_month_numbers = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_month = (
+    r"(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b"
+)
+_year = r"((?:19|20)\d\d)\b"
+# a month with an optional year, a quarter with a year, or a year
+_date = rf"(?:{_month}(?:\s+{_year})?|q([1-4])\s+{_year}|{_year})"
+
+
+def normalise(text):
+    """This function lowercases text and reduces it to words separated by single spaces, writing flat
+    types such as "four-room" or "4rm" as "4 room"
+
+    Args:
+        text (str): text
+
+    Returns:
+        str: normalised text
+    """
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    text = re.sub(
+        rf"\b({'|'.join(_number_words)})\s*(?=(room|rm)s?\b)",
+        lambda m: f"{_number_words[m.group(1)]} ",
+        text,
+    )
+    text = re.sub(r"\b(\d)\s*(room|rm)s?\b", r"\1 room", text)
+    return text.strip()
+
+
+class Automaton:
+    """Aho-Corasick automaton over words, which finds every occurrence of a set of phrases in a text in
+    a single pass over its words, however many phrases there are. Working on words rather than
+    characters keeps the automaton small and only matches whole words.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        # phrases ending at each state, as (number of words, value)
+        self._output = [[]]
+
+    def add(self, words, value):
+        """This function adds a phrase, given as a list of words, and the value it stands for"""
+        state = 0
+        for word in words:
+            if word not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][word] = len(self._goto) - 1
+            state = self._goto[state][word]
+        if (len(words), value) not in self._output[state]:
+            self._output[state].append((len(words), value))
+
+    def build(self):
+        """This function links every state to the state of its longest proper suffix, after all phrases are added"""
+        queue = deque(self._goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for word, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail != 0 and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(word, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        return self
+
+    def find(self, words):
+        """This function returns every occurrence of the phrases in a list of words
+
+        Args:
+            words (list): words of the text
+
+        Returns:
+            list: (position of first word, number of words, value) of each occurrence
+        """
+        matches = []
+        state = 0
+        for i, word in enumerate(words):
+            while state != 0 and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            for length, value in self._output[state]:
+                matches.append((i - length + 1, length, value))
+        return matches
+
+
+def _is_ordinary_model(value):
+    """This function returns whether a flat model is a single ordinary word, e.g. Standard or Improved"""
+    words = normalise(str(value)).split()
+    return len(words) == 1 and not str(value).isupper() and words[0].isalpha()
+
+
+def _phrases(field, value):
+    """This function returns the phrases, as lists of words, by which a value of a field may be named"""
+    words = normalise(str(value)).split()
+    if len(words) == 0:
+        return []
+    if field == "town":
+        # e.g. KALLANG/WHAMPOA is also named by either part
+        return [words] + [normalise(part).split() for part in str(value).split("/") if "/" in str(value)]
+    if field == "flat_type":
+        return [words] + ([["exec"]] if words == ["executive"] else [])
+    if field == "flat_model":
+        # a one-word model that is an ordinary word, e.g. Standard or Improved, needs "model" next to it
+        if _is_ordinary_model(value):
+            return [words + ["model"], ["model"] + words]
+        return [words]
+    if field == "sales_agent_name":
+        # single names are too likely to be ordinary words
+        return [words] if len(words) >= 2 else []
+    if field == "real_estate_company_name":
+        phrases = [words]
+        for suffix in _legal_suffixes:
+            if words[-len(suffix):] == suffix and len(words) - len(suffix) >= 2:
+                phrases.append(words[: -len(suffix)])
+        return phrases
+    return [words]
+
+
+@lru_cache(maxsize=4)
+def get_extractor(table, data_version):
+    """This function builds the automaton over the values of the entity fields of a table, and collects
+    the values of its date field, once per data version.
+
+    Args:
+        table (str): name of table
+        data_version (str): version of the analytics database, so that the values are reloaded when it changes
+
+    Returns:
+        tuple: automaton whose values are (field, value, whether the phrase names the value on its own)
+        triples, and sorted values of the date field
+    """
+    automaton = Automaton()
+    # flat types come first, so that e.g. the flat model 2-room does not stand for the flat type 2 ROOM
+    seen = set()
+    for field in entity_fields[table]:
+        for value in analytics_db.distinct_values(table, field):
+            if value is None:
+                continue
+            for words in _phrases(field, value):
+                if field == "flat_model" and tuple(words) in seen:
+                    continue
+                seen.add(tuple(words))
+                automaton.add(words, (field, value, True))
+            if field == "flat_model" and _is_ordinary_model(value):
+                # on its own, e.g. "Improved" in "Standard model or Improved", it only counts when
+                # another flat model is named
+                automaton.add(normalise(str(value)).split(), (field, value, False))
+    dates = sorted(analytics_db.distinct_values(table, date_fields[table]), key=str)
+    return automaton.build(), dates
+
+
+def build_extractors():
+    """This function builds the extractors of both chat tables for the current data version, e.g. to warm them up"""
+    for table in entity_fields:
+        get_extractor(table, analytics_db.data_version())
+
+
+def extract_entities(words, automaton):
+    """This function finds the entities named in a question, preferring the leftmost and then longest
+    phrase where phrases overlap, e.g. an agency name over a town within it. A phrase that only names a
+    value next to others of its field, e.g. "Improved" in "Standard model or Improved", is only kept if
+    another value of the field is named.
+
+    Args:
+        words (list): words of the normalised question
+        automaton (Automaton): automaton over the entity values
+
+    Returns:
+        dict: field -> list of values named, in order of mention
+    """
+    entities = {}
+    weak = {}
+    end = 0
+    span = None
+    matches = sorted(automaton.find(words), key=lambda m: (m[0], -m[1]))
+    for position, length, (field, value, strong) in matches:
+        # a phrase may stand for more than one value, e.g. a name shared by two agents
+        if (position, length) != span:
+            if position < end:
+                continue
+            span = (position, length)
+            end = position + length
+        found = entities if strong else weak
+        if value not in found.setdefault(field, []):
+            found[field].append(value)
+    for field, values in weak.items():
+        if field in entities:
+            entities[field] += [value for value in values if value not in entities[field]]
+    return entities
+
+
+def _resolve(groups, latest):
+    """This function returns the first and last month of a date expression, as (year, month) pairs. A
+    month without a year is its latest occurrence up to the latest month of the data."""
+    month, month_year, quarter, quarter_year, year = groups
+    if month is not None:
+        number = _month_numbers[month[:3]]
+        if month_year is not None:
+            y = int(month_year)
+        else:
+            y = latest[0] if number <= latest[1] else latest[0] - 1
+        return (y, number), (y, number)
+    if quarter is not None:
+        q = int(quarter)
+        return (int(quarter_year), 3 * q - 2), (int(quarter_year), 3 * q)
+    return (int(year), 1), (int(year), 12)
+
+
+def _shift(month, n):
+    """This function returns the (year, month) pair n months after a (year, month) pair"""
+    index = month[0] * 12 + month[1] - 1 + n
+    return (index // 12, index % 12 + 1)
+
+
+def parse_period(text, months):
+    """This function finds the period a question is about, from phrases such as "since March", "in 2024",
+    "from Jan to Jun 2024", "before May", "Q2 2024" or "past 6 months". Months without a year and
+    relative periods are taken relative to the latest month of the data. A date that follows a word of
+    another field, e.g. "lease commencing in 2024" or "built before 1990", is not a period of the
+    transactions. A question with more than one period phrase, or one comparing periods, is not narrowed.
+
+    Args:
+        text (str): normalised question
+        months (list): sorted months of the data, as YYYY-MM
+
+    Returns:
+        tuple: first and last month of the period as YYYY-MM, or None if the question names no single period
+    """
+    words = set(text.split())
+    if len(months) == 0 or words & _comparing_words:
+        return None
+    latest = (int(months[-1][:4]), int(months[-1][5:]))
+    earliest = (int(months[0][:4]), int(months[0][5:]))
+    n = rf"(\d+|{'|'.join(_number_words)})"
+    patterns = [
+        # a range between two dates
+        (rf"\b(?:between|from)\s+{_date}\s+(?:and|to|until|till|through)\s+{_date}", "range"),
+        (rf"\b(?:since|from|starting|after)\s+{_date}", "since"),
+        (rf"\b(?:before|until|till|up to)\s+{_date}", "until"),
+        (rf"\b(?:in|during|for|of|on)\s+{_date}", "in"),
+        (rf"\b{_month}\s+{_year}|\bq([1-4])\s+{_year}|\b{_year}", "bare"),
+        (rf"\b(?:last|past|previous|latest)\s+{n}?\s*(month|year|quarter)s?\b", "recent"),
+        (r"\bthis\s+(month|year)\b", "this"),
+    ]
+    found = []
+    taken = []
+    for pattern, kind in patterns:
+        for match in re.finditer(pattern, text):
+            if any(start < match.end() and match.start() < end for start, end in taken):
+                continue
+            taken.append(match.span())
+            # up to three words before the date, e.g. "lease commence date in 2024"
+            before = text[: match.start()].split()[-3:]
+            if kind != "recent" and kind != "this" and set(before) & _other_date_words:
+                continue
+            found.append((kind, match))
+    if len(found) != 1:
+        return None
+
+    kind, match = found[0]
+    groups = match.groups()
+    if kind == "range":
+        start, _ = _resolve(groups[:5], latest)
+        _, end = _resolve(groups[5:], latest)
+        if start > end and groups[1] is None and groups[4] is None:
+            # e.g. "from Nov to Feb" starts in the year before
+            start = (start[0] - 1, start[1])
+    elif kind in ("since", "until", "in", "bare"):
+        first, last = _resolve(groups[:5], latest)
+        if kind == "since":
+            start, end = (_shift(last, 1) if match.group(0).startswith("after") else first), latest
+        elif kind == "until":
+            start, end = earliest, (_shift(first, -1) if match.group(0).startswith("before") else last)
+        else:
+            start, end = first, last
+    elif kind == "recent":
+        count = groups[0]
+        count = 1 if count is None else int(_number_words.get(count, count))
+        length = {"month": 1, "quarter": 3, "year": 12}[groups[1]] * count
+        start, end = _shift(latest, 1 - length), latest
+    else:
+        start, end = ((latest[0], 1), latest) if groups[0] == "year" else (latest, latest)
+
+    start, end = f"{start[0]}-{start[1]:02d}", f"{end[0]}-{end[1]:02d}"
+    if start > end or end < months[0] or start > months[-1]:
+        return None
+    return start, end
+
+
+def _ranked_fields(words, matches):
+    """This function returns the entity fields that a question ranks, compares or takes a share of, whose
+    rows are all needed to answer it. Those are the fields named by a word such as "towns" in a question
+    with a ranking word, e.g. "which towns are cheaper than Bishan", and otherwise the fields of entities
+    named next to a comparing word or "rank", e.g. "cheaper than Bishan" or "how does Bishan rank". A
+    share of a field that is not named, e.g. "what share of sales were in Sengkang", needs every field.
+
+    Args:
+        words (list): words of the normalised question
+        matches (list): occurrences of entity values in the words, from Automaton.find
+
+    Returns:
+        set: names of fields, or None for every field
+    """
+    if len(set(words) & (_ranking_words | _share_words)) == 0:
+        return set()
+    # words within entity names, e.g. "model" in "Standard model", do not name a field
+    covered = {i for position, length, _ in matches for i in range(position, position + length)}
+    present = {word for i, word in enumerate(words) if i not in covered}
+    fields = {field for field, nouns in _field_words.items() if present & nouns}
+    if len(fields) > 0:
+        return fields
+    if present & _share_words:
+        return None
+    # superlatives and "each" or "all" on their own stay within the entities named, e.g. "most expensive
+    # flat in Bishan", but an entity just before a comparing word or "rank", or just after a comparing
+    # word, is the one compared
+    fields = set()
+    for position, length, (field, _, _) in matches:
+        # the words next to the entity, up to another entity, e.g. not "vs" for 4 room in
+        # "Bishan vs Tampines 4 room"
+        end = position + length
+        while end < min(position + length + _ranking_reach, len(words)) and end not in covered:
+            end += 1
+        start = position
+        while start > max(position - _ranking_reach, 0) and start - 1 not in covered:
+            start -= 1
+        after, before = words[position + length : end], words[start:position]
+        if set(after) & _comparing_words or any(word.startswith("rank") for word in after):
+            fields.add(field)
+        if set(before) & _comparing_words:
+            fields.add(field)
+    return fields
+
+
+@profiling.profiled("entity filter")
+def narrow_filters(query, table, filters):
+    """This function narrows the filters of a chat table to the entities and the period named in a
+    question, e.g. "4 room flats in Bishan since March", so that the data chat works on the rows the
+    question is about rather than finding them itself. Only fields whose named values are among the
+    selected ones are narrowed. A field that the question ranks or compares is not narrowed, e.g. the
+    towns in "towns cheaper than Bishan" or "how does Bishan rank", while the other fields still are, e.g.
+    the town in "top 3 agents in Tampines". Nothing is narrowed for a question that reaches beyond the
+    entities it names, e.g. "Bishan compared with other towns", since its answer needs the rows of other
+    entities.
+
+    Args:
+        query (str): user question
+        table (str): name of table, resale_details or agent_txn
+        filters (dict): field -> list of selected values
+
+    Returns:
+        tuple: narrowed filters, and a description of the narrowing for the prompt, or None if nothing was narrowed
+    """
+    automaton, dates = get_extractor(table, analytics_db.data_version())
+    text = normalise(query)
+    words = text.split()
+    if set(words) & _widening_words:
+        return filters, None
+    ranked = _ranked_fields(words, automaton.find(words))
+    if ranked is None:
+        return filters, None
+
+    named = {
+        field: values for field, values in extract_entities(words, automaton).items() if field not in ranked
+    }
+    period = parse_period(text, sorted({str(value)[:7] for value in dates}))
+    if period is not None:
+        named[date_fields[table]] = [value for value in dates if period[0] <= str(value)[:7] <= period[1]]
+
+    narrowed = dict(filters)
+    applied = []
+    for field, values in named.items():
+        selected = filters.get(field)
+        if selected is not None:
+            wanted = set(values)
+            values = [value for value in selected if value in wanted]
+        if len(values) == 0:
+            continue
+        narrowed[field] = values
+        if field == date_fields[table]:
+            applied.append(f"{field} from {period[0]} to {period[1]}")
+        else:
+            applied.append(f"{field} in ({', '.join(map(str, values))})")
+    if len(applied) == 0:
+        return filters, None
+    description = (
+        "Note: the dataframe only holds the rows this question is about, with "
+        + "; ".join(applied)
+        + ". Rows outside them are not in the dataframe."
+    )
+    return narrowed, description
@@ -0,0 +1,292 @@
+import json
+import os
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+# location of the exported chunk vectors and chunk contents
+vector_directory = "./data/rag_vectors"
+
+# rows of the first-pass matrix converted to float32 at a time when scanning a quantized matrix
+scan_block_rows = 1024
+
+
+def export_from_chroma(vector_store, directory=vector_directory):
+    """This function exports every chunk in the Chroma collection to a matrix of unit-length float32
+    vectors, stored as .npy so that it can be memory-mapped, and a JSON file of the chunk ids,
+    contents and metadata in the same order.
+
+    Args:
+        vector_store (Chroma): vector store holding the chunks
+        directory (str, optional): folder to export to. Defaults to "./data/rag_vectors".
+    """
+    collection = vector_store.get(include=["embeddings", "documents", "metadatas"])
+    vectors = np.asarray(collection["embeddings"], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    chunks = [
+        {"id": id_, "page_content": document, "metadata": metadata}
+        for id_, document, metadata in zip(
+            collection["ids"], collection["documents"], collection["metadatas"]
+        )
+    ]
+    os.makedirs(directory, exist_ok=True)
+    np.save(f"{directory}/vectors.npy", vectors)
+    with open(f"{directory}/chunks.json", "w") as file:
+        json.dump(chunks, file)
+
+
+def quantize(vectors, precision="int8", dimensions=None):
+    """This function returns a compact copy of unit-length vectors for the first pass of a search. The
+    vectors are truncated to their first dimensions and made unit-length again, which text-embedding-3
+    models are trained to allow (Matryoshka embeddings), then stored as float16, or as int8 with a
+    scale per dimension.
+
+    Args:
+        vectors (np.ndarray): unit-length float32 vectors, one per row
+        precision (str, optional): "float32", "float16" or "int8". Defaults to "int8".
+        dimensions (int, optional): number of leading dimensions kept. Defaults to None, for all.
+
+    Returns:
+        tuple: quantized vectors, and the scale of each dimension for int8, else None
+    """
+    vectors = np.asarray(vectors[:, :dimensions], dtype=np.float32)
+    if dimensions is not None:
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    if precision == "int8":
+        scale = np.abs(vectors).max(axis=0) / 127
+        scale[scale == 0] = 1
+        return np.round(vectors / scale).astype(np.int8), scale.astype(np.float32)
+    return vectors.astype(precision), None
+
+
+def load_index(directory=vector_directory, precision="int8", dimensions=None):
+    """This function returns the quantized first-pass matrix of the exported vectors, quantizing and
+    saving it next to them if it is missing or older than the export.
+
+    Args:
+        directory (str, optional): folder with the exported vectors. Defaults to "./data/rag_vectors".
+        precision (str, optional): "float32", "float16" or "int8". Defaults to "int8".
+        dimensions (int, optional): number of leading dimensions kept. Defaults to None, for all.
+
+    Returns:
+        tuple: quantized vectors, and the scale of each dimension for int8, else None
+    """
+    source = f"{directory}/vectors.npy"
+    path = f"{directory}/vectors-{precision}-{dimensions or 'all'}.npz"
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        index, scale = quantize(np.load(source, mmap_mode="r"), precision, dimensions)
+        arrays = {"index": index} if scale is None else {"index": index, "scale": scale}
+        np.savez(path + ".tmp.npz", **arrays)
+        os.replace(path + ".tmp.npz", path)
+    with np.load(path) as arrays:
+        return arrays["index"], arrays["scale"] if "scale" in arrays else None
+
+
+class NumpyVectorStore:
+    """Exact-search vector store for small corpora. All chunk vectors are held in one contiguous,
+    memory-mapped float32 matrix of unit-length rows, so cosine similarity against every chunk is a
+    single matrix-vector product, with no database round trip.
+
+    For larger corpora, the first pass can instead scan a quantized copy of the vectors held in memory,
+    int8 or float16 and optionally truncated to fewer dimensions. The rescore_k chunks it scores highest
+    are then rescored exactly from the memory-mapped float32 matrix, of which only those rows are read.
+    The other chunks are left out of the query's results, so that every score compared is exact.
+
+    Args:
+        directory (str, optional): folder with the exported vectors and chunks. Defaults to "./data/rag_vectors".
+        precision (str, optional): "float32", "float16" or "int8" for the first pass. Defaults to "float32".
+        dimensions (int, optional): number of leading dimensions for the first pass. Defaults to None, for all.
+        rescore_k (int, optional): number of chunks rescored exactly per query. Defaults to 100.
+        fetch_k (int, optional): largest number of chunks the store is searched for, e.g. the fetch_k of
+        an MMR search, which rescore_k must be at least. Defaults to 20.
+
+    Raises:
+        ValueError: if rescore_k is less than fetch_k
+    """
+
+    def __init__(
+        self, directory=vector_directory, precision="float32", dimensions=None, rescore_k=100, fetch_k=20
+    ):
+        if rescore_k < fetch_k:
+            raise ValueError(f"rescore_k ({rescore_k}) must be at least fetch_k ({fetch_k})")
+        self.vectors = np.load(f"{directory}/vectors.npy", mmap_mode="r")
+        with open(f"{directory}/chunks.json") as file:
+            self.chunks = json.load(file)
+        if dimensions == self.vectors.shape[1]:
+            dimensions = None
+        self.dimensions = dimensions
+        self.rescore_k = rescore_k
+        if precision == "float32" and dimensions is None:
+            # the full-precision matrix is scanned directly, and the scores are exact
+            self.index, self.scale = None, None
+        else:
+            self.index, self.scale = load_index(directory, precision, dimensions)
+
+    def document(self, i):
+        """This function returns chunk i as a document"""
+        chunk = self.chunks[i]
+        return Document(page_content=chunk["page_content"], metadata=chunk["metadata"])
+
+    def first_pass_scores(self, queries):
+        """This function returns the approximate similarity of every chunk to each unit-length query,
+        from the quantized matrix. Quantized rows are converted to float32 a block at a time, so the
+        scan needs no full-precision copy of the matrix."""
+        if self.dimensions is not None:
+            queries = queries[:, : self.dimensions]
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        if self.scale is not None:
+            # (q * scale) . v_int8 equals q . (v_int8 * scale), without scaling the matrix
+            queries = queries * self.scale
+        if self.index.dtype == np.float32:
+            return queries @ self.index.T
+        scores = np.empty((len(queries), len(self.index)), dtype=np.float32)
+        for start in range(0, len(self.index), scan_block_rows):
+            block = self.index[start : start + scan_block_rows].astype(np.float32)
+            scores[:, start : start + scan_block_rows] = queries @ block.T
+        return scores
+
+    def scores(self, embeddings):
+        """This function returns the cosine similarity of every chunk to each query embedding, as one
+        matrix product. With a quantized first pass, only the rescore_k chunks shortlisted for a query
+        are scored, exactly, and every other chunk scores -inf for that query, since approximate scores
+        are on another scale and cannot be compared with exact ones.
+
+        Args:
+            embeddings (list): list of query embeddings
+
+        Returns:
+            np.ndarray: similarity, with one row per query and one column per chunk
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        if self.index is None:
+            return queries @ self.vectors.T
+        scores = self.first_pass_scores(queries)
+        rescore_k = min(self.rescore_k, scores.shape[1])
+        shortlist = np.argpartition(-scores, rescore_k - 1, axis=1)[:, :rescore_k]
+        # sorted rows, so that the memory-mapped matrix is read in file order
+        rows = np.unique(shortlist)
+        exact = queries @ np.asarray(self.vectors[rows]).T
+        rescored = np.full_like(scores, -np.inf)
+        np.put_along_axis(
+            rescored, shortlist, np.take_along_axis(exact, np.searchsorted(rows, shortlist), axis=1), axis=1
+        )
+        return rescored
+
+    def mmr_indices(self, scores, k=4, fetch_k=20, lambda_mult=0.5):
+        """This function selects k chunks by maximal marginal relevance, among the fetch_k chunks most
+        similar to the query.
+
+        Args:
+            scores (np.ndarray): similarity of every chunk to the query
+            k (int, optional): number of chunks to return. Defaults to 4.
+            fetch_k (int, optional): number of most similar chunks to select from. Defaults to 20.
+            lambda_mult (float, optional): 1 for pure relevance, 0 for maximum diversity. Defaults to 0.5.
+
+        Returns:
+            np.ndarray: positions of the chunks, in order of selection
+        """
+        # chunks that were not scored for the query are never candidates
+        fetch_k = min(fetch_k, int(np.isfinite(scores).sum()))
+        if fetch_k == 0:
+            return np.array([], dtype=int)
+        k = min(k, fetch_k)
+        candidates = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+        relevance = scores[candidates]
+        candidate_vectors = np.asarray(self.vectors[candidates])
+        # similarity between every pair of candidates, computed once
+        pairwise = candidate_vectors @ candidate_vectors.T
+
+        selected = [int(np.argmax(relevance))]
+        # highest similarity of each candidate to any selected candidate so far
+        redundancy = pairwise[selected[0]].copy()
+        for _ in range(k - 1):
+            mmr = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+            mmr[selected] = -np.inf
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            redundancy = np.maximum(redundancy, pairwise[best])
+        return candidates[selected]
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        """This function returns the k chunks most similar to the query embedding.
+
+        Args:
+            embedding (list): query embedding
+            k (int, optional): number of chunks to return. Defaults to 4.
+
+        Returns:
+            list: documents in descending similarity
+        """
+        scores = self.scores([embedding])[0]
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [self.document(i) for i in top[np.argsort(-scores[top])]]
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding, k=4, fetch_k=20, lambda_mult=0.5, score_threshold=None
+    ):
+        """This function returns k chunks selected by maximal marginal relevance, among the fetch_k
+        chunks most similar to the query embedding. Chunks selected with a similarity of at most
+        score_threshold are dropped, as the embeddings filter would, without embedding them again.
+
+        Args:
+            embedding (list): query embedding
+            k (int, optional): number of chunks to return. Defaults to 4.
+            fetch_k (int, optional): number of most similar chunks to select from. Defaults to 20.
+            lambda_mult (float, optional): 1 for pure relevance, 0 for maximum diversity. Defaults to 0.5.
+            score_threshold (float, optional): similarity that chunks must exceed. Defaults to None, for no threshold.
+
+        Returns:
+            list: documents in order of selection
+        """
+        scores = self.scores([embedding])[0]
+        selected = self.mmr_indices(scores, k, fetch_k, lambda_mult)
+        if score_threshold is not None:
+            selected = selected[scores[selected] > score_threshold]
+        return [self.document(i) for i in selected]
+
+    def as_retriever(self, embeddings, search_type="similarity", search_kwargs=None):
+        """This function returns a LangChain retriever over the vector store.
+
+        Args:
+            embeddings (Embeddings): embedding model for queries
+            search_type (str, optional): "similarity" or "mmr". Defaults to "similarity".
+            search_kwargs (dict, optional): keyword arguments for the search. Defaults to None.
+
+        Returns:
+            NumpyRetriever: retriever
+        """
+        return NumpyRetriever(
+            store=self,
+            embeddings=embeddings,
+            search_type=search_type,
+            search_kwargs=search_kwargs or {},
+        )
+
+
+class NumpyRetriever(BaseRetriever):
+    """LangChain retriever over a NumpyVectorStore, for use in place of the Chroma retriever"""
+
+    store: NumpyVectorStore
+    embeddings: Embeddings
+    search_type: str = "similarity"
+    search_kwargs: dict = {}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ):
+        embedding = self.embeddings.embed_query(query)
+        if self.search_type == "mmr":
+            return self.store.max_marginal_relevance_search_by_vector(
+                embedding, **self.search_kwargs
+            )
+        return self.store.similarity_search_by_vector(embedding, **self.search_kwargs)
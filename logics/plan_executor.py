@@ -0,0 +1,447 @@
+import ast
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from helper_functions import analytics_db
+
+logger = logging.getLogger(__name__)
+
+# names that a plan may refer to, and the objects they are bound to when the plan is executed
+_allowed_names = {
+    "df": None,
+    "pd": pd,
+    "len": len,
+    "round": round,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "abs": abs,
+    "str": str,
+    "int": int,
+    "float": float,
+}
+
+# pandas methods and properties that a plan may use
+_allowed_attributes = {
+    "agg", "aggregate", "all", "any", "astype", "between", "columns", "contains", "count",
+    "crosstab", "cumsum", "cut", "describe", "diff", "drop_duplicates", "dropna", "dt",
+    "endswith", "eq", "fillna", "first", "ge", "groupby", "gt", "head", "idxmax", "idxmin",
+    "iloc", "index", "isin", "isna", "last", "le", "loc", "lower", "lt", "max", "mean",
+    "median", "min", "mode", "month", "ne", "nlargest", "notna", "nsmallest", "nunique",
+    "pct_change", "pivot_table", "quantile", "rename", "reset_index", "round", "shape",
+    "size", "sort_index", "sort_values", "startswith", "std", "str", "sum", "tail",
+    "to_datetime", "to_frame", "tolist", "unique", "unstack", "upper", "value_counts",
+    "values", "year",
+}
+
+# methods that look up the functions they are given by name on the dataframe, and the position and
+# keyword of the function argument. The functions a plan passes to them must be reducers.
+_function_arguments = {
+    "agg": (0, "func"),
+    "aggregate": (0, "func"),
+    "pivot_table": (3, "aggfunc"),
+    "crosstab": (5, "aggfunc"),
+}
+
+# reducers that a plan may pass to the methods above, by name or as the builtin functions
+_allowed_reducers = {
+    "sum", "mean", "median", "min", "max", "count", "size", "nunique", "std", "var",
+    "first", "last", "prod", "idxmax", "idxmin", "any", "all",
+}
+_allowed_reducer_names = {"len", "min", "max", "sum"}
+
+# syntax that a plan may use: a single expression without lambdas, comprehensions or assignments
+_allowed_nodes = (
+    ast.Expression, ast.Call, ast.Attribute, ast.Name, ast.Load, ast.Constant,
+    ast.Subscript, ast.Slice, ast.Tuple, ast.List, ast.Dict, ast.keyword,
+    ast.Compare, ast.BoolOp, ast.BinOp, ast.UnaryOp,
+    ast.And, ast.Or, ast.Not, ast.Invert, ast.USub, ast.UAdd,
+    ast.BitAnd, ast.BitOr, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+)
+
+# words dropped when normalising queries, so that light paraphrases share a cached plan
+_stopwords = {
+    "a", "an", "the", "of", "in", "at", "for", "to", "on", "by", "is", "are", "was", "were",
+    "be", "what", "which", "who", "how", "me", "show", "tell", "give", "list", "please",
+    "can", "you", "i", "do", "does", "did", "there", "that", "this", "and", "with", "from",
+}
+
+# normalised query + schema version -> validated plan, shared across user sessions
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+plan_cache_size = 512
+
+
+def normalise_query(query):
+    """This function normalises the user query into a canonical string, ignoring case,
+    punctuation, plural forms and common filler words. Word order is kept, since e.g. "Bishan
+    higher than Tampines" and "Tampines higher than Bishan" need opposite plans.
+
+    Args:
+        query (str): user query
+
+    Returns:
+        str: normalised query
+    """
+    tokens = re.findall(r"[a-z0-9]+", query.lower())
+    tokens = [t[:-1] if len(t) > 3 and t.endswith("s") else t for t in tokens]
+    return " ".join(t for t in tokens if t not in _stopwords)
+
+
+def schema_version(df):
+    """This function returns a short hash of the dataframe columns and their data types,
+    which changes whenever a plan generated for the dataframe may no longer apply.
+
+    Args:
+        df (pd.DataFrame): dataframe to be queried
+
+    Returns:
+        str: schema version
+    """
+    schema = ",".join(f"{col}:{dtype}" for col, dtype in df.dtypes.astype(str).items())
+    return hashlib.sha1(schema.encode("utf-8")).hexdigest()[:12]
+
+
+def _validate_function(node):
+    """This function checks that a function passed to agg, pivot_table or crosstab is a whitelisted
+    reducer, or a list, tuple or dictionary of them, so that no other method is looked up by name
+
+    Raises:
+        ValueError: if the function is not allowed
+    """
+    if isinstance(node, (ast.List, ast.Tuple)):
+        for element in node.elts:
+            _validate_function(element)
+    elif isinstance(node, ast.Dict):
+        # keys are column names
+        for value in node.values:
+            _validate_function(value)
+    elif isinstance(node, ast.Constant) and node.value in _allowed_reducers:
+        return
+    elif isinstance(node, ast.Name) and node.id in _allowed_reducer_names:
+        return
+    else:
+        raise ValueError(f"Plan uses disallowed function: {ast.unparse(node)}")
+
+
+def _validate_call(node):
+    """This function checks the functions passed to a call of agg, aggregate, pivot_table or crosstab
+
+    Raises:
+        ValueError: if a function is not allowed
+    """
+    name = node.func.attr if isinstance(node.func, ast.Attribute) else None
+    if name not in _function_arguments:
+        return
+    position, keyword = _function_arguments[name]
+    if len(node.args) > position:
+        _validate_function(node.args[position])
+    for kw in node.keywords:
+        if kw.arg == keyword:
+            _validate_function(kw.value)
+        elif name in ("agg", "aggregate") and kw.arg != "axis":
+            # named aggregation, e.g. agg(total=("resale_price", "sum")) or agg(total="sum")
+            _validate_function(kw.value.elts[-1] if isinstance(kw.value, ast.Tuple) else kw.value)
+
+
+def validate_plan(expression, max_length=1000):
+    """This function checks that the plan is a single pandas expression that only uses whitelisted
+    syntax, names and attributes, and only passes whitelisted reducers to the methods that look up
+    functions by name.
+
+    Args:
+        expression (str): pandas expression over the dataframe df
+        max_length (int, optional): maximum number of characters in the expression. Defaults to 1000.
+
+    Raises:
+        ValueError: if the expression is not allowed
+    """
+    if len(expression) > max_length:
+        raise ValueError("Plan is too long")
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Plan is not a valid expression: {e}")
+    for node in ast.walk(tree):
+        if not isinstance(node, _allowed_nodes):
+            raise ValueError(f"Plan uses disallowed syntax: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in _allowed_names:
+            raise ValueError(f"Plan uses disallowed name: {node.id}")
+        if isinstance(node, ast.Attribute) and node.attr not in _allowed_attributes:
+            raise ValueError(f"Plan uses disallowed attribute: {node.attr}")
+        if isinstance(node, ast.keyword) and node.arg is None:
+            raise ValueError("Plan uses disallowed syntax: **")
+        if isinstance(node, ast.Call):
+            _validate_call(node)
+
+
+def _format_result(result, max_rows=20):
+    """This function converts the result of a plan into text for display"""
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.to_string(max_rows=max_rows)
+    if isinstance(result, float):
+        return f"{result:,.2f}"
+    return str(result)
+
+
+def _run_plan(expression, df, conn, memory_limit_mb):
+    """This function executes the plan in the sandbox process and sends back the outcome"""
+    try:
+        if memory_limit_mb:
+            import resource
+
+            # e.g. "a" * 10**12 fails with a MemoryError rather than using up the host's memory
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+        names = dict(_allowed_names, df=df)
+        result = eval(
+            compile(expression, "<plan>", "eval"), {"__builtins__": {}}, names
+        )
+        conn.send((True, _format_result(result)))
+    except MemoryError:
+        conn.send((False, "MemoryError: the plan exceeded its memory limit"))
+    except Exception as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def execute_plan(expression, df, timeout=10, memory_limit_mb=None):
+    """This function validates the plan and executes it on the dataframe in a separate process,
+    which is terminated if it does not finish within the timeout, and fails if it exceeds its memory limit.
+
+    Args:
+        expression (str): pandas expression over the dataframe df
+        df (pd.DataFrame): dataframe to be queried
+        timeout (int, optional): seconds allowed for the plan to run. Defaults to 10.
+        memory_limit_mb (int, optional): memory limit of the process in MB, or 0 for no limit. Defaults to
+        the environment variable PLAN_MEMORY_MB, or 1024 if not set.
+
+    Raises:
+        ValueError: if the plan is not allowed, fails or times out
+
+    Returns:
+        str: result of the plan as text
+    """
+    validate_plan(expression)
+    # the process is forked from a single-threaded fork server rather than from the server process, which
+    # runs many threads, so that it cannot inherit a lock held by another thread. The fork server has
+    # this module imported already, so that a plan starts quickly.
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload([__name__])
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    if memory_limit_mb is None:
+        memory_limit_mb = int(os.environ.get("PLAN_MEMORY_MB", "1024"))
+    process = ctx.Process(
+        target=_run_plan, args=(expression, df, child_conn, memory_limit_mb), daemon=True
+    )
+    process.start()
+    child_conn.close()
+    try:
+        if not parent_conn.poll(timeout):
+            raise ValueError("Plan timed out")
+        ok, output = parent_conn.recv()
+    except EOFError:
+        raise ValueError("Plan terminated unexpectedly")
+    finally:
+        parent_conn.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    if not ok:
+        raise ValueError(f"Plan failed: {output}")
+    return output
+
+
+def _sql_authorizer(table):
+    """This function returns a SQLite authorizer that only allows reading the given table"""
+
+    def authorizer(action, arg1, arg2, dbname, source):
+        if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE):
+            return sqlite3.SQLITE_OK
+        if action == sqlite3.SQLITE_READ and arg1 == table:
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+
+    return authorizer
+
+
+def validate_sql_plan(statement, max_length=2000):
+    """This function checks that the plan is a single SELECT statement.
+
+    Args:
+        statement (str): SQLite SELECT statement over the table df
+        max_length (int, optional): maximum number of characters in the statement. Defaults to 2000.
+
+    Raises:
+        ValueError: if the statement is not allowed
+    """
+    statement = statement.strip().rstrip(";")
+    if len(statement) > max_length:
+        raise ValueError("Plan is too long")
+    if ";" in statement:
+        raise ValueError("Plan has more than one statement")
+    if re.match(r"(select|with)\b", statement, re.IGNORECASE) is None:
+        raise ValueError("Plan is not a SELECT statement")
+
+
+def execute_sql_plan(statement, source, timeout=10):
+    """This function validates the plan and runs it on the analytics database, over the rows
+    selected by the source statement. The database connection is read-only, can only read the
+    source table, and is interrupted if the plan does not finish within the timeout.
+
+    Args:
+        statement (str): SQLite SELECT statement over the table df
+        source (tuple): SELECT statement for the rows being queried and its parameters
+        timeout (int, optional): seconds allowed for the plan to run. Defaults to 10.
+
+    Raises:
+        ValueError: if the plan is not allowed, fails or times out
+
+    Returns:
+        str: result of the plan as text
+    """
+    validate_sql_plan(statement)
+    statement = statement.strip().rstrip(";")
+    source_sql, params = source
+    # expose the selected rows to the plan as the table df
+    prefix = re.match(r"with(\s+recursive)?\s", statement, re.IGNORECASE)
+    if prefix is not None:
+        statement = f"{prefix.group(0)}df AS ({source_sql}), " + statement[prefix.end() :]
+    else:
+        statement = f"WITH df AS ({source_sql}) " + statement
+    table = re.search(r"\bFROM (\w+)", source_sql).group(1)
+
+    deadline = time.monotonic() + timeout
+    conn = analytics_db.open_connection()
+    try:
+        conn.set_authorizer(_sql_authorizer(table))
+        # a non-zero return value interrupts the running statement
+        conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+        result = pd.read_sql_query(statement, conn, params=params)
+    except Exception as e:
+        if time.monotonic() > deadline:
+            raise ValueError("Plan timed out")
+        raise ValueError(f"Plan failed: {type(e).__name__}: {e}")
+    finally:
+        conn.close()
+    # single values are shown as is rather than as a table
+    if result.shape == (1, 1):
+        return _format_result(result.iat[0, 0])
+    return _format_result(result)
+
+
+def generate_plan(query, df, model="gpt-4o-mini", temperature=0, language="pandas"):
+    """This function asks LLM to translate the user query into a single pandas expression
+    over the dataframe df, or a single SQLite SELECT statement over the table df.
+
+    Args:
+        query (str): user query
+        df (pd.DataFrame): dataframe to be queried
+        model (str, optional): ID of the OpenAI LLM model to use. Defaults to "gpt-4o-mini".
+        temperature (int, optional): temperature setting for LLM. Defaults to 0.
+        language (str, optional): "pandas" or "sql". Defaults to "pandas".
+
+    Returns:
+        str: pandas expression or SQL statement
+    """
+    schema = "\n".join(f"{col} ({dtype})" for col, dtype in df.dtypes.astype(str).items())
+    sample = df.head(3).to_string()
+    if language == "sql":
+        intro = "You are given a SQLite table named df"
+        task = """Write a SINGLE SQLite SELECT statement over df
+    that computes the answer to the user query. Quote column names with double quotes.
+    Do NOT modify any data or use any other statements."""
+    else:
+        intro = "You are given a pandas dataframe named df"
+        task = """Write a SINGLE pandas expression over df
+    that computes the answer to the user query. Use only df, pd and pandas methods for filtering, grouping,
+    aggregating and sorting. Do NOT use lambdas, loops, assignments, imports or any other statements."""
+    prompt = f"""{intro} with the following columns and data types:
+    {schema}
+
+    These are the first 3 rows of df:
+    {sample}
+
+    The user query is enclosed within <incoming-query> tag pair. {task}
+    Respond in JSON with the {"statement" if language == "sql" else "expression"} under the key "expression".
+
+    <incoming-query> {query} </incoming-query>"""
+
+    # imported here rather than at the top, so that the sandbox process does not load the OpenAI client
+    from helper_functions import llm
+
+    response = llm.get_completion(
+        prompt, model=model, temperature=temperature, json_output=True
+    )
+    return json.loads(response).get("expression", "")
+
+
+def cached_plan(query, df, language="pandas"):
+    """This function returns the validated plan cached for the user query, dataframe schema
+    and plan language, or None if there is none"""
+    key = (normalise_query(query), schema_version(df), language)
+    with _plan_cache_lock:
+        expression = _plan_cache.get(key)
+        if expression is not None:
+            _plan_cache.move_to_end(key)
+        return expression
+
+
+def cache_plan(query, df, expression, language="pandas"):
+    """This function caches the validated plan for the user query, dataframe schema and plan language"""
+    key = (normalise_query(query), schema_version(df), language)
+    with _plan_cache_lock:
+        _plan_cache[key] = expression
+        _plan_cache.move_to_end(key)
+        while len(_plan_cache) > plan_cache_size:
+            _plan_cache.popitem(last=False)
+
+
+def answer_query(query, df, model="gpt-4o-mini", temperature=0, timeout=10, source=None):
+    """This function answers the user query with a single validated plan, taken from the plan
+    cache or else generated by LLM in one call, and executed in a sandbox. If the SQL statement
+    that selected the dataframe rows is given, the plan is a SQL statement run on the analytics
+    database, otherwise it is a pandas expression run on the dataframe.
+
+    Args:
+        query (str): user query
+        df (pd.DataFrame): dataframe to be queried
+        model (str, optional): ID of the OpenAI LLM model to use. Defaults to "gpt-4o-mini".
+        temperature (int, optional): temperature setting for LLM. Defaults to 0.
+        timeout (int, optional): seconds allowed for the plan to run. Defaults to 10.
+        source (tuple, optional): SELECT statement for the dataframe rows and its parameters. Defaults to None.
+
+    Returns:
+        str: result of the plan or templated response
+    """
+    language = "pandas" if source is None else "sql"
+    expression = cached_plan(query, df, language)
+    from_cache = expression is not None
+    try:
+        if not from_cache:
+            expression = generate_plan(
+                query, df, model=model, temperature=temperature, language=language
+            )
+        if language == "sql":
+            result = execute_sql_plan(expression, source, timeout=timeout)
+        else:
+            result = execute_plan(expression, df, timeout=timeout)
+    except (ValueError, json.JSONDecodeError) as e:
+        logger.warning("Plan for query %r rejected: %s", query, e)
+        return "The LLM is unable to provide an answer to your query. Please consider refining your query."
+    if not from_cache:
+        cache_plan(query, df, expression, language)
+    # result and expression are shown as code, so streamlit does not treat $ signs as Latex
+    return f"```\n{result}\n```\n*Computed with* `{expression}`"
@@ -4,6 +4,7 @@ from langchain_community.document_loaders import WebBaseLoader
 from langchain.docstore.document import Document
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from logics.numpy_retriever import export_from_chroma, vector_directory
 
 # initialise embedding model to be used for RAG
 embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
@@ -36,6 +37,7 @@ def extract_clean(url):
 
 
 if __name__ == "__main__":
+    # Run from the repository root: python -m logics.rag_preretrieval
     # Step 1: Loading data from external sources (2 from HDB and 1 from CPF)
 
     HDBurl1 = "https://www.hdb.gov.sg/cs/infoweb/e-resale/resale-purchase-of-an-hdb-resale-flat"
@@ -105,8 +107,11 @@ if __name__ == "__main__":
         embedding=embeddings_model,
         ids=idlist,
         collection_metadata={"hnsw:space": "cosine"},
-        persist_directory="../data/chroma_langchain_db",  # Where to save data locally
+        persist_directory="./data/chroma_langchain_db",  # Where to save data locally
     )
 
     print(f"Number of docs in chromadb: {vector_store._collection.count()}")
     print(f"First doc: {vector_store._collection.peek(limit=1)}")
+
+    # Step 4: Export the chunk vectors for the in-memory exact-search vector store
+    export_from_chroma(vector_store, directory=vector_directory)
@@ -1,27 +1,117 @@
-__import__("pysqlite3")
+import os
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 
-sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+from helper_functions import llm, profiling
+from helper_functions.single_flight import normalise_text, single_flight
+
+# LangChain, Chroma and Cohere are imported, and the models constructed, when first needed
+# rather than at import, to keep app startup fast.
+
+
+@lru_cache(maxsize=None)
+def get_embeddings_model():
+    """This function returns the embedding model to be used for RAG, initialising it on first use"""
+    from langchain_openai import OpenAIEmbeddings
+
+    from helper_functions.admission import http_client
+
+    return OpenAIEmbeddings(model="text-embedding-3-small", http_client=http_client("openai"))
+
+
+@lru_cache(maxsize=None)
+def get_llm():
+    """This function returns the language model to be used for RAG, initialising it on first use"""
+    from langchain_openai import ChatOpenAI
+
+    from helper_functions.admission import http_client
+
+    return ChatOpenAI(model="gpt-4o-mini", temperature=0, seed=42, http_client=http_client("openai"))
+
+
+@lru_cache(maxsize=None)
+def get_reranker():
+    """This function returns the Cohere reranker to be used for RAG, initialising it on first use"""
+    import cohere
+    from langchain_cohere import CohereRerank
+
+    from helper_functions.admission import http_client
+
+    client = cohere.Client(
+        api_key=os.environ.get("COHERE_API_KEY"), httpx_client=http_client("cohere")
+    )
+    return CohereRerank(client=client, model="rerank-english-v3.0", top_n=4)
+
+
+@lru_cache(maxsize=None)
+def _import_chroma():
+    """This function imports the Chroma vector store. Chroma needs a newer SQLite than some
+    hosts provide, so the sqlite3 module is swapped for pysqlite3 first, unless the app already
+    did at startup because RAG searches the chromadb."""
+    from helper_functions.warmup import use_pysqlite3
+
+    use_pysqlite3()
+    from langchain_chroma import Chroma
+
+    return Chroma
+
+
+def _chroma_store(embeddings_model=None):
+    """This function opens the pre-generated chromadb as a vector store"""
+    Chroma = _import_chroma()
+    return Chroma(
+        "HDBResale",
+        embedding_function=embeddings_model,
+        persist_directory="./data/chroma_langchain_db",
+    )
+
+
+@lru_cache(maxsize=None)
+def get_numpy_store():
+    """This function returns the in-memory vector store, exporting the chunk vectors from the
+    pre-generated chromadb on first use if they have not been exported yet. The search is exact unless
+    the environment variable RAG_VECTOR_PRECISION is set to int8 or float16, or RAG_VECTOR_DIMENSIONS to
+    fewer dimensions than the embeddings have, for a quantized first pass with exact rescoring of the
+    RAG_VECTOR_RESCORE_K (default 100, at least the fetch_k of 20 of the MMR search) best chunks."""
+    from logics.numpy_retriever import NumpyVectorStore, export_from_chroma, vector_directory
+
+    if not os.path.exists(f"{vector_directory}/vectors.npy"):
+        export_from_chroma(_chroma_store())
+    dimensions = os.environ.get("RAG_VECTOR_DIMENSIONS")
+    return NumpyVectorStore(
+        vector_directory,
+        precision=os.environ.get("RAG_VECTOR_PRECISION", "float32"),
+        dimensions=int(dimensions) if dimensions else None,
+        rescore_k=int(os.environ.get("RAG_VECTOR_RESCORE_K", "100")),
+    )
 
-import re
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_chroma import Chroma
-from langchain_cohere import CohereRerank
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import (
-    DocumentCompressorPipeline,
-    EmbeddingsFilter,
-)
-
-from helper_functions import llm
-
-# initialise embedding model to be used for RAG
-embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
-# initialise language model to be used for RAG
-llm_ = ChatOpenAI(model="gpt-4o-mini", temperature=0, seed=42)
+
+def get_corpus_version():
+    """This function returns the version of the corpus indexed by the vector store chosen by the environment
+    variable RAG_VECTOR_BACKEND, computed on first use"""
+    return _corpus_version(os.environ.get("RAG_VECTOR_BACKEND", "numpy"))
+
+
+@lru_cache(maxsize=None)
+def _corpus_version(backend):
+    """This function computes the version of the corpus indexed by the vector store of the backend. The
+    chromadb lists its chunks in the order they are exported in, so both backends give the same version
+    of the same corpus."""
+    from logics.answer_bank import corpus_version
+
+    if backend == "chroma":
+        collection = _chroma_store().get(include=["documents"])
+        chunks = [
+            {"id": id_, "page_content": document}
+            for id_, document in zip(collection["ids"], collection["documents"])
+        ]
+        return corpus_version(chunks)
+    return corpus_version(get_numpy_store().chunks)
+
+# token budget of the retrieved contexts passed to the LLM
+context_max_tokens = 1200
 
 # search system message
 system_msg_search = """<the_only_instruction>
@@ -36,6 +126,8 @@ system_msg_search = """<the_only_instruction>
     """
 
 
+@profiling.profiled("query_rewrite")
+@single_flight(lambda query, temperature=0.3: (normalise_text(query), temperature))
 def query_rewrite(query, temperature=0.3):
     """This function takes in the original user query, assesses if there is a
     need to rephrase, if so rewrite/rephrase the query so as to optimise the quality
@@ -83,6 +175,93 @@ def query_rewrite(query, temperature=0.3):
         return re.search(r"\<(.*?)\>", response).group(1)
 
 
+def _answer_chain(sys_msg, lang_model):
+    """This function creates the chain that answers the query from the retrieved contexts, which are
+    passed to the LLM as the system message"""
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import ChatPromptTemplate
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", sys_msg),
+            ("human", "<incoming-query>{input}</incoming-query>"),
+        ]
+    )
+    return create_stuff_documents_chain(llm=lang_model, prompt=prompt)
+
+
+def _retriever(embeddings_model, diversity, similarity_threshold):
+    """This function creates the retriever of the contexts relevant to a query, from the vector store chosen
+    by the environment variable RAG_VECTOR_BACKEND: MMR search, dropping documents below the similarity
+    threshold, reranking and packing the rest into the context"""
+    from langchain_core.runnables import RunnableLambda
+    from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
+    from langchain.retrievers.document_compressors import (
+        DocumentCompressorPipeline,
+        EmbeddingsFilter,
+    )
+
+    from logics.context_packer import pack_context
+
+    # Step 1: initialise vector store. The corpus is small, so by default every chunk vector is held in
+    # memory and searched exactly, or with a quantized first pass for a larger corpus (see get_numpy_store).
+    # Set the environment variable RAG_VECTOR_BACKEND to chroma to search the pre-generated chromadb instead.
+    # Step 2a: Creating the base retriever
+    search_kwargs = {"k": 8, "fetch_k": 20, "lambda_mult": diversity}
+    # Setting up Cohere reranker to rerank relevant documents
+    cohere_rerank = get_reranker()
+    if os.environ.get("RAG_VECTOR_BACKEND", "numpy") == "chroma":
+        base_retriever = _chroma_store(embeddings_model).as_retriever(
+            search_type="mmr", search_kwargs=search_kwargs
+        )
+        # Step 2b: Setting up advanced retriever, and add on to base retriever using contextual compression
+        # uses embeddings to drop unrelated documents below defined similarity threshold
+        embeddings_filter = EmbeddingsFilter(
+            embeddings=embeddings_model, similarity_threshold=similarity_threshold
+        )
+        # Combining embedding filtering and reranking with base MMR search
+        transformers = [embeddings_filter, cohere_rerank]
+    else:
+        # the in-memory store already holds the similarity of each document, so it drops the documents
+        # below the similarity threshold itself, instead of the embeddings filter embedding them again
+        base_retriever = get_numpy_store().as_retriever(
+            embeddings_model,
+            search_type="mmr",
+            search_kwargs={**search_kwargs, "score_threshold": similarity_threshold},
+        )
+        # Step 2b: Setting up advanced retriever, and add on to base retriever using contextual compression
+        transformers = [cohere_rerank]
+    pipeline_compressor = DocumentCompressorPipeline(transformers=transformers)
+    compression_retriever = ContextualCompressionRetriever(
+        base_compressor=pipeline_compressor, base_retriever=base_retriever
+    )
+    # Step 2c: Packing the reranked documents into the context, merging overlapping chunks and dropping near-duplicates
+    return compression_retriever | RunnableLambda(
+        lambda documents: pack_context(documents, max_tokens=context_max_tokens)
+    )
+
+
+def _retrievalQA_key(
+    query,
+    embeddings_model,
+    sys_msg,
+    lang_model,
+    diversity=0.7,
+    similarity_threshold=0.5,
+):
+    """This function returns the key identifying identical retrievalQA requests, which are coalesced.
+    The models are the same for every session, so only the retrieval settings are part of the key."""
+    return (
+        normalise_text(query),
+        sys_msg,
+        diversity,
+        similarity_threshold,
+        os.environ.get("RAG_VECTOR_BACKEND", "numpy"),
+    )
+
+
+@profiling.profiled("retrievalQA")
+@single_flight(_retrievalQA_key)
 def retrievalQA(
     query,
     embeddings_model,
@@ -92,7 +271,7 @@ def retrievalQA(
     similarity_threshold=0.5,
 ):
     """This function takes in user query and check if it contains malicious activity. If ok,
-    a vector store is initialised from the pre-generated chromadb. Contexts relevant to the query
+    a vector store is initialised from the pre-generated chromadb, or its exported vectors. Contexts relevant to the query
     are then retrieved from the vector store and passed to the LLM, together with the
     query, to generate a response.
 
@@ -110,55 +289,139 @@ def retrievalQA(
                template message and None
     """
 
-    # Step 0: Safeguard the RAG agent from malicious prompt
+    # Step 0a: Curated questions are answered from the precomputed answer bank, unless the corpus has changed since
+    from logics import answer_bank
+
+    banked = answer_bank.lookup(
+        query, sys_msg, diversity, similarity_threshold, get_corpus_version()
+    )
+    if banked is not None:
+        return banked
+
+    # Step 0b: Safeguard the RAG agent from malicious prompt
     # if query is deemed to be malicious, exit function with message
     if llm.check_for_malicious_intent(query) == "Y":
         return ("Sorry, potentially malicious prompt detected. This request cannot be processed.", None)
 
-    # Step 1: initialise vector store from pre-generated chromadb
-    vector_store = Chroma(
-        "HDBResale",
-        embedding_function=embeddings_model,
-        persist_directory="./data/chroma_langchain_db",
-    )
-    # Step 2a: Creating the base retriever
-    base_retriever = vector_store.as_retriever(
-        search_type="mmr",
-        search_kwargs={
-            "k": 8,
-            "fetch_k": 20,
-            "lambda_mult": diversity,
-        },
-    )
+    from langchain.chains import create_retrieval_chain
 
-    # Step 2b: Setting up advanced retriever, and add on to base retriever using contextual compression
-    # Setting up Cohere reranker to rerank relevant documents
-    cohere_rerank = CohereRerank(model="rerank-english-v3.0", top_n=4)
-    # uses embeddings to drop unrelated documents below defined similarity threshold
-    embeddings_filter = EmbeddingsFilter(
-        embeddings=embeddings_model, similarity_threshold=similarity_threshold
-    )
-    # Combining embedding filtering and reranking with base MMR search
-    pipeline_compressor = DocumentCompressorPipeline(
-        transformers=[embeddings_filter, cohere_rerank]
-    )
-    compression_retriever = ContextualCompressionRetriever(
-        base_compressor=pipeline_compressor, base_retriever=base_retriever
-    )
+    # Step 1 and 2: Creating the retriever of the contexts relevant to the query
+    packed_retriever = _retriever(embeddings_model, diversity, similarity_threshold)
 
     # Step 3: Creating the question and answer mechanism
-    system_prompt = sys_msg
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", system_prompt),
-            ("human", "<incoming-query>{input}</incoming-query>"),
-        ]
-    )
+    question_answer_chain = _answer_chain(sys_msg, lang_model)
 
     # Step 4: Passing the retrieved contexts relevant to user query as well as the query itself to LLM to generate response
-    question_answer_chain = create_stuff_documents_chain(llm=lang_model, prompt=prompt)
-    rag_chain = create_retrieval_chain(compression_retriever, question_answer_chain)
+    rag_chain = create_retrieval_chain(packed_retriever, question_answer_chain)
     response = rag_chain.invoke({"input": query})
 
     # returning both the response text and the underlying contexts. Escaping $ to prevent streamlit from showing anything between $ signs as Latex when not intended to.
     return response.get("answer").replace("$", "\\$"), response.get("context")
+
+
+def retrievalQA_batch(
+    queries,
+    embeddings_model,
+    sys_msg,
+    lang_model,
+    diversity=0.7,
+    similarity_threshold=0.5,
+    max_workers=8,
+):
+    """This function answers a set of queries the same way as retrievalQA, e.g. to replay logged queries
+    after the corpus is refreshed. With the in-memory vector store, all queries are embedded in one request
+    and searched as one matrix product. With RAG_VECTOR_BACKEND set to chroma, each query is searched in the
+    chromadb as retrievalQA does. The malicious prompt check, reranking and answering of up to max_workers
+    queries then run concurrently, and results are yielded as they complete.
+
+    Args:
+        queries (list): list of user queries
+        embeddings_model (_type_): embedding model for RAG
+        sys_msg (str): system message to be passed to the LLM
+        lang_model (_type_): the LLM
+        diversity (float): the lambda multipler input (0-1) to maximal marginal relevance. Default to 0.7
+        similarity_threshold (float): document similarity threshold (0-1) , measured using cosine similarity
+                                    Default to 0.5.
+        max_workers (int): maximum number of queries in progress at once. Default to 8.
+
+    Yields:
+        tuple: position of the query in queries, and either the LLM response and the corresponding sources or
+               template message and None
+    """
+    import contextvars
+
+    import numpy as np
+
+    from logics.context_packer import pack_context
+
+    queries = list(queries)
+    if len(queries) == 0:
+        return
+
+    # Step 1: Embedding all queries in one request and searching all chunks with one matrix product,
+    # unless the chromadb is searched, one query at a time
+    if os.environ.get("RAG_VECTOR_BACKEND", "numpy") == "chroma":
+        retriever = _retriever(embeddings_model, diversity, similarity_threshold)
+    else:
+        retriever = None
+        store = get_numpy_store()
+        scores = store.scores(embeddings_model.embed_documents(queries))
+    cohere_rerank = get_reranker()
+    question_answer_chain = _answer_chain(sys_msg, lang_model)
+
+    def answer(i):
+        """This function answers query i from its similarity scores, or from the chromadb"""
+        # Step 2: Safeguard the RAG agent from malicious prompt
+        if llm.check_for_malicious_intent(queries[i]) == "Y":
+            return i, ("Sorry, potentially malicious prompt detected. This request cannot be processed.", None)
+        # Step 3: MMR search, then drop documents below the similarity threshold, most similar first as
+        # the embeddings filter does, and rerank the rest
+        if retriever is not None:
+            documents = retriever.invoke(queries[i])
+        else:
+            selected = store.mmr_indices(scores[i], k=8, fetch_k=20, lambda_mult=diversity)
+            selected = selected[np.argsort(-scores[i][selected], kind="stable")]
+            selected = selected[scores[i][selected] > similarity_threshold]
+            documents = [store.document(j) for j in selected]
+            if len(documents) > 0:
+                documents = list(cohere_rerank.compress_documents(documents, queries[i]))
+                documents = pack_context(documents, max_tokens=context_max_tokens)
+        # Step 4: Passing the retrieved contexts and the query to LLM to generate response
+        response = question_answer_chain.invoke({"input": queries[i], "context": documents})
+        return i, (response.replace("$", "\\$"), documents)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-batch") as executor:
+        # each query runs in a copy of the caller's context, so its model calls are admitted under the caller's tool
+        futures = [
+            executor.submit(contextvars.copy_context().run, answer, i)
+            for i in range(len(queries))
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+if __name__ == "__main__":
+    # Replays a file of queries, one per line, writing each answer as a line of JSON as soon as it is ready.
+    # Run from the repository root: python -m logics.rag_retrieval queries.txt answers.jsonl
+    import json
+    import time
+
+    from helper_functions.admission import admission_context
+
+    queries_path, answers_path = sys.argv[1], sys.argv[2]
+    with open(queries_path) as file:
+        queries = [line.strip() for line in file if line.strip()]
+    start = time.perf_counter()
+    with open(answers_path, "w") as file, admission_context(tool="replay"):
+        for n, (i, (answer, sources)) in enumerate(
+            retrievalQA_batch(queries, get_embeddings_model(), system_msg_search, get_llm()),
+            start=1,
+        ):
+            record = {
+                "query": queries[i],
+                "answer": answer,
+                "sources": [doc.metadata.get("source") for doc in (sources or [])],
+            }
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            print(f"{n}/{len(queries)} answered in {time.perf_counter() - start:.1f}s")
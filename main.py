@@ -1,9 +1,13 @@
-import pandas as pd
+import os
+import uuid
+
 import streamlit as st
-from helper_functions.utility import check_password
+from helper_functions.warmup import start_warmup, use_pysqlite3
 
-from logics.renochat import chatbot_response, system_msg
-from logics import agent, rag_retrieval
+# Swap in the newer SQLite that Chroma needs before any thread or module using sqlite3 starts, if RAG
+# searches the chromadb. The default in-memory vector store does not need it.
+if os.environ.get("RAG_VECTOR_BACKEND", "numpy") == "chroma":
+    use_pysqlite3()
 
 
 # region <--------- Streamlit App Configuration --------->
@@ -29,43 +33,139 @@ with st.expander("*Disclaimer*"):
 
 # st.cache_data.clear()
 
+# Import heavy dependencies and construct model clients in the background while the user logs in
+start_warmup()
+
+from helper_functions.utility import admin_password, check_admin_password, check_password
+
 # Do not continue if check_password is not True.
 if not check_password():
     st.stop()
 
+# The hidden admin page, with profiling and service statistics, is opened with ?admin=1 and its own
+# password. It is turned off unless an admin password is set.
+if st.query_params.get("admin") == "1" and admin_password() is not None:
+    if not check_admin_password():
+        st.stop()
+    from helper_functions.admin import admin_page
+
+    admin_page()
+    st.stop()
+
+# The tools and their dependencies are only imported once the user has logged in
+import data_prep
+from helper_functions import analytics_db, chart_data, profiling
+from helper_functions.leaderboard import LeaderboardIndex
+from helper_functions.price_sketch import PriceSketchIndex, load_sketches
+from helper_functions.memory_store import get_memory_store
+from helper_functions.utility import model_call_queue, paginated_table
+
+from logics.renochat import chatbot_response, new_memory
+from logics import agent, answer_bank, entity_filter, rag_retrieval
+
+import pandas as pd
+
+# The datasets below are loaded once per process and shared by all sessions. With copy-on-write, a frame
+# derived from a shared one is a view until it is modified, and modifying it never changes the shared one.
+pd.set_option("mode.copy_on_write", True)
+
+
+# maximum number of points plotted on a line chart, about the width of a chart in pixels
+chart_max_points = 600
+
 
 # Declaring functions relevant for visualisation
-@st.cache_data
-def load_data(directory="./data"):
-    """This function loads all relevant datasets for visualisation
+@st.cache_resource
+def load_data(data_version):
+    """This function loads the options for the filters on the transaction details tables
+    from the analytics database once per data version. The options are shared by all sessions
+    rather than copied into each, so they are returned as tuples, which cannot be modified. The
+    transaction details themselves are queried with the applied filters.
 
     Args:
-        directory (str, optional): Directory where data files are stored. Defaults to "./data".
+        data_version (str): version of the analytics database, so that the options are reloaded when it changes
 
     Returns:
-        _type_: relevant datasets in pandas dataframe
+        dict: distinct values of each filtered field
     """
-    filelist = [
-        "1_HDBResalePriceIndex2009_2024.csv",
-        "2_HDBMedianResalePrices2020_2024.csv",
-        "3_HDBResalePricesDetailsOct23_Oct24.csv",
-        "4_CEAAgentTransactionsSep23-Sep24.csv",
-    ]
-    datalist = []
-    for file in filelist:
-        # Read in all csv data
-        df = pd.read_csv(f"{directory}/" + file)
-        datalist.append(df)
-    return datalist[0], datalist[1], datalist[2], datalist[3]
+    return {
+        "town": tuple(analytics_db.distinct_values("resale_details", "town")),
+        "month": tuple(analytics_db.distinct_values("resale_details", "month")),
+        "flat_type": tuple(analytics_db.distinct_values("resale_details", "flat_type")),
+    }
 
 
-# Load all relevant datasets for visualisation
-df1, df2, df3, df4 = load_data()
-df3["lease_commence_date"] = df3["lease_commence_date"].astype(str)
+@st.cache_resource
+def load_chart_series(data_version, max_points=chart_max_points):
+    """This function precomputes the series plotted on the 1a and 1b charts once per data version.
+    The series are shared by all sessions, so switching the chart selectors is a dictionary lookup.
+
+    Args:
+        data_version (str): version of the analytics database, so that the series are rebuilt when it changes
+        max_points (int, optional): maximum number of points on the price index line chart. Defaults to chart_max_points.
+
+    Returns:
+        tuple: downsampled price index in pandas dataframe, and median resale prices by location and by period
+    """
+    price_index = chart_data.downsample(
+        analytics_db.select_rows("price_index"), "index", max_points
+    )
+    median_series = chart_data.median_price_series(
+        analytics_db.select_rows("median_prices")
+    )
+    return price_index, median_series
+
+
+@st.cache_resource
+def load_leaderboard(data_version):
+    """This function builds the index of CEA agent transaction counts by town and month once per
+    data version. The index is shared by all sessions.
+
+    Args:
+        data_version (str): version of the analytics database, so that the index is rebuilt when it changes
+
+    Returns:
+        LeaderboardIndex: index for top-k agent and agency queries
+    """
+    return LeaderboardIndex(analytics_db.select_rows("agent_counts"))
+
+
+@st.cache_resource
+def load_price_sketches(data_version, sketch_version):
+    """This function loads the quantile sketches of resale prices by town, flat type and month
+    once per data version and version of the sketch file, building them first if they have not been
+    built. The sketches are shared by all sessions.
+
+    Args:
+        data_version (str): version of the analytics database, so that the sketches are reloaded when it changes
+        sketch_version (float): modification time of the sketch file, or None if it has not been built, so
+        that rebuilt sketches are reloaded
+
+    Returns:
+        PriceSketchIndex: index for approximate median and percentile queries
+    """
+    if not os.path.exists(data_prep.price_sketch_path):
+        data_prep.HDBresalesketches()
+    return PriceSketchIndex(load_sketches(data_prep.price_sketch_path))
 
-# Initialise memory for RenoChat in session_state
-if "chatbot_memory" not in st.session_state:
-    st.session_state["chatbot_memory"] = [{"role": "system", "content": system_msg}]
+
+# Identifies the session, whose RenoChat memory is kept in the memory store and whose model calls are scheduled fairly
+if "chatbot_session_id" not in st.session_state:
+    st.session_state["chatbot_session_id"] = str(uuid.uuid4())
+
+# Times each section of this rerun when profiling is on, see helper_functions.profiling
+profiling.start_rerun("main", st.session_state["chatbot_session_id"])
+
+# Load all relevant datasets for visualisation
+with profiling.section("load data"):
+    data_version = analytics_db.data_version()
+    filter_options = load_data(data_version)
+    price_index, median_series = load_chart_series(data_version)
+    leaderboard = load_leaderboard(data_version)
+    price_sketches = load_price_sketches(
+        data_version,
+        os.path.getmtime(data_prep.price_sketch_path) if os.path.exists(data_prep.price_sketch_path) else None,
+    )
 
 st.markdown(
     "### Need help with buying HDB resale flats? You may find the following 3 tools useful 😃"
@@ -73,21 +173,14 @@ st.markdown(
 
 st.markdown("#### 1. ResaleStats - Your Insightful Data Illustrator")
 
-# Divide real estate into 2 columns
-col_topleft, col_topright = st.columns(2, gap="medium")
+# Each panel with its own widgets is a fragment, so that a widget change or form submit in a panel
+# reruns only that panel. State shared between panels is kept in session state under explicit keys.
 
-# on the left
-with col_topleft:
-    # line chart
-    st.write("**1a. HDB Resale Price Index from 2004Q1 (index=100 in 2009Q1)**")
-    st.line_chart(df1, x="quarter", y="index", x_label="quarter", y_label="Price Index")
 
-# on the right
-with col_topright:
-    # bar chart
-    st.write(
-        "**1b. HDB Median Resale Prices($), by flat types**"
-    )
+@st.fragment
+@profiling.profiled("1b median prices")
+def median_price_panel():
+    """This function displays the 1b chart of median resale prices, by location or by period"""
     # radio buttons to select either by location or period
     period_location = st.radio(
         "2) Filter HDB median resale prices by: ",
@@ -102,72 +195,75 @@ with col_topright:
     # if location is selected
     if period_location == "Location":
         loc_value = st.selectbox(
-            "Select a location", df2.town.unique().tolist(), key="loc_selector"
+            "Select a location", list(median_series["Location"]), key="loc_selector"
         )
         st.bar_chart(
-            df2[df2["town"] == loc_value],
-            x="quarter",
-            y="price",
+            median_series["Location"][loc_value],
+            x_label="quarter",
             y_label="price($)",
-            color="flat_type",
             stack=False,
         )
     else:
         period_value = st.selectbox(
-            "Select a time period", df2.quarter.unique().tolist(), key="period_selector"
+            "Select a time period", list(median_series["Period"]), key="period_selector"
         )
         st.bar_chart(
-            df2[df2["quarter"] == period_value],
-            x="town",
-            y="price",
+            median_series["Period"][period_value],
+            x_label="town",
             y_label="price($)",
-            color="flat_type",
             stack=False,
         )
 
-st.divider()
 
-st.write("*The following location filter applies to both tables in 1c and 1d*")
-townoptions = st.multiselect(
-    "Select the location(s)",
-    options=df3.town.unique().tolist(),
-    default=df3.town.unique().tolist(),
-    key="town_selector",
-)
+@st.fragment
+@profiling.profiled("1c details")
+def resale_details_panel(townoptions):
+    """This function displays the 1c filters, price percentiles and table of HDB resale transaction details.
+    The applied filters are kept in session state for the chat panel.
 
-# Divide real estate into 2 columns
-col_midleft, col_midright = st.columns(2, gap="medium")
-
-with col_midleft:
-    st.write("**1c. HDB Resale Transaction Details (Oct 2023-Oct 2024)**")
+    Args:
+        townoptions (list): towns selected in the location filter
+    """
     fieldoptions = st.multiselect(
         "Select the fields to be displayed",
-        options=df3.columns.tolist(),
-        default=df3.columns.tolist(),
+        options=analytics_db.table_columns["resale_details"],
+        default=analytics_db.table_columns["resale_details"],
         key="field_selector",
     )
     monthoptions = st.multiselect(
         "Select the time period(s)",
-        options=df3.month.unique().tolist(),
-        default=df3.month.unique().tolist(),
+        options=filter_options["month"],
+        default=filter_options["month"],
         key="month_selector",
     )
     flatoptions = st.multiselect(
         "Select the flat type(s)",
-        options=df3.flat_type.unique().tolist(),
-        default=df3.flat_type.unique().tolist(),
+        options=filter_options["flat_type"],
+        default=filter_options["flat_type"],
         key="flat_selector",
     )
-    # Subset HDB Resale Transaction Details dataset based on applied filters
-    df3_filter = df3[
-        (df3["month"].isin(monthoptions))
-        & (df3["town"].isin(townoptions))
-        & df3["flat_type"].isin(flatoptions)
-    ]
-    # display HDB Resale Transaction Details data as table visualisation
-    st.dataframe(df3_filter, column_order=fieldoptions, key="pricedetails_df")
-
-    # Widget for chatting with HDB Resale Transaction Details data
+    # Filters on HDB Resale Transaction Details dataset
+    df3_filters = {"month": monthoptions, "town": townoptions, "flat_type": flatoptions}
+    st.session_state["df3_filters"] = df3_filters
+    # approximate resale price percentiles of the filtered transactions, from the price sketches
+    p25, p50, p75 = price_sketches.quantiles(
+        (0.25, 0.5, 0.75), towns=townoptions, flat_types=flatoptions, months=monthoptions
+    )
+    col_p25, col_p50, col_p75 = st.columns(3)
+    for col, label, value in [
+        (col_p25, "25th percentile price", p25),
+        (col_p50, "Median price", p50),
+        (col_p75, "75th percentile price", p75),
+    ]:
+        col.metric(label, "-" if value is None else f"${value:,.0f}")
+    # display HDB Resale Transaction Details data as paginated table visualisation
+    paginated_table("resale_details", df3_filters, fieldoptions, key="pricedetails")
+
+
+@st.fragment
+@profiling.profiled("1c chat")
+def resale_details_chat_panel():
+    """This function displays the 1c widget for chatting with the filtered HDB resale transaction details"""
     form = st.form(key="ResaleTxnDetails")
     form.write("Chat with your data!")
     user_query_HDB = form.text_area(
@@ -179,29 +275,90 @@ with col_midleft:
     if form.form_submit_button("Submit"):
         st.toast(f"Query Submitted - {user_query_HDB}")
         with st.spinner("Fetching results..."):
-            # response from data query agent
-            response_HDB = agent.LLM_query_df(
-                user_query_HDB, df3_filter, agent.system_msg_HDB
+            # Query HDB Resale Transaction Details dataset based on applied filters, narrowed to the
+            # towns, flat types, flat models and period named in the query
+            df3_filters, narrowing = entity_filter.narrow_filters(
+                user_query_HDB, "resale_details", st.session_state["df3_filters"]
             )
+            # the rows are loaded by the data chat only where they are needed, so the server does not hold
+            # a copy of them per query when the worker pool is on
+            df3_source = analytics_db.select_sql("resale_details", df3_filters)
+            # response from data query agent
+            with model_call_queue("resalestats", st.session_state["chatbot_session_id"]):
+                response_HDB = agent.LLM_query_df(
+                    user_query_HDB,
+                    None,
+                    agent.system_msg_HDB,
+                    mode=os.environ.get("RESALESTATS_CHAT_MODE", "agent"),
+                    source=df3_source,
+                    narrowing=narrowing,
+                )
             st.write(response_HDB)
 
-with col_midright:
-    st.write("**1d. CEA Agent Transaction Details (Sep 2023-Sep 2024)**")
-    # Subset CEA Agent Transaction Details dataset based on applied town filter
-    df4_filter = df4[df4["town"].isin(townoptions)]
-    # display CEA Agent Transaction Details data as table visualisation
-    st.dataframe(
-        df4_filter,
-        column_order=[
+
+@st.fragment
+@profiling.profiled("1d details")
+def agent_details_panel(townoptions):
+    """This function displays the 1d table of CEA agent transaction details, subsetted by the location filter
+
+    Args:
+        townoptions (list): towns selected in the location filter
+    """
+    paginated_table(
+        "agent_txn",
+        {"town": townoptions},
+        [
             "resale_transaction_date",
             "town",
             "sales_agent_name",
             "real_estate_company_name",
         ],
-        key="CEAdetails_df",
+        key="CEAdetails",
     )
-    
-    # Widget for chatting with CEA Agent Transaction Details data
+
+
+@st.fragment
+@profiling.profiled("1d leaderboards")
+def leaderboard_panel(townoptions):
+    """This function displays the leaderboards of agents and agencies with the most transactions in the
+    selected towns and months
+
+    Args:
+        townoptions (list): towns selected in the location filter
+    """
+    start_month, end_month = st.select_slider(
+        "Leaderboard period",
+        options=leaderboard.months,
+        value=(leaderboard.months[0], leaderboard.months[-1]),
+        key="leaderboard_period",
+    )
+    top_k = st.number_input(
+        "Leaderboard size", min_value=1, max_value=50, value=5, key="leaderboard_size"
+    )
+    col_agents, col_agencies = st.columns(2)
+    col_agents.write("*Top sales agents*")
+    col_agents.dataframe(
+        leaderboard.top_k("agent", townoptions, start_month, end_month, top_k),
+        column_order=["sales_agent_name", "real_estate_company_name", "transactions"],
+        hide_index=True,
+        key="agent_leaderboard",
+    )
+    col_agencies.write("*Top real estate companies*")
+    col_agencies.dataframe(
+        leaderboard.top_k("agency", townoptions, start_month, end_month, top_k),
+        hide_index=True,
+        key="agency_leaderboard",
+    )
+
+
+@st.fragment
+@profiling.profiled("1d chat")
+def agent_details_chat_panel(townoptions):
+    """This function displays the 1d widget for chatting with the CEA agent transaction details
+
+    Args:
+        townoptions (list): towns selected in the location filter
+    """
     form = st.form(key="CEAAgentTxnDetails")
     form.write("Chat with your data!")
     user_query_CEA = form.text_area(
@@ -213,76 +370,165 @@ with col_midright:
     if form.form_submit_button("Submit"):
         st.toast(f"Query Submitted - {user_query_CEA}")
         with st.spinner("Fetching results..."):
-            response_CEA = agent.LLM_query_df(
-                user_query_CEA, df4_filter, agent.system_msg_CEA, flag=False
+            # Query CEA Agent Transaction Details dataset based on applied town filter, narrowed to the
+            # towns, agents, agencies and period named in the query
+            df4_filters, narrowing = entity_filter.narrow_filters(
+                user_query_CEA, "agent_txn", {"town": townoptions}
             )
+            # the rows are loaded by the data chat only where they are needed, so the server does not hold
+            # a copy of them per query when the worker pool is on
+            df4_source = analytics_db.select_sql("agent_txn", df4_filters)
+            with model_call_queue("resalestats", st.session_state["chatbot_session_id"]):
+                response_CEA = agent.LLM_query_df(
+                    user_query_CEA,
+                    None,
+                    agent.system_msg_CEA,
+                    flag=False,
+                    mode=os.environ.get("RESALESTATS_CHAT_MODE", "agent"),
+                    source=df4_source,
+                    narrowing=narrowing,
+                )
             st.write(response_CEA)
 
-st.divider()
 
-form = st.form(key="ResaleSmartSearch")
-form.markdown("#### 2. ResaleSearch-Your Intelligent Q&A Partner")
+@st.fragment
+@profiling.profiled("ResaleSearch")
+def resale_search_panel():
+    """This function displays ResaleSearch, the Q&A tool on HDB resale terms and conditions"""
+    form = st.form(key="ResaleSmartSearch")
+    form.markdown("#### 2. ResaleSearch-Your Intelligent Q&A Partner")
 
-user_prompt_search = form.text_area(
-    """Unsure about specific HDB resale terms and conditions, CPF housing grants for resale flats
+    user_prompt_search = form.text_area(
+        """Unsure about specific HDB resale terms and conditions, CPF housing grants for resale flats
     or expenses to prepare when becoming homeowner? Try searching here:\n
     Sample queries:
-    - What are the details regarding the option fee and option period when purchasing a resale HDB flat?
-    - What are the terms and conditions for obtaining a housing loan from HDB for a resale flat?
-    - Can I cancel my HDB resale application?
-    - How is property tax calculated?
-    - What is the buyer stamp duty for purchasing an HDB resale flat?
-    - What is the maximum household income to qualify for CPF housing grants?
-    """,
-    height=200,
-    key="ResaleSmartSearch_text",
-)
-# When the rephrase query button is pressed
-if form.form_submit_button("Try rephrasing query with AI"):
-    with st.spinner("Generating query for your consideration"):
-        st.write(rag_retrieval.query_rewrite(user_prompt_search, temperature=0.8))
-if form.form_submit_button("Submit"):
-    st.toast(f"Query Submitted - {user_prompt_search}")
-    with st.spinner("Fetching results..."):
-        response, sources = rag_retrieval.retrievalQA(
-            user_prompt_search,
-            rag_retrieval.embeddings_model,
-            rag_retrieval.system_msg_search,
-            rag_retrieval.llm_,
-        )
-        st.write(response)
-        st.divider()
-        # if the user query is malicious or unrelated to the subject matter, do nothing
-        if sources is None or "I am sorry but I don't know" in response or len(sources) == 0:
-            pass
-        else:
-            with st.expander("*Expand to see sources*"):
-                for i, source in enumerate(sources):
-                    # to prevent streamlit from showing anything between $ signs as Latex when not intended to.
-                    retrieved_context = dict(source)['page_content'].replace("$", "\\$")
-                    st.write(
-                        f"""*Source {i+1}*:  **Page {dict(source)['metadata']['source']}**,\
-                            \n"{retrieved_context}" """
-                    )
-                    st.divider()
-
-form = st.form(key="renochatform")
-form.markdown("#### 3. RenoChat-Your Friendly Renovation Assistant")
-
-user_prompt_chat = form.text_area(
-    """Pose your renovation related queries here and the assistant\
+"""
+        + "".join(f"    - {query}\n" for query in answer_bank.sample_queries)
+        + "    ",
+        height=200,
+        key="ResaleSmartSearch_text",
+    )
+    # When the rephrase query button is pressed
+    if form.form_submit_button("Try rephrasing query with AI"):
+        with st.spinner("Generating query for your consideration"), model_call_queue(
+            "resalesearch", st.session_state["chatbot_session_id"]
+        ):
+            st.write(rag_retrieval.query_rewrite(user_prompt_search, temperature=0.8))
+    if form.form_submit_button("Submit"):
+        st.toast(f"Query Submitted - {user_prompt_search}")
+        with st.spinner("Fetching results..."):
+            with model_call_queue("resalesearch", st.session_state["chatbot_session_id"]):
+                response, sources = rag_retrieval.retrievalQA(
+                    user_prompt_search,
+                    rag_retrieval.get_embeddings_model(),
+                    rag_retrieval.system_msg_search,
+                    rag_retrieval.get_llm(),
+                )
+            st.write(response)
+            st.divider()
+            # if the user query is malicious or unrelated to the subject matter, do nothing
+            if sources is None or "I am sorry but I don't know" in response or len(sources) == 0:
+                pass
+            else:
+                with st.expander("*Expand to see sources*"):
+                    for i, source in enumerate(sources):
+                        # to prevent streamlit from showing anything between $ signs as Latex when not intended to.
+                        retrieved_context = dict(source)['page_content'].replace("$", "\\$")
+                        st.write(
+                            f"""*Source {i+1}*:  **Page {dict(source)['metadata']['source']}**,\
+                                \n"{retrieved_context}" """
+                        )
+                        st.divider()
+
+
+@st.fragment
+@profiling.profiled("RenoChat")
+def renochat_panel():
+    """This function displays RenoChat, the renovation assistant"""
+    form = st.form(key="renochatform")
+    form.markdown("#### 3. RenoChat-Your Friendly Renovation Assistant")
+
+    user_prompt_chat = form.text_area(
+        """Pose your renovation related queries here and the assistant\
     will provide you with curated answers sourced from internet.
     (NB: the assistant has been told not to entertain any\
     non-renovation related queries) :""",
-    height=200,
-    key="renochatform_text",
+        height=200,
+        key="renochatform_text",
+    )
+
+    if form.form_submit_button("Submit"):
+        st.toast(f"Query Submitted - {user_prompt_chat}")
+        with st.spinner("Fetching results..."):
+            # Load memory for RenoChat from the memory store, initialising it for new sessions
+            memory_store = get_memory_store()
+            memory_mode = os.environ.get("RENOCHAT_MEMORY_MODE", "summary")
+            memory = memory_store.get(
+                st.session_state["chatbot_session_id"], new_memory(memory_mode)
+            )
+            with model_call_queue("renochat", st.session_state["chatbot_session_id"]):
+                response, memory = chatbot_response(
+                    user_prompt_chat,
+                    memory,
+                    st.session_state["chatbot_session_id"],
+                    memory_mode=memory_mode,
+                )
+            memory_store.put(st.session_state["chatbot_session_id"], memory)
+            st.write(response)
+
+
+# Divide real estate into 2 columns
+col_topleft, col_topright = st.columns(2, gap="medium")
+
+# on the left
+with col_topleft, profiling.section("1a price index"):
+    # line chart
+    st.write("**1a. HDB Resale Price Index from 2004Q1 (index=100 in 2009Q1)**")
+    st.line_chart(
+        price_index, x="quarter", y="index", x_label="quarter", y_label="Price Index"
+    )
+
+# on the right
+with col_topright:
+    # bar chart
+    st.write(
+        "**1b. HDB Median Resale Prices($), by flat types**"
+    )
+    median_price_panel()
+
+st.divider()
+
+# The location filter is shared by 1c and 1d, so changing it reruns the whole page
+st.write("*The following location filter applies to both tables in 1c and 1d*")
+townoptions = st.multiselect(
+    "Select the location(s)",
+    options=filter_options["town"],
+    default=filter_options["town"],
+    key="town_selector",
 )
 
-if form.form_submit_button("Submit"):
-    st.toast(f"Query Submitted - {user_prompt_chat}")
-    with st.spinner("Fetching results..."):
-        response, memory = chatbot_response(
-            user_prompt_chat, st.session_state["chatbot_memory"]
-        )
-        st.session_state["chatbot_memory"] = memory
-        st.write(response)
+# Divide real estate into 2 columns
+col_midleft, col_midright = st.columns(2, gap="medium")
+
+with col_midleft:
+    st.write("**1c. HDB Resale Transaction Details (Oct 2023-Oct 2024)**")
+    resale_details_panel(townoptions)
+    # Widget for chatting with HDB Resale Transaction Details data
+    resale_details_chat_panel()
+
+with col_midright:
+    st.write("**1d. CEA Agent Transaction Details (Sep 2023-Sep 2024)**")
+    # display CEA Agent Transaction Details data, subsetted by applied town filter, as paginated table visualisation
+    agent_details_panel(townoptions)
+    # Leaderboards of agents and agencies with the most transactions in the selected towns and months
+    leaderboard_panel(townoptions)
+    # Widget for chatting with CEA Agent Transaction Details data
+    agent_details_chat_panel(townoptions)
+
+st.divider()
+
+resale_search_panel()
+
+renochat_panel()
+
+profiling.end_rerun()
@@ -0,0 +1,109 @@
+import os
+import sys
+
+import pytest
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository)
+
+from helper_functions import analytics_db  # noqa: E402
+from logics import entity_filter  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def in_repository(monkeypatch):
+    # the analytics database is found at ./data from the repository root
+    monkeypatch.chdir(repository)
+
+
+@pytest.fixture
+def resale_filters(in_repository):
+    return {
+        field: analytics_db.distinct_values("resale_details", field) for field in ["town", "month", "flat_type"]
+    }
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "How does Bishan rank among all towns",
+        "Which towns are cheaper than Bishan?",
+        "What fraction of 4 room sales were in Sengkang?",
+        "What percentage of Model A flats were sold in Punggol?",
+        "How do prices in Bishan compare with other towns?",
+    ],
+)
+def test_questions_reaching_beyond_named_entities_are_not_narrowed(question, resale_filters):
+    narrowed, narrowing = entity_filter.narrow_filters(question, "resale_details", resale_filters)
+    assert narrowed == resale_filters
+    assert narrowing is None
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Which towns are cheaper than Bishan for 4 room flats?",
+        "Which town has the most 4 room transactions, Bishan or Tampines?",
+        "How does Bishan rank for 4 room flats?",
+    ],
+)
+def test_only_the_ranked_field_is_not_narrowed(question, resale_filters):
+    narrowed, narrowing = entity_filter.narrow_filters(question, "resale_details", resale_filters)
+    assert narrowed["town"] == resale_filters["town"]
+    assert narrowed["flat_type"] == ["4 ROOM"]
+    assert "town" not in narrowing
+
+
+def test_ranking_within_a_named_town_is_narrowed_to_it(resale_filters):
+    narrowed, narrowing = entity_filter.narrow_filters(
+        "average price of each flat type in Bishan", "resale_details", resale_filters
+    )
+    assert narrowed["town"] == ["BISHAN"]
+    assert narrowed["flat_type"] == resale_filters["flat_type"]
+    assert "town in (BISHAN)" in narrowing
+
+
+def test_top_agents_in_a_named_town_are_narrowed_to_it():
+    filters = {"town": analytics_db.distinct_values("agent_txn", "town")}
+    for question in ["top 3 agents in Tampines", "Who are the top 3 sales agent for Tampines since March?"]:
+        narrowed, narrowing = entity_filter.narrow_filters(question, "agent_txn", filters)
+        assert narrowed["town"] == ["TAMPINES"]
+        assert "town in (TAMPINES)" in narrowing
+
+
+@pytest.mark.parametrize(
+    "question",
+    ["flats with lease commencing in 2024", "3 room flats built before 1990", "lease commence date 1985"],
+)
+def test_dates_of_other_fields_are_not_the_sale_period(question, resale_filters):
+    narrowed, _ = entity_filter.narrow_filters(question, "resale_details", resale_filters)
+    assert narrowed["month"] == resale_filters["month"]
+
+
+def test_sale_period_is_kept_next_to_date_of_other_field(resale_filters):
+    narrowed, _ = entity_filter.narrow_filters(
+        "4 room flats in Bishan built before 1990 sold in 2024", "resale_details", resale_filters
+    )
+    assert narrowed["town"] == ["BISHAN"]
+    assert {month[:4] for month in narrowed["month"]} == {"2024"}
+
+
+def test_alternative_flat_models_are_all_kept(resale_filters):
+    narrowed, _ = entity_filter.narrow_filters("Standard model or Improved?", "resale_details", resale_filters)
+    assert sorted(narrowed["flat_model"]) == ["Improved", "Standard"]
+
+
+def test_ordinary_word_alone_is_not_a_flat_model(resale_filters):
+    narrowed, _ = entity_filter.narrow_filters("Have prices improved in Bishan?", "resale_details", resale_filters)
+    assert "flat_model" not in narrowed
+    assert narrowed["town"] == ["BISHAN"]
+
+
+def test_targeted_question_is_narrowed_and_described(resale_filters):
+    narrowed, narrowing = entity_filter.narrow_filters(
+        "What is the average price of 4 room flats in Bishan since March?", "resale_details", resale_filters
+    )
+    assert narrowed["town"] == ["BISHAN"]
+    assert narrowed["flat_type"] == ["4 ROOM"]
+    assert narrowed["month"] == [month for month in resale_filters["month"] if "2024-03" <= month <= "2024-10"]
+    assert "town in (BISHAN)" in narrowing